@@ -0,0 +1,287 @@
+"""Async versions of the read-heavy db.py queries for the ASGI app (asgi.py).
+
+Queries are built by the same helpers as their db.py counterparts and cached
+under the same keys, so the sync and async paths return identical results and
+writes made through db.py invalidate what is cached here. Connections come
+from aiomysql pools of their own, one per shard, sized separately from the
+sync pools. Managers are routed to their shard through db.py's directory
+cache.
+
+Like db.py's read_only_request routes, handlers marked with
+asgi.read_only_request read shard 0 from the DB_REPLICA_HOSTS replicas, held
+to the same DB_REPLICA_* limits as db.replicas, and fall back to the primary
+when none is usable. What they read from a replica is served from the cache
+but never stored in it.
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from cache import manager_cache
+from metrics import record_query, record_rows
+from passwords import verify_password_async
+from throttle import login_throttle
+from db import (shard_configs, cached_manager_shard, remember_manager_shard, SHARDED, MAIN_SHARD,
+                MANAGER_SHARD_QUERY, _customers_page_query, _payments_page_query, _payments_export_query, _next_page,
+                _payment_cursor, _email_counts, CUSTOMER_EXPORT_QUERY, EMAIL_STATUS_QUERY,
+                MANAGER_LOGIN_QUERY, MANAGER_REHASH_QUERY, replica_addresses, replicas, _replica_config,
+                _rehash_allowed)
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+# Async pool settings; one pool per shard and event loop (i.e. per uvicorn worker)
+async_pool_config = {
+    'minsize': int(os.getenv('ASYNC_DB_POOL_MIN', 1)),
+    'maxsize': int(os.getenv('ASYNC_DB_POOL_SIZE', 20)),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 3600)),
+}
+ASYNC_DB_POOL_TIMEOUT = float(os.getenv('ASYNC_DB_POOL_TIMEOUT', os.getenv('DB_POOL_TIMEOUT', 10)))
+
+DB_ERRORS = (OSError, asyncio.TimeoutError) + ((aiomysql.Error,) if aiomysql else ())
+
+# Pools by shard number, and by address for the replicas
+_pools = {}
+_pool_lock = None
+
+# Set while a handler marked with asgi.read_only_request runs for a session that may read from a replica
+replica_allowed = contextvars.ContextVar('aiodb_replica_allowed', default=False)
+
+class _Replica:
+    def __init__(self, address):
+        self.address = address
+        self.config = _replica_config(address)
+        self.down_until = 0.0
+        self.lag = None
+        self.checked_at = float('-inf')
+
+_replicas = [_Replica(address) for address in replica_addresses]
+_replica_rotation = itertools.count()
+
+async def _open_pool(key, config):
+    global _pool_lock
+    if aiomysql is None:
+        raise RuntimeError("The async app needs the aiomysql package")
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if key not in _pools:
+            _pools[key] = await aiomysql.create_pool(
+                host=config['host'],
+                port=config['port'],
+                user=config['user'],
+                password=config['password'],
+                db=config['database'],
+                autocommit=True,
+                init_command=f"SET time_zone = '{config['time_zone']}'",
+                **async_pool_config
+            )
+        return _pools[key]
+
+async def get_pool(shard=MAIN_SHARD):
+    return await _open_pool(shard, shard_configs[shard])
+
+async def close_pool():
+    while _pools:
+        _, pool = _pools.popitem()
+        pool.close()
+        await pool.wait_closed()
+
+def get_pool_stats():
+    """Totals over the pools of every shard opened so far."""
+    pools = list(_pools.values())
+    return {
+        'size': sum(pool.size for pool in pools),
+        'free': sum(pool.freesize for pool in pools),
+        'max': async_pool_config['maxsize'] * max(len(pools), 1),
+    }
+
+def _reads_primary():
+    """db._reads_primary for the async reads: only results read from the primary may fill the cache."""
+    return not (_replicas and replica_allowed.get())
+
+async def _measure_lag(conn):
+    """ReplicaRouter._measure_lag on an aiomysql connection."""
+    async with conn.cursor(aiomysql.DictCursor) as cursor:
+        try:
+            await cursor.execute("SHOW REPLICA STATUS")
+        except aiomysql.Error:
+            # Servers before MySQL 8.0.22 only know the old name
+            await cursor.execute("SHOW SLAVE STATUS")
+        row = await cursor.fetchone()
+    if row is None:
+        return 0 if replicas.allow_standalone else None
+    return row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+
+async def _replica_connection():
+    """Return (pool, connection) of the next usable replica in turn, or (None, None) to use the primary."""
+    start = next(_replica_rotation)
+    for i in range(len(_replicas)):
+        replica = _replicas[(start + i) % len(_replicas)]
+        if time.monotonic() < replica.down_until:
+            continue
+        try:
+            pool = await _open_pool(replica.address, replica.config)
+            if not pool.freesize and pool.size >= pool.maxsize:
+                # Busy rather than down, so it is only skipped for this read
+                continue
+            conn = await asyncio.wait_for(pool.acquire(), ASYNC_DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            continue
+        except DB_ERRORS as e:
+            print(f"Replica {replica.address} unavailable: {str(e)}")
+            replica.down_until = time.monotonic() + replicas.retry_after
+            continue
+        try:
+            if time.monotonic() - replica.checked_at >= replicas.check_interval:
+                replica.lag = await _measure_lag(conn)
+                replica.checked_at = time.monotonic()
+        except DB_ERRORS as e:
+            print(f"Replica {replica.address} unavailable: {str(e)}")
+            replica.down_until = time.monotonic() + replicas.retry_after
+            pool.release(conn)
+            continue
+        if replica.lag is not None and replica.lag <= replicas.max_lag:
+            return pool, conn
+        pool.release(conn)
+    return None, None
+
+@asynccontextmanager
+async def connection(shard=MAIN_SHARD, read_only=False):
+    """Check a connection to `shard` out of its pool, waiting at most ASYNC_DB_POOL_TIMEOUT.
+
+    `read_only` connections to shard 0 come from a usable replica when there is one.
+    """
+    pool = conn = None
+    if read_only and shard == MAIN_SHARD and _replicas:
+        pool, conn = await _replica_connection()
+    if conn is None:
+        pool = await get_pool(shard)
+        conn = await asyncio.wait_for(pool.acquire(), ASYNC_DB_POOL_TIMEOUT)
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+async def _execute(cursor, statement, query, params):
+    # Timed under the db.py function name, so sync and async queries share a series
+    started = time.perf_counter()
+    try:
+        await cursor.execute(query, params)
+    finally:
+        record_query(statement, time.perf_counter() - started)
+
+async def _fetchall(statement, query, params, shard=MAIN_SHARD, use_replica=False):
+    async with connection(shard, use_replica) as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await _execute(cursor, statement, query, params)
+            rows = await cursor.fetchall()
+    record_rows(statement, len(rows))
+    return list(rows)
+
+async def manager_shard(manager_id):
+    """db.manager_shard without blocking the event loop; returns the shard only."""
+    if not SHARDED:
+        return MAIN_SHARD
+    location = cached_manager_shard(manager_id)
+    if location is None:
+        rows = await _fetchall('manager_shard', MANAGER_SHARD_QUERY, (manager_id,))
+        location = remember_manager_shard(manager_id, (rows[0]['shard'], rows[0]['frozen']) if rows else None)
+    return location[0]
+
+async def get_manager_by_email_and_password(email, password):
+    # Emails recently found to have no account skip both the query and bcrypt
+    if await login_throttle.off_loop(login_throttle.is_unknown_email, email):
+        return None
+    try:
+        rows = await _fetchall('get_manager_by_email_and_password', MANAGER_LOGIN_QUERY, (email,))
+    except DB_ERRORS as e:
+        print(f"Error fetching manager: {str(e)}")
+        return None
+    if not rows:
+        await login_throttle.off_loop(login_throttle.remember_unknown_email, email)
+        return None
+    manager = rows[0]
+    # The connection is back in the pool while bcrypt runs
+    matches, new_hash = await verify_password_async(manager['password'], password)
+    if not matches:
+        return None
+    # frozen_managers() may query shard 0, so the check runs on a worker thread
+    if new_hash and await asyncio.to_thread(_rehash_allowed, manager['id']):
+        # The cost factor changed since this hash was stored; save the upgraded hash
+        try:
+            async with connection() as conn:
+                async with conn.cursor() as cursor:
+                    await _execute(cursor, 'get_manager_by_email_and_password', MANAGER_REHASH_QUERY, (new_hash, manager['id']))
+        except DB_ERRORS as e:
+            print(f"Error saving upgraded password hash: {str(e)}")
+    return manager
+
+@manager_cache.cached('customers_page', cache_if=lambda result: result[0] is not None,
+                      fill_when=_reads_primary)
+async def get_customers_page(manager_id, sort='box_number', direction='asc', search=None, status=None,
+                             balance=None, balance_op=None, cursor=None, limit=50):
+    query, params, sort = _customers_page_query(manager_id, sort, direction, search, status, balance, balance_op, cursor, limit)
+    try:
+        rows = await _fetchall('get_customers_page', query, params, await manager_shard(manager_id), replica_allowed.get())
+    except DB_ERRORS as e:
+        print(f"Error fetching customers page: {str(e)}")
+        return None, None
+    return _next_page(rows, limit, lambda last: [last[sort], last['id']])
+
+@manager_cache.cached('payments_page', cache_if=lambda result: result[0] is not None,
+                      fill_when=_reads_primary)
+async def get_payments_page(manager_id, status=None, customer_id=None, mobile_number=None, start_date=None,
+                            end_date=None, direction='desc', cursor=None, limit=50):
+    query, params = _payments_page_query(manager_id, status, customer_id, mobile_number, start_date, end_date, direction, cursor, limit)
+    try:
+        rows = await _fetchall('get_payments_page', query, params, await manager_shard(manager_id), replica_allowed.get())
+    except DB_ERRORS as e:
+        print(f"Error fetching payments page: {str(e)}")
+        return None, None
+    return _next_page(rows, limit, _payment_cursor)
+
+async def get_email_status_counts(manager_id):
+    try:
+        rows = await _fetchall('get_email_status_counts', EMAIL_STATUS_QUERY, (manager_id,), await manager_shard(manager_id),
+                               replica_allowed.get())
+    except DB_ERRORS as e:
+        print(f"Error fetching email status: {str(e)}")
+        return None
+    return _email_counts(rows)
+
+async def _stream_rows(statement, query, params, batch_size, manager_id, use_replica=False):
+    """Yield rows from an unbuffered cursor on the manager's shard; see db._stream_rows.
+
+    A connection abandoned part way through its result set is closed rather
+    than returned to the pool. `use_replica` is decided when the export is
+    requested, since the rows are only read once the handler has returned.
+    """
+    async with connection(await manager_shard(manager_id), use_replica) as conn:
+        cursor = await conn.cursor(aiomysql.SSDictCursor)
+        try:
+            await _execute(cursor, statement, query, params)
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                record_rows(statement, len(rows))
+                for row in rows:
+                    yield row
+        except BaseException:
+            # Unread rows are still on the wire, so the connection cannot be reused
+            conn.close()
+            raise
+        await cursor.close()
+
+def iter_customers(manager_id, batch_size=1000):
+    return _stream_rows('iter_customers', CUSTOMER_EXPORT_QUERY, (manager_id,), batch_size, manager_id, replica_allowed.get())
+
+def iter_payments(manager_id, status=None, customer_id=None, mobile_number=None, start_date=None,
+                  end_date=None, direction='desc', batch_size=1000):
+    query, params = _payments_export_query(manager_id, status, customer_id, mobile_number, start_date, end_date, direction)
+    return _stream_rows('iter_payments', query, params, batch_size, manager_id, replica_allowed.get())
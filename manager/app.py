@@ -1,139 +1,114 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
-from db import get_manager_by_email_and_password, get_all_customers, add_customer, update_customer, delete_customer, add_pending_manager, update_customer_balance, add_payment, get_payment_history
-from flask_bcrypt import Bcrypt
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response
+from db import get_manager_by_email_and_password, get_customer, add_customer, update_customer, delete_customer, add_pending_manager, update_customer_balance, post_payment, create_billing_run, enqueue_emails, get_email_status_counts, get_customers_page, get_payments_page, to_money, init_app, read_only_request, iter_customers, iter_payments, get_manager_summary, get_pool_stats, get_shard_pool_stats, get_replica_stats, get_import_job, PAYMENT_HISTORY_MONTHS
+from datetime import datetime
+from decimal import InvalidOperation
 from dotenv import load_dotenv
 import os
-import smtplib
-import string
-import random
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import csv
+import math
+import io
+import uuid
+import mailer
+from passwords import generate_password, hash_password, PasswordServiceBusy
+from importer import import_customers, start_import_worker, ImportTooLarge
+from cache import manager_cache
+import metrics
+import assets
+from throttle import login_throttle
+import logging
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'manager_secret_key')
-bcrypt = Bcrypt(app)
+# One pooled connection per request, returned at app context teardown
+init_app(app)
 
-# Email configuration
-EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
-EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(message)s')
 
-def generate_password(length=8):
-    """Generate a random password."""
-    characters = string.ascii_letters + string.digits + string.punctuation
-    return ''.join(random.choice(characters) for _ in range(length))
+def runtime_metrics():
+    """Pool and cache counters and gauges sampled on each /metrics scrape."""
+    pool = get_pool_stats()
+    for key in ('size', 'in_use', 'open'):
+        yield 'gauge', f'db_pool_{key}', (), pool.get(key, 0)
+    for key in ('checkouts', 'timeouts', 'connects', 'connect_errors', 'recycled', 'broken'):
+        yield 'counter', f'db_pool_{key}_total', (), pool.get(key, 0)
+    yield 'histogram', 'db_pool_wait_seconds', (), (pool['wait_buckets'], pool['wait_seconds_total'], pool['checkouts'])
+    shards = get_shard_pool_stats()
+    for kind, name, key in (('gauge', 'db_shard_pool_in_use', 'in_use'), ('gauge', 'db_shard_pool_open', 'open'),
+                            ('counter', 'db_shard_pool_timeouts_total', 'timeouts'),
+                            ('counter', 'db_shard_pool_connect_errors_total', 'connect_errors')):
+        for shard, stats in shards.items():
+            yield kind, name, (('shard', str(shard)),), stats.get(key, 0)
+    replicas = get_replica_stats()
+    if replicas is not None:
+        for key in ('reads', 'fallbacks', 'busy'):
+            yield 'counter', f'db_replica_{key}_total', (), replicas[key]
+        for kind, name, key in (('gauge', 'db_replica_down', 'down'), ('gauge', 'db_replica_lag_seconds', 'lag'),
+                                ('gauge', 'db_replica_pool_in_use', 'in_use'), ('gauge', 'db_replica_pool_open', 'open'),
+                                ('counter', 'db_replica_pool_timeouts_total', 'timeouts'),
+                                ('counter', 'db_replica_pool_connect_errors_total', 'connect_errors')):
+            for replica in replicas['replicas']:
+                value = replica[key]
+                # Lag is -1 until first measured and while replication is stopped
+                yield kind, name, (('replica', replica['name']),), -1 if value is None else int(value)
+    cache = manager_cache.stats()
+    for key in ('hits', 'misses', 'invalidations', 'errors', 'evictions'):
+        yield 'counter', f'cache_{key}_total', (('backend', cache['backend']),), cache[key]
 
-def send_email(to_email, subject, template_type, **kwargs):
-    """Send an email with a specified template type (credential or bill_notification)."""
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        if template_type == 'credential':
-            mobile_number = kwargs.get('mobile_number')
-            password = kwargs.get('password')
-            # HTML email body for account credentials with website link
-            html_body = f"""
-            <!DOCTYPE html>
-            <html>
-            <body style="font-family: Arial, sans-serif; color: #333;">
-                <div style="max-width: 600px; margin: auto; padding: 20px; border: 1px solid #ddd;">
-                    <h2 style="color: #007bff;">Welcome to Time2Due</h2>
-                    <h3>Account Created Successfully</h3>
-                    <p>Dear Customer,</p>
-                    <p>Your Time2Due account has been created successfully. Below are your login credentials:</p>
-                    <ul>
-                        <li><strong>Mobile Number:</strong> {mobile_number}</li>
-                        <li><strong>Password:</strong> {password}</li>
-                    </ul>
-                    <p><strong>Important:</strong> Please keep this information secure and do not share it with anyone.</p>
-                    <p>You can log in to your account using these credentials by visiting our website:</p>
-                    <p style="text-align: center;">
-                        <a href="https://www.time2due.com" style="display: inline-block; padding: 10px 20px; background-color: #007bff; color: #fff; text-decoration: none; border-radius: 5px;">Click Me</a>
-                    </p>
-                    <p>Regards,<br>Time2Due Team</p>
-                </div>
-            </body>
-            </html>
-            """
-        elif template_type == 'bill_notification':
-            name = kwargs.get('name')
-            amount = kwargs.get('amount')
-            # HTML email body for bill notification with enhanced styling
-            html_body = f"""
-            <!DOCTYPE html>
-            <html lang="en">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>New Bill Generated</title>
-            </head>
-            <body style="margin: 0; padding: 0; font-family: 'Arial', 'Helvetica', sans-serif; color: #333333; background-color: #f4f7fa;">
-                <table width="100%" cellpadding="0" cellspacing="0" border="0" style="background-color: #f4f7fa; padding: 20px;">
-                    <tr>
-                        <td align="center">
-                            <table width="100%" cellpadding="0" cellspacing="0" border="0" style="max-width: 600px; background-color: #ffffff; border: 1px solid #e0e0e0; border-radius: 8px; overflow: hidden;">
-                                <!-- Header -->
-                                <tr>
-                                    <td style="background-color: #007bff; padding: 20px; text-align: center;">
-                                        <!-- Logo Placeholder (Uncomment and replace src if logo is available) -->
-                                        <!-- <img src="https://www.time2due.com/logo.png" alt="Time2Due Logo" style="max-width: 150px;"> -->
-                                        <h2 style="color: #ffffff; font-size: 24px; margin: 10px 0;">New Bill Generated</h2>
-                                    </td>
-                                </tr>
-                                <!-- Content -->
-                                <tr>
-                                    <td style="padding: 30px;">
-                                        <h3 style="font-size: 20px; color: #007bff; margin: 0 0 15px;">Bill Notification</h3>
-                                        <p style="font-size: 16px; line-height: 24px; margin: 0 0 10px;">Dear {name},</p>
-                                        <p style="font-size: 16px; line-height: 24px; margin: 0 0 20px;">
-                                            A new bill Cable <strong style="color: #333333;">₹{amount:.2f}</strong> has been generated for your account.
-                                        </p>
-                                        <p style="font-size: 16px; line-height: 24px; margin: 0 0 20px;">
-                                            Please visit our website to pay your bill and keep your account active:
-                                        </p>
-                                        <!-- Call-to-Action Button -->
-                                        <p style="text-align: center; margin: 30px 0;">
-                                            <a href="https://www.time2due.com" style="display: inline-block; padding: 12px 24px; background-color: #007bff; color: #ffffff; text-decoration: none; border-radius: 5px; font-size: 16px; font-weight: bold; border: 2px solid #0056b3;">Pay Now</a>
-                                        </p>
-                                        <p style="font-size: 14px; line-height: 22px; color: #666666; margin: 0 0 10px;">
-                                            If you have any questions, please contact our support team at <a href="mailto:support@time2due.com" style="color: #007bff; text-decoration: none;">support@time2due.com</a>.
-                                        </p>
-                                    </td>
-                                </tr>
-                                <!-- Footer -->
-                                <tr>
-                                    <td style="background-color: #f8f9fa; padding: 15px; text-align: center; font-size: 12px; color: #666666; border-top: 1px solid #e0e0e0;">
-                                        <p style="margin: 0;">Regards,<br>The Time2Due Team</p>
-                                        <p style="margin: 10px 0 0;">
-                                            <a href="https://www.time2due.com" style="color: #007bff; text-decoration: none;">www.time2due.com</a>
-                                        </p>
-                                    </td>
-                                </tr>
-                            </table>
-                        </td>
-                    </tr>
-                </table>
-            </body>
-            </html>
-            """
-        else:
-            return False, "Invalid template type"
+# Per-request timing, SQL counts, JSON request logs and the /metrics endpoint
+metrics.init_app(app, samples=runtime_metrics)
+
+# Fingerprinted CSS/JS bundles under /assets and ETag revalidation of HTML pages
+assets.init_app(app)
+
+# Rows written per chunk of a streamed CSV export
+CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', 500))
 
-        # Attach the HTML body to the email
-        msg.attach(MIMEText(html_body, 'html'))
+# Run the email dispatcher inside the web process unless a standalone `python mailer.py` is used.
+# It starts with the first request, so asgi.py can switch it off for its own async dispatcher.
+app.config['EMAIL_WORKER_INLINE'] = os.getenv('EMAIL_WORKER_INLINE', '1') == '1'
 
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            server.sendmail(EMAIL_ADDRESS, to_email, msg.as_string())
-        return True, "Email sent successfully"
-    except Exception as e:
-        return False, f"Failed to send email: {str(e)}"
+@app.before_request
+def start_email_worker():
+    if app.config['EMAIL_WORKER_INLINE']:
+        mailer.start_dispatcher()
+
+# Save queued customer imports inside the web process unless a standalone `python importer.py` is used
+IMPORT_WORKER_INLINE = os.getenv('IMPORT_WORKER_INLINE', '1') == '1'
+
+@app.before_request
+def start_import_worker_inline():
+    if IMPORT_WORKER_INLINE:
+        start_import_worker()
+
+def send_email(to_email, subject, template_type, manager_id=None, **kwargs):
+    """Queue an email with a specified template type (credential or bill_notification)."""
+    return queue_emails([{
+        'manager_id': manager_id,
+        'to_email': to_email,
+        'subject': subject,
+        'template_type': template_type,
+        'payload': kwargs,
+    }])
+
+def queue_emails(emails):
+    """Queue emails for the background dispatcher instead of sending them inline."""
+    for email in emails:
+        if email['template_type'] not in ('credential', 'bill_notification'):
+            return False, "Invalid template type"
+    success, message = enqueue_emails(emails)
+    if not success:
+        return False, f"Failed to queue email: {message}"
+    return True, "Email queued successfully"
+
+@app.errorhandler(PasswordServiceBusy)
+def password_service_busy(error):
+    flash('The server is busy, please try again in a moment.', 'error')
+    if session.get('role') == 'manager':
+        return redirect(url_for('manager_dashboard'))
+    return redirect(url_for('manager_login'))
 
 # Middleware for manager authentication
 def manager_required(f):
@@ -152,7 +127,7 @@ def manager_signup():
         username = request.form['username']
         email = request.form['email']
         mobile_number = request.form['mobile_number']
-        password = bcrypt.generate_password_hash(request.form['password']).decode('utf-8')
+        password = hash_password(request.form['password'])
         success, message = add_pending_manager(username, email, mobile_number, password)
         flash(message, 'success' if success else 'error')
         if success:
@@ -165,14 +140,20 @@ def manager_login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
+        retry_after = login_throttle.retry_after(request.remote_addr, email)
+        if retry_after:
+            flash(f'Too many failed login attempts. Please try again in {math.ceil(retry_after)} seconds.', 'error')
+            return render_template('manager_login.html'), 429
         manager = get_manager_by_email_and_password(email, password)
         if manager:
+            login_throttle.reset(email)
             session['logged_in'] = True
             session['user_id'] = manager['id']
             session['role'] = 'manager'
             flash('Manager login successful!', 'success')
             return redirect(url_for('manager_dashboard'))
         else:
+            login_throttle.record_failure(request.remote_addr, email)
             flash('Invalid email or password.', 'error')
     return render_template('manager_login.html')
 
@@ -188,17 +169,110 @@ def manager_logout():
 # Manager dashboard
 @app.route('/dashboard')
 @manager_required
+@read_only_request
 def manager_dashboard():
+    # Customers and bill history are loaded page by page from /api/customers and /api/payments
+    summary = get_manager_summary(session['user_id'])
+    if summary is None:
+        flash('Failed to fetch dashboard summary.', 'error')
+    return render_template('manager_dashboard.html', summary=summary, history_months=PAYMENT_HISTORY_MONTHS)
+
+# Paginated customer listing for the dashboard
+@app.route('/api/customers')
+@manager_required
+@read_only_request
+def customers_api():
+    manager_id = session['user_id']
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        balance = request.args.get('balance')
+        balance = float(balance) if balance else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid query parameters.'}), 400
+    customers, next_cursor = get_customers_page(
+        manager_id,
+        sort=request.args.get('sort', 'box_number'),
+        direction=request.args.get('direction', 'asc'),
+        search=request.args.get('search', '').strip() or None,
+        status=request.args.get('status'),
+        balance=balance,
+        balance_op=request.args.get('balance_op'),
+        cursor=request.args.get('cursor'),
+        limit=limit
+    )
+    if customers is None:
+        return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+    return jsonify({'success': True, 'customers': customers, 'next_cursor': next_cursor}), 200
+
+def parse_date_arg(name):
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+def payment_filter_args():
+    """Bill history filters shared by /api/payments and /export/payments.csv."""
+    return {
+        'status': request.args.get('status'),
+        'customer_id': request.args.get('customer_id', type=int),
+        'mobile_number': request.args.get('mobile_number', '').strip() or None,
+        'start_date': parse_date_arg('start_date'),
+        'end_date': parse_date_arg('end_date'),
+        'direction': request.args.get('direction', 'desc'),
+    }
+
+# Paginated bill history for the dashboard
+@app.route('/api/payments')
+@manager_required
+@read_only_request
+def payments_api():
     manager_id = session['user_id']
-    customers = get_all_customers(manager_id=manager_id)
-    payments = get_payment_history(manager_id=manager_id)
-    if not customers and customers != []:
-        flash('Database connection failed!', 'error')
-        return render_template('manager_dashboard.html', customers=[], payments=[])
-    if not payments and payments != []:
-        flash('Failed to fetch payment history.', 'error')
-        payments = []
-    return render_template('manager_dashboard.html', customers=customers, payments=payments)
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+        filters = payment_filter_args()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid query parameters.'}), 400
+    payments, next_cursor = get_payments_page(manager_id, cursor=request.args.get('cursor'), limit=limit, **filters)
+    if payments is None:
+        return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+    # Results may be shared through the cache, so they are copied rather than modified
+    payments = [dict(payment, payment_date=str(payment['payment_date'])) for payment in payments]
+    return jsonify({'success': True, 'payments': payments, 'next_cursor': next_cursor}), 200
+
+def csv_response(rows, columns, filename):
+    """Stream rows as CSV, writing one chunk per CSV_CHUNK_ROWS rows."""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for count, row in enumerate(rows, 1):
+            writer.writerow([row[column] for column in columns])
+            if count % CSV_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    return Response(generate(), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Accel-Buffering': 'no',
+    })
+
+# Export customers as CSV
+@app.route('/export/customers.csv')
+@manager_required
+def export_customers():
+    columns = ['id', 'box_number', 'name', 'mobile_number', 'email', 'plan_amount', 'address', 'balance', 'created_at']
+    return csv_response(iter_customers(session['user_id']), columns, 'customers.csv')
+
+# Export bill history as CSV, with the same filters as the bill history view
+@app.route('/export/payments.csv')
+@manager_required
+def export_payments():
+    try:
+        filters = payment_filter_args()
+    except ValueError:
+        flash('Invalid export filters.', 'error')
+        return redirect(url_for('manager_dashboard'))
+    columns = ['id', 'customer_id', 'box_number', 'name', 'mobile_number', 'amount', 'payment_mode', 'payment_status', 'payment_reference', 'payment_date']
+    return csv_response(iter_payments(session['user_id'], **filters), columns, 'bill_history.csv')
 
 # Add customer
 @app.route('/add_customer', methods=['POST'])
@@ -210,7 +284,7 @@ def add_customer_route():
     email = request.form.get('email')
     # Generate a random password for the customer
     password = generate_password()
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    hashed_password = hash_password(password)
     plan_amount = request.form['plan_amount']
     address = request.form['address']
     manager_id = session['user_id']
@@ -224,13 +298,14 @@ def add_customer_route():
             to_email=email,
             subject='Your Time2Due Account Credentials',
             template_type='credential',
+            manager_id=manager_id,
             mobile_number=mobile_number,
             password=password
         )
         if not email_success:
             flash(f"Customer added, but {email_message}", 'warning')
         else:
-            flash(f"{message} and credentials sent to customer's email.", 'success')
+            flash(f"{message} and credentials email queued for the customer.", 'success')
     elif success:
         flash(message, 'success')
     else:
@@ -238,20 +313,51 @@ def add_customer_route():
     
     return redirect(url_for('manager_dashboard'))
 
+# Bulk import customers from a CSV or Excel file
+@app.route('/import_customers', methods=['POST'])
+@manager_required
+def import_customers_route():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'success': False, 'error': 'Please choose a CSV file to import.'}), 400
+    try:
+        success, message, job_id = import_customers(session['user_id'], upload)
+    except ImportTooLarge as e:
+        return jsonify({'success': False, 'error': str(e)}), 413
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'error': f"Could not read file: {str(e)}"}), 400
+    if not success:
+        return jsonify({'success': False, 'error': message}), 500
+    # The rows are saved by the import worker; the dashboard polls the status URL for progress
+    return jsonify({'success': True, 'job_id': job_id,
+                    'status_url': url_for('import_status', job_id=job_id)}), 202
+
+@app.route('/import_customers/<int:job_id>')
+@manager_required
+def import_status(job_id):
+    job = get_import_job(job_id, session['user_id'])
+    if job is None:
+        return jsonify({'success': False, 'error': 'Import not found.'}), 404
+    return jsonify({'success': True, **job})
+
 # Edit customer
 @app.route('/edit_customer/<int:customer_id>', methods=['POST'])
 @manager_required
 def edit_customer(customer_id):
+    manager_id = session['user_id']
+    if not get_customer(customer_id, manager_id):
+        flash('Customer not found.', 'error')
+        return redirect(url_for('manager_dashboard'))
     box_number = request.form['box_number']
     mobile_number = request.form['mobile_number']
     name = request.form['name']
     email = request.form.get('email')
     password = request.form.get('password')
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8') if password else None
+    hashed_password = hash_password(password) if password else None
     is_temp_password = bool(password)  # Set is_temp_password to True if a new password is provided
     plan_amount = request.form['plan_amount']
     address = request.form['address']
-    success, message = update_customer(customer_id, box_number, mobile_number, name, email, hashed_password, plan_amount, address, is_temp_password)
+    success, message = update_customer(customer_id, box_number, mobile_number, name, email, hashed_password, plan_amount, address, is_temp_password, manager_id)
     flash(message, 'success' if success else 'error')
     return redirect(url_for('manager_dashboard'))
 
@@ -259,7 +365,11 @@ def edit_customer(customer_id):
 @app.route('/delete_customer/<int:customer_id>', methods=['POST'])
 @manager_required
 def delete_customer_route(customer_id):
-    success, message = delete_customer(customer_id)
+    manager_id = session['user_id']
+    if not get_customer(customer_id, manager_id):
+        flash('Customer not found.', 'error')
+        return redirect(url_for('manager_dashboard'))
+    success, message = delete_customer(customer_id, manager_id)
     flash(message, 'success' if success else 'error')
     return redirect(url_for('manager_dashboard'))
 
@@ -268,21 +378,12 @@ def delete_customer_route(customer_id):
 @manager_required
 def add_bill(customer_id):
     manager_id = session['user_id']
-    customers = get_all_customers(manager_id=manager_id)
-    if not customers and customers != []:
-        flash('Database connection failed!', 'error')
-        return redirect(url_for('manager_dashboard'))
-    if not customers:
-        flash('No customers found.', 'error')
-        return redirect(url_for('manager_dashboard'))
-    
-    customer = next((c for c in customers if c['id'] == customer_id), None)
+    customer = get_customer(customer_id, manager_id)
     if not customer:
         flash('Customer not found.', 'error')
         return redirect(url_for('manager_dashboard'))
     
-    plan_amount = float(customer['plan_amount'])
-    success, message = update_customer_balance(customer_id, plan_amount)
+    success, message = update_customer_balance(customer_id, customer['plan_amount'], entry_type='bill')
     flash(message, 'success' if success else 'error')
     return redirect(url_for('manager_dashboard'))
 
@@ -291,72 +392,51 @@ def add_bill(customer_id):
 @manager_required
 def add_all_bills():
     manager_id = session['user_id']
-    customers = get_all_customers(manager_id=manager_id)
-    if not customers and customers != []:
-        flash('Database connection failed!', 'error')
-        return redirect(url_for('manager_dashboard'))
-    
-    if not customers:
+    # The dashboard form carries a run key so a resubmitted request is not billed twice
+    run_key = request.form.get('run_key') or uuid.uuid4().hex
+    # Bills and their notifications are processed by the billing worker (billing.py)
+    success, message, customer_count = create_billing_run(manager_id, run_key)
+    if not success:
+        flash(message, 'error')
+    elif not customer_count:
         flash('No customers found.', 'error')
-        return redirect(url_for('manager_dashboard'))
-    
-    success_count = 0
-    email_success_count = 0
-    email_failures = []
-    
-    for customer in customers:
-        plan_amount = float(customer['plan_amount'])
-        success, message = update_customer_balance(customer['id'], plan_amount)
-        if success:
-            success_count += 1
-            # Send bill notification email if customer has an email
-            if customer.get('email'):
-                email_success, email_message = send_email(
-                    to_email=customer['email'],
-                    subject='New Bill Generated for Your Time2Due Account',
-                    template_type='bill_notification',
-                    name=customer['name'],
-                    amount=plan_amount
-                )
-                if email_success:
-                    email_success_count += 1
-                else:
-                    email_failures.append(f"{customer['name']} ({customer['email']}): {email_message}")
-    
-    flash(f'Bills added successfully for {success_count} customers.', 'success')
-    if email_success_count > 0:
-        flash(f'Bill notifications sent to {email_success_count} customers.', 'success')
-    if email_failures:
-        flash(f"Failed to send emails to {len(email_failures)} customers: {'; '.join(email_failures)}", 'warning')
-    
+    elif message == 'Billing run already processed':
+        flash(message, 'warning')
+    else:
+        flash(f'Billing queued for {customer_count} customers; bills and notifications will go out shortly.', 'success')
     return redirect(url_for('manager_dashboard'))
 
+# Email queue status for the dashboard
+@app.route('/email_status')
+@manager_required
+@read_only_request
+def email_status():
+    counts = get_email_status_counts(session['user_id'])
+    if counts is None:
+        return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+    return jsonify({'success': True, 'counts': counts}), 200
+
 # Pay offline
 @app.route('/pay_offline/<int:customer_id>', methods=['POST'])
 @manager_required
 def pay_offline(customer_id):
     manager_id = session.get('user_id')
-    customers = get_all_customers(manager_id=manager_id)
-    customer = next((c for c in customers if c['id'] == customer_id), None)
-    
-    if not customer:
-        return jsonify({'success': False, 'error': 'Customer not found.'}), 404
-    
     try:
-        amount = float(request.form.get('amount'))
+        amount = to_money(request.form.get('amount'))
         if amount <= 0:
             return jsonify({'success': False, 'error': 'Amount must be greater than zero.'}), 400
-        if amount > float(customer['balance']):
-            return jsonify({'success': False, 'error': 'Payment amount cannot exceed current balance.'}), 400
-        
-        success, message = add_payment(customer_id, manager_id, amount, 'offline', 'completed', None)
-        if not success:
-            return jsonify({'success': False, 'error': message}), 400
-        
-        success, message = update_customer_balance(customer_id, -amount)
-        return jsonify({'success': success, 'message': message, 'new_balance': customer['balance'] - amount}), 200
-    
-    except ValueError:
+    except (InvalidOperation, TypeError):
         return jsonify({'success': False, 'error': 'Invalid payment amount.'}), 400
+    
+    # The balance check happens in the same UPDATE that deducts the payment
+    success, message, new_balance = post_payment(customer_id, manager_id, amount, 'offline', 'completed', None)
+    if success:
+        return jsonify({'success': True, 'message': message, 'new_balance': new_balance}), 200
+    if message == 'Customer not found':
+        return jsonify({'success': False, 'error': 'Customer not found.'}), 404
+    if message == 'Balance cannot be negative':
+        return jsonify({'success': False, 'error': 'Payment amount cannot exceed current balance.'}), 400
+    return jsonify({'success': False, 'error': message}), 400
+
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
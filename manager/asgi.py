@@ -0,0 +1,312 @@
+"""Optional async serving mode: run the manager app under an ASGI server.
+
+    pip install aiomysql aiosmtplib starlette uvicorn a2wsgi
+    uvicorn asgi:app --workers 4 --port 5002
+
+The read-heavy paths are served by async handlers on aiodb's aiomysql pool:
+login (with bcrypt awaited on the password process pool), /api/customers,
+/api/payments, /email_status and the two CSV exports. An idle connection
+waiting on MySQL no longer holds a worker thread. Every other route, the
+dashboard HTML included, is the unchanged Flask app run on a bounded thread
+pool. Both halves read and write the same signed Flask session cookie and
+share one result cache, so a browser moves between them freely. Like their
+Flask routes, the read handlers use the read replicas unless the session is
+inside its read-your-writes window, and a shared cache or login throttle in
+Redis is reached from worker threads rather than the event loop.
+
+Queued emails are sent by mailer.AsyncEmailDispatcher on the event loop
+instead of the thread-based dispatcher app.py starts under gunicorn.
+"""
+import csv
+import io
+import math
+import os
+import time
+from datetime import datetime
+from contextlib import asynccontextmanager
+from functools import wraps
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+from flask import render_template, session as flask_session, url_for
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+import aiodb
+import mailer
+import metrics
+from app import app as flask_app, CSV_CHUNK_ROWS
+from db import PRIMARY_UNTIL_KEY
+from passwords import PasswordServiceBusy
+from throttle import login_throttle
+
+# The async dispatcher below replaces the threads the Flask app would otherwise start
+EMAIL_WORKER_INLINE = flask_app.config['EMAIL_WORKER_INLINE']
+flask_app.config['EMAIL_WORKER_INLINE'] = False
+
+# Threads running the Flask routes; each holds one sync pool connection while busy
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 10))
+
+session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+SESSION_COOKIE = flask_app.config['SESSION_COOKIE_NAME']
+SESSION_MAX_AGE = int(flask_app.permanent_session_lifetime.total_seconds())
+
+with flask_app.test_request_context():
+    LOGIN_URL = url_for('manager_login')
+    DASHBOARD_URL = url_for('manager_dashboard')
+
+def load_session(request):
+    value = request.cookies.get(SESSION_COOKIE)
+    if not value:
+        return {}
+    try:
+        return session_serializer.loads(value, max_age=SESSION_MAX_AGE)
+    except BadSignature:
+        return {}
+
+def save_session(response, session):
+    samesite = flask_app.config['SESSION_COOKIE_SAMESITE']
+    response.set_cookie(
+        SESSION_COOKIE,
+        session_serializer.dumps(dict(session)),
+        path=flask_app.config['SESSION_COOKIE_PATH'] or '/',
+        domain=flask_app.config['SESSION_COOKIE_DOMAIN'] or None,
+        secure=flask_app.config['SESSION_COOKIE_SECURE'],
+        httponly=flask_app.config['SESSION_COOKIE_HTTPONLY'],
+        samesite=samesite.lower() if samesite else None,
+    )
+    return response
+
+def flash(session, message, category):
+    # Same storage as flask.flash, so the next Flask page shows the message
+    session.setdefault('_flashes', []).append((category, message))
+
+def redirect(url, session):
+    return save_session(RedirectResponse(url, status_code=302), session)
+
+def render_page(template, session, status_code=200):
+    """Render a Flask template, showing and consuming the session's flashed messages."""
+    with flask_app.test_request_context():
+        flask_session.update(session)
+        body = render_template(template)
+    session.pop('_flashes', None)
+    return save_session(HTMLResponse(body, status_code=status_code), session)
+
+def jsonify(payload, status_code=200):
+    # Flask's JSON provider, so Decimals and dates serialise exactly as in the sync app
+    return Response(flask_app.json.dumps(payload), status_code=status_code, media_type='application/json')
+
+def instrumented(endpoint):
+    """Record the request in metrics under the same endpoint name as its Flask route."""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrap(request):
+            token = metrics.start_request()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                try:
+                    metrics.finish_request(request.method, request.url.path, endpoint, status)
+                finally:
+                    metrics.end_request(token)
+        return wrap
+    return decorator
+
+def manager_required(handler):
+    @wraps(handler)
+    async def wrap(request):
+        session = load_session(request)
+        if 'logged_in' not in session or session.get('role') != 'manager':
+            flash(session, 'Please log in as manager to access this page.', 'error')
+            return redirect(LOGIN_URL, session)
+        return await handler(request, session)
+    return wrap
+
+def read_only_request(handler):
+    """db.read_only_request for the async handlers; goes below manager_required."""
+    @wraps(handler)
+    async def wrap(request, session):
+        # db._replica_allowed, read from the session cookie
+        token = aiodb.replica_allowed.set(session.get(PRIMARY_UNTIL_KEY, 0) <= time.time())
+        try:
+            return await handler(request, session)
+        finally:
+            aiodb.replica_allowed.reset(token)
+    return wrap
+
+@instrumented('manager_login')
+async def manager_login(request):
+    form = parse_qs((await request.body()).decode('utf-8', 'replace'), keep_blank_values=True)
+    if 'email' not in form or 'password' not in form:
+        return PlainTextResponse('Bad Request', status_code=400)
+    email = form['email'][0]
+    password = form['password'][0]
+    session = load_session(request)
+    ip = request.client.host if request.client else None
+    # Failures redirect back to the Flask login page, which shows the flashed message;
+    # a throttled login renders it with a 429 like the Flask route does
+    retry_after = await login_throttle.off_loop(login_throttle.retry_after, ip, email)
+    if retry_after:
+        flash(session, f'Too many failed login attempts. Please try again in {math.ceil(retry_after)} seconds.', 'error')
+        return render_page('manager_login.html', session, 429)
+    try:
+        manager = await aiodb.get_manager_by_email_and_password(email, password)
+    except PasswordServiceBusy:
+        flash(session, 'The server is busy, please try again in a moment.', 'error')
+        return redirect(LOGIN_URL, session)
+    if manager:
+        await login_throttle.off_loop(login_throttle.reset, email)
+        session['logged_in'] = True
+        session['user_id'] = manager['id']
+        session['role'] = 'manager'
+        flash(session, 'Manager login successful!', 'success')
+        return redirect(DASHBOARD_URL, session)
+    await login_throttle.off_loop(login_throttle.record_failure, ip, email)
+    flash(session, 'Invalid email or password.', 'error')
+    return redirect(LOGIN_URL, session)
+
+@instrumented('customers_api')
+@manager_required
+@read_only_request
+async def customers_api(request, session):
+    args = request.query_params
+    try:
+        limit = min(max(int(args.get('limit', 50)), 1), 200)
+        balance = args.get('balance')
+        balance = float(balance) if balance else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid query parameters.'}, 400)
+    customers, next_cursor = await aiodb.get_customers_page(
+        session['user_id'],
+        sort=args.get('sort', 'box_number'),
+        direction=args.get('direction', 'asc'),
+        search=args.get('search', '').strip() or None,
+        status=args.get('status'),
+        balance=balance,
+        balance_op=args.get('balance_op'),
+        cursor=args.get('cursor'),
+        limit=limit
+    )
+    if customers is None:
+        return jsonify({'success': False, 'error': 'Database connection failed'}, 500)
+    return jsonify({'success': True, 'customers': customers, 'next_cursor': next_cursor})
+
+def payment_filter_args(args):
+    """app.payment_filter_args for Starlette query parameters."""
+    def parse_date(name):
+        value = args.get(name)
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+    customer_id = args.get('customer_id')
+    try:
+        customer_id = int(customer_id) if customer_id is not None else None
+    except ValueError:
+        # Flask's args.get(type=int) ignores values that do not parse
+        customer_id = None
+    return {
+        'status': args.get('status'),
+        'customer_id': customer_id,
+        'mobile_number': args.get('mobile_number', '').strip() or None,
+        'start_date': parse_date('start_date'),
+        'end_date': parse_date('end_date'),
+        'direction': args.get('direction', 'desc'),
+    }
+
+@instrumented('payments_api')
+@manager_required
+@read_only_request
+async def payments_api(request, session):
+    args = request.query_params
+    try:
+        limit = min(max(int(args.get('limit', 50)), 1), 200)
+        filters = payment_filter_args(args)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid query parameters.'}, 400)
+    payments, next_cursor = await aiodb.get_payments_page(session['user_id'], cursor=args.get('cursor'), limit=limit, **filters)
+    if payments is None:
+        return jsonify({'success': False, 'error': 'Database connection failed'}, 500)
+    # Results may be shared through the cache, so they are copied rather than modified
+    payments = [dict(payment, payment_date=str(payment['payment_date'])) for payment in payments]
+    return jsonify({'success': True, 'payments': payments, 'next_cursor': next_cursor})
+
+@instrumented('email_status')
+@manager_required
+@read_only_request
+async def email_status(request, session):
+    counts = await aiodb.get_email_status_counts(session['user_id'])
+    if counts is None:
+        return jsonify({'success': False, 'error': 'Database connection failed'}, 500)
+    return jsonify({'success': True, 'counts': counts})
+
+def csv_response(rows, columns, filename):
+    """app.csv_response over an async row iterator."""
+    async def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        count = 0
+        async for row in rows:
+            writer.writerow([row[column] for column in columns])
+            count += 1
+            if count % CSV_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    return StreamingResponse(generate(), media_type='text/csv', headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Accel-Buffering': 'no',
+    })
+
+@instrumented('export_customers')
+@manager_required
+@read_only_request
+async def export_customers(request, session):
+    columns = ['id', 'box_number', 'name', 'mobile_number', 'email', 'plan_amount', 'address', 'balance', 'created_at']
+    return csv_response(aiodb.iter_customers(session['user_id']), columns, 'customers.csv')
+
+@instrumented('export_payments')
+@manager_required
+@read_only_request
+async def export_payments(request, session):
+    try:
+        filters = payment_filter_args(request.query_params)
+    except ValueError:
+        flash(session, 'Invalid export filters.', 'error')
+        return redirect(DASHBOARD_URL, session)
+    columns = ['id', 'customer_id', 'box_number', 'name', 'mobile_number', 'amount', 'payment_mode', 'payment_status', 'payment_reference', 'payment_date']
+    return csv_response(aiodb.iter_payments(session['user_id'], **filters), columns, 'bill_history.csv')
+
+@asynccontextmanager
+async def lifespan(app):
+    dispatcher = None
+    if EMAIL_WORKER_INLINE:
+        dispatcher = mailer.AsyncEmailDispatcher(rate_per_second=mailer.EMAIL_INLINE_RATE_PER_SECOND)
+        dispatcher.start()
+    try:
+        yield
+    finally:
+        if dispatcher is not None:
+            await dispatcher.stop()
+        await aiodb.close_pool()
+
+# Paths are taken from the Flask url_map so both apps always agree on them
+def flask_path(endpoint):
+    return next(rule.rule for rule in flask_app.url_map.iter_rules() if rule.endpoint == endpoint)
+
+app = Starlette(
+    routes=[
+        Route(flask_path('manager_login'), manager_login, methods=['POST']),
+        Route(flask_path('customers_api'), customers_api),
+        Route(flask_path('payments_api'), payments_api),
+        Route(flask_path('email_status'), email_status),
+        Route(flask_path('export_customers'), export_customers),
+        Route(flask_path('export_payments'), export_payments),
+        # Anything not matched above (including GET /) is served by Flask
+        Mount('', app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
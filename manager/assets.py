@@ -0,0 +1,256 @@
+"""Build and serve the CSS/JS bundles under static/src.
+
+    python assets.py        rebuild static/dist and its manifest
+
+Run it as part of every deploy: the app only reads static/dist, so the
+package directory can be read-only in production. In debug mode, or with
+ASSETS_AUTOBUILD=1, a source newer than the manifest is rebuilt at runtime.
+
+Each bundle is concatenated, purged of CSS rules whose classes no template or
+script mentions, minified and written as <name>.<hash>.<ext> with gzip and
+(when the brotli package is installed) brotli copies next to it. The hash
+changes with the content, so bundles are served with a one-year immutable
+Cache-Control and a deploy never serves a stale file.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(BASE_DIR, 'static', 'src')
+DIST_DIR = os.path.join(BASE_DIR, 'static', 'dist')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# Rebuild at runtime when a source file is newer than the manifest; always on in debug mode
+ASSETS_AUTOBUILD = os.getenv('ASSETS_AUTOBUILD', '0') == '1'
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Bundle name -> source files under static/src, in order
+BUNDLES = {
+    'dashboard.css': ['css/utilities.css', 'css/dashboard.css'],
+    'dashboard.js': ['js/dashboard.js'],
+    'login.css': ['css/login.css'],
+    'login.js': ['js/login.js'],
+    'signup.css': ['css/signup.css'],
+}
+
+# Class prefixes only ever built at runtime (e.g. `status-${status}`), never purged
+SAFELIST_PREFIXES = ('status-',)
+
+CLASS_SELECTOR = re.compile(r'\.((?:\\.|[A-Za-z0-9_-])+)')
+CONTENT_TOKEN = re.compile(r'[A-Za-z0-9_:/.-]+')
+
+def content_tokens(text):
+    """Class-like tokens in a template or script.
+
+    Selectors in scripts such as '.modal' or '.modal.hidden' name their
+    classes after dots, so each dotted part counts as a token too.
+    """
+    tokens = set()
+    for token in CONTENT_TOKEN.findall(text):
+        tokens.add(token.strip('.'))
+        tokens.update(token.split('.'))
+    tokens.discard('')
+    return tokens
+
+def used_classes():
+    """Every class-like token in the templates and scripts, like Tailwind's content scan."""
+    tokens = set()
+    for root in (TEMPLATES_DIR, os.path.join(SOURCE_DIR, 'js')):
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(('.html', '.js')):
+                    with open(os.path.join(dirpath, filename), encoding='utf-8') as f:
+                        tokens.update(content_tokens(f.read()))
+    return tokens
+
+def _blocks(css):
+    """Split a stylesheet into top-level (prelude, body) pairs."""
+    blocks = []
+    depth = 0
+    start = 0
+    prelude = None
+    for i, char in enumerate(css):
+        if char == '{':
+            if depth == 0:
+                prelude = css[start:i].strip()
+                start = i + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude, css[start:i]))
+                start = i + 1
+    return blocks
+
+def _selector_used(selector, used):
+    for name in CLASS_SELECTOR.findall(selector):
+        name = re.sub(r'\\(.)', r'\1', name)
+        if name not in used and not name.startswith(SAFELIST_PREFIXES):
+            return False
+    return True
+
+def purge_css(css, used):
+    """Drop rules whose selectors only match classes that are never used."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    out = []
+    for prelude, body in _blocks(css):
+        if prelude.startswith(('@media', '@supports')):
+            inner = purge_css(body, used)
+            if inner:
+                out.append(f"{prelude}{{{inner}}}")
+        elif prelude.startswith('@'):
+            out.append(f"{prelude}{{{body}}}")
+        else:
+            selectors = [s.strip() for s in prelude.split(',') if _selector_used(s, used)]
+            if selectors:
+                out.append(f"{','.join(selectors)}{{{body}}}")
+    return '\n'.join(out)
+
+def minify_css(css):
+    if rcssmin is not None:
+        return rcssmin.cssmin(css)
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+def minify_js(js):
+    if rjsmin is not None:
+        return rjsmin.jsmin(js)
+    # Without rjsmin only drop whole-line comments and indentation, which cannot change behaviour
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+def build_bundle(name, used):
+    sources = []
+    for path in BUNDLES[name]:
+        with open(os.path.join(SOURCE_DIR, path), encoding='utf-8') as f:
+            sources.append(f.read())
+    content = '\n'.join(sources)
+    if name.endswith('.css'):
+        content = minify_css(purge_css(content, used))
+    else:
+        content = minify_js(content)
+    return content.encode('utf-8')
+
+def build(dist_dir=DIST_DIR):
+    """Write every bundle and its compressed copies, then the manifest; returns the manifest."""
+    os.makedirs(dist_dir, exist_ok=True)
+    used = used_classes()
+    manifest = {}
+    for name in BUNDLES:
+        data = build_bundle(name, used)
+        stem, ext = os.path.splitext(name)
+        filename = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+        path = os.path.join(dist_dir, filename)
+        _write(path, data)
+        # mtime=0 keeps the .gz byte-identical across builds of the same content
+        _write(path + '.gz', gzip.compress(data, 9, mtime=0))
+        if brotli is not None:
+            _write(path + '.br', brotli.compress(data, quality=11))
+        manifest[name] = filename
+    _write(os.path.join(dist_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+def _write(path, data):
+    # Every gunicorn worker may build at startup; a rename never exposes a half-written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def _stale():
+    if not os.path.exists(MANIFEST_PATH):
+        return True
+    built = os.path.getmtime(MANIFEST_PATH)
+    for root in (SOURCE_DIR, TEMPLATES_DIR):
+        for dirpath, _, filenames in os.walk(root):
+            if any(os.path.getmtime(os.path.join(dirpath, f)) > built for f in filenames):
+                return True
+    return False
+
+def load_manifest(autobuild=ASSETS_AUTOBUILD):
+    if autobuild and _stale():
+        return build()
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise RuntimeError(f"{MANIFEST_PATH} is missing; run `python assets.py` when deploying") from None
+
+def init_app(app):
+    """Register asset_url() for templates, the /assets route and ETags on HTML pages.
+
+    The manifest is read on first use, once app.debug is known; in debug mode
+    it is rebuilt whenever a source changes.
+    """
+    from flask import abort, request, send_file, url_for
+
+    manifest = None
+
+    def current_manifest():
+        nonlocal manifest
+        if manifest is None or (app.debug and _stale()):
+            manifest = load_manifest(ASSETS_AUTOBUILD or app.debug)
+        return manifest
+
+    @app.template_global()
+    def asset_url(name):
+        return url_for('asset', filename=current_manifest()[name])
+
+    @app.route('/assets/<path:filename>')
+    def asset(filename):
+        if filename not in current_manifest().values():
+            abort(404)
+        path = os.path.join(DIST_DIR, filename)
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.exists(path + suffix):
+                encoding = candidate
+                path += suffix
+                break
+        response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True, max_age=ASSET_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    @app.after_request
+    def conditional_html(response):
+        # Pages are per manager and change with every write, so they are revalidated
+        # on each view; an unchanged page costs a 304 instead of the full HTML
+        if (request.method == 'GET' and response.status_code == 200
+                and response.mimetype == 'text/html' and not response.direct_passthrough):
+            response.add_etag()
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.make_conditional(request)
+        return response
+
+if __name__ == '__main__':
+    for name, filename in sorted(build().items()):
+        size = os.path.getsize(os.path.join(DIST_DIR, filename))
+        print(f"{name:<16} {filename:<32} {size:>8,} bytes")
@@ -0,0 +1,275 @@
+"""Compare the sync (gunicorn app:app) and async (uvicorn asgi:app) deployments side by side.
+
+Seeds data and an SMTP sink as loadtest.py does, starts each server as a
+subprocess on a free port with the same number of worker processes, and
+drives it with --concurrency keep-alive connections from a single asyncio
+client. Every connection logs in once, then issues a read-heavy mix of
+/api/customers, /api/payments and /email_status until --duration runs out.
+Prints throughput, p50/p95/p99 latency and errors per deployment and saves the
+run as JSON.
+
+    python benchmarks/bench_asgi.py [--concurrency 500] [--duration 30] [--workers 4]
+        [--gunicorn-threads 8] [--deployments sync async]
+        [--output results/asgi-<timestamp>.json]
+
+Needs gunicorn for the sync run and uvicorn, starlette, a2wsgi, aiomysql and
+aiosmtplib for the async one. Both servers share the same database pool sizes
+(DB_POOL_SIZE / ASYNC_DB_POOL_SIZE); raise MySQL's max_connections to at least
+workers x pool size for each.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, APP_DIR)
+
+from loadtest import PASSWORD, SMTPSink, cleanup, git_revision, percentile, seed  # noqa: E402
+
+MIX = (
+    ('customers_api', '/api/customers?limit=50&sort=name', 4),
+    ('payments_api', '/api/payments?limit=50', 4),
+    ('email_status', '/email_status', 2),
+)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def server_command(deployment, port, args):
+    if deployment == 'sync':
+        return [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f"127.0.0.1:{port}",
+                '--workers', str(args.workers), '--threads', str(args.gunicorn_threads),
+                '--backlog', str(max(2048, args.concurrency)), '--log-level', 'warning']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(args.workers), '--backlog', str(max(2048, args.concurrency)), '--log-level', 'warning']
+
+def wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not listen on port {port} within {timeout}s")
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection carrying a session cookie."""
+
+    def __init__(self, port):
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.cookie = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, form=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        body = urlencode(form).encode() if form is not None else b''
+        lines = [f"{method} {path} HTTP/1.1", f"Host: 127.0.0.1:{self.port}"]
+        if self.cookie:
+            lines.append(f"Cookie: {self.cookie}")
+        if form is not None:
+            lines.append('Content-Type: application/x-www-form-urlencoded')
+        lines.append(f"Content-Length: {len(body)}")
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await self.reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            if name == 'set-cookie':
+                self.cookie = value.strip().split(';', 1)[0]
+            headers[name] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';', 1)[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        else:
+            await self.reader.read()
+            await self.close()
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status
+
+async def drive(port, managers, args):
+    names = [name for name, _, weight in MIX for _ in range(weight)]
+    paths = {name: path for name, path, _ in MIX}
+    samples = {name: [] for name, _, _ in MIX}
+    errors = {'login': 0, 'status': 0, 'connection': 0}
+    deadline = None
+
+    async def client(index):
+        conn = Connection(port)
+        manager = managers[index % len(managers)]
+        try:
+            if await conn.request('POST', '/', {'email': manager['email'], 'password': PASSWORD}) != 302:
+                errors['login'] += 1
+                return
+            await ready.wait()
+            while time.monotonic() < deadline:
+                name = random.choice(names)
+                started = time.perf_counter()
+                try:
+                    status = await conn.request('GET', paths[name])
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    errors['connection'] += 1
+                    await conn.close()
+                    continue
+                samples[name].append((time.perf_counter() - started) * 1000)
+                if status != 200:
+                    errors['status'] += 1
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            errors['login'] += 1
+        finally:
+            await conn.close()
+
+    ready = asyncio.Event()
+    tasks = [asyncio.create_task(client(i)) for i in range(args.concurrency)]
+    # Let every connection log in before the measured window starts
+    await asyncio.sleep(args.warmup)
+    started = time.monotonic()
+    deadline = started + args.duration
+    ready.set()
+    await asyncio.gather(*tasks)
+    wall = time.monotonic() - started
+
+    everything = [sample for values in samples.values() for sample in values]
+    result = {
+        'requests': len(everything),
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(everything) / wall, 2) if wall else None,
+        'errors': errors,
+        'routes': {},
+    }
+    for name, values in [('all', everything)] + list(samples.items()):
+        if not values:
+            continue
+        stats = {key: round(percentile(values, pct), 2) for key, pct in (('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99))}
+        stats['requests'] = len(values)
+        if name == 'all':
+            result.update(stats)
+        else:
+            result['routes'][name] = stats
+    return result
+
+def run_deployment(deployment, managers, args):
+    port = free_port()
+    process = subprocess.Popen(server_command(deployment, port, args), cwd=APP_DIR, env=os.environ.copy())
+    try:
+        wait_for_port(port, process)
+        result = asyncio.run(drive(port, managers, args))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    result['deployment'] = deployment
+    result['command'] = ' '.join(server_command(deployment, port, args)[1:])
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--managers', type=int, default=4)
+    parser.add_argument('--customers', type=int, default=2000, help='customers per manager')
+    parser.add_argument('--payments', type=int, default=5, help='payments per customer')
+    parser.add_argument('--concurrency', type=int, default=500, help='open client connections')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds per deployment')
+    parser.add_argument('--warmup', type=float, default=10, help='seconds allowed for the logins before measuring')
+    parser.add_argument('--workers', type=int, default=4, help='server processes for both deployments')
+    parser.add_argument('--gunicorn-threads', type=int, default=8, help='threads per gunicorn worker')
+    parser.add_argument('--deployments', nargs='+', choices=('sync', 'async'), default=['sync', 'async'])
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help='BCRYPT_ROUNDS for the seeded managers and servers')
+    parser.add_argument('--output', help='JSON results path (default results/asgi-<timestamp>.json)')
+    parser.add_argument('--keep', action='store_true', help='leave the seeded rows in place')
+    args = parser.parse_args()
+
+    sink = SMTPSink()
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    # Inherited by both server processes
+    os.environ.update({
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(sink.server_address[1]),
+        'SMTP_STARTTLS': '0',
+        'EMAIL_PASSWORD': '',
+        'EMAIL_ADDRESS': os.getenv('EMAIL_ADDRESS') or 'loadtest@example.invalid',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+        # A fresh checkout has no static/dist yet
+        'ASSETS_AUTOBUILD': os.getenv('ASSETS_AUTOBUILD', '1'),
+        'BCRYPT_ROUNDS': str(args.bcrypt_rounds),
+    })
+
+    import db  # noqa: E402
+    from passwords import hash_password  # noqa: E402
+
+    print(f"Seeding {args.managers} managers x {args.customers} customers x {args.payments} payments")
+    managers = seed(db, hash_password, args)
+    results = []
+    try:
+        print(f"{'deployment':<10} {'reqs':>8} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>9} {'errors':>7}")
+        for deployment in args.deployments:
+            result = run_deployment(deployment, managers, args)
+            results.append(result)
+            print(f"{deployment:<10} {result['requests']:>8} {result['throughput_rps']:>9} {result.get('p50_ms', '-'):>8} "
+                  f"{result.get('p95_ms', '-'):>8} {result.get('p99_ms', '-'):>9} {sum(result['errors'].values()):>7}")
+    finally:
+        if not args.keep:
+            cleanup(db, managers)
+        sink.shutdown()
+
+    report = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'seed': {'managers': args.managers, 'customers': args.customers, 'payments': args.payments},
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'workers': args.workers,
+        'gunicorn_threads': args.gunicorn_threads,
+        'environment': {key: os.getenv(key) for key in ('DB_POOL_SIZE', 'ASYNC_DB_POOL_SIZE', 'ASGI_WSGI_THREADS', 'CACHE_BACKEND', 'BCRYPT_ROUNDS')},
+        'results': results,
+    }
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"asgi-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark db.get_customer as a manager's customer count grows.
+
+Seeds a throwaway manager with 100, 1k, 10k and 100k customers in the database
+configured by the DB_* environment variables, times random single-customer
+lookups at each size and removes the seeded rows afterwards.
+
+    python benchmarks/bench_customer_lookup.py [--lookups 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db  # noqa: E402
+
+SIZES = (100, 1000, 10000, 100000)
+
+def create_manager(cursor):
+    tag = uuid.uuid4().hex[:12]
+    cursor.execute("""
+        INSERT INTO managers (username, email, mobile_number, password)
+        VALUES (%s, %s, %s, %s)
+    """, (f"bench-{tag}", f"bench-{tag}@example.invalid", tag[:10], 'x'))
+    return cursor.lastrowid
+
+def seed_customers(cursor, manager_id, start, count):
+    rows = [
+        (f"B{i:07d}", f"9{manager_id % 1000:03d}{i:06d}", f"Customer {i}", None, 'x', 300, 'Bench Street', manager_id, False)
+        for i in range(start, start + count)
+    ]
+    for offset in range(0, len(rows), 5000):
+        cursor.executemany("""
+            INSERT INTO customers (box_number, mobile_number, name, email, password, plan_amount, address, manager_id, is_temp_password)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, rows[offset:offset + 5000])
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    manager_id = create_manager(cursor)
+    conn.commit()
+    try:
+        seeded = 0
+        print(f"{'customers':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for size in SIZES:
+            seed_customers(cursor, manager_id, seeded, size - seeded)
+            conn.commit()
+            seeded = size
+            cursor.execute("SELECT id FROM customers WHERE manager_id = %s", (manager_id,))
+            ids = [row[0] for row in cursor.fetchall()]
+            samples = []
+            for _ in range(args.lookups):
+                customer_id = random.choice(ids)
+                started = time.perf_counter()
+                customer = db.get_customer(customer_id, manager_id)
+                samples.append((time.perf_counter() - started) * 1000)
+                assert customer and customer['id'] == customer_id
+            print(f"{size:>10} {percentile(samples, 50):>8.3f} {percentile(samples, 95):>8.3f} {percentile(samples, 99):>8.3f}")
+    finally:
+        cursor.execute("DELETE FROM customers WHERE manager_id = %s", (manager_id,))
+        cursor.execute("DELETE FROM managers WHERE id = %s", (manager_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+if __name__ == '__main__':
+    main()
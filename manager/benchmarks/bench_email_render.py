@@ -0,0 +1,39 @@
+"""Measure how fast bill notifications are rendered for a billing run.
+
+Renders and serialises a batch of bill_notification messages through
+mailer.render_messages without sending anything.
+
+    python benchmarks/bench_email_render.py [--recipients 10000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mailer  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=10000)
+    args = parser.parse_args()
+
+    emails = [{
+        'id': i,
+        'to_email': f"customer{i}@example.invalid",
+        'subject': 'New Bill Generated for Your Time2Due Account',
+        'template_type': 'bill_notification',
+        'payload': {'name': f"Customer {i}", 'amount': 250 + i % 300},
+    } for i in range(args.recipients)]
+
+    started = time.perf_counter()
+    total_bytes = 0
+    for _, message_bytes in mailer.render_messages(emails):
+        total_bytes += len(message_bytes)
+    elapsed = time.perf_counter() - started
+    print(f"{args.recipients} messages in {elapsed:.2f}s: {args.recipients / elapsed:,.0f} messages/s, "
+          f"{total_bytes / args.recipients / 1024:.1f} KB/message")
+
+if __name__ == '__main__':
+    main()
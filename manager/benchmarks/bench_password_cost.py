@@ -0,0 +1,48 @@
+"""Report login password checks per second at different bcrypt cost factors.
+
+For each cost, measures checks per second inline (one sync worker doing
+bcrypt itself) and through the passwords process pool with several
+concurrent callers.
+
+    python benchmarks/bench_password_cost.py [--costs 10 11 12 13] [--seconds 3]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import passwords  # noqa: E402
+
+def checks_per_second(check, seconds):
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        check()
+        done += 1
+    return done / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--costs', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--callers', type=int, default=passwords.PASSWORD_HASH_WORKERS)
+    args = parser.parse_args()
+
+    print(f"{'cost':>4} {'inline/s':>10} {'pooled/s':>10}  ({args.callers} concurrent callers, {passwords.PASSWORD_HASH_WORKERS} hash workers)")
+    for cost in args.costs:
+        hashed = passwords._hash('correct horse battery', cost)
+        inline = checks_per_second(lambda: passwords._check(hashed, 'correct horse battery'), args.seconds)
+        with ThreadPoolExecutor(max_workers=args.callers) as callers:
+            # _run rather than verify_password, which would also rehash whenever cost != BCRYPT_ROUNDS
+            futures = [
+                callers.submit(checks_per_second, lambda: passwords._run(passwords._check, hashed, 'correct horse battery'), args.seconds)
+                for _ in range(args.callers)
+            ]
+            pooled = sum(future.result() for future in futures)
+        print(f"{cost:>4} {inline:>10.1f} {pooled:>10.1f}")
+
+if __name__ == '__main__':
+    main()
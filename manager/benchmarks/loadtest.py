@@ -0,0 +1,387 @@
+"""Drive the Flask routes at controlled concurrency and record latency per route.
+
+Seeds throwaway managers, customers and payments into the database configured
+by the DB_* environment variables, points SMTP at a local sink, serves app.py
+from an in-process threaded server (or targets --url) and runs each scenario
+with --concurrency client threads. Prints p50/p95/p99 latency, throughput and
+SQL statements per request (read from /metrics), saves the run as JSON and
+removes the seeded rows afterwards.
+
+    python benchmarks/loadtest.py [--managers 4] [--customers 2000] [--payments 5]
+        [--concurrency 16] [--requests 500] [--scenarios dashboard pay_offline add_all_bills:10]
+        [--output results/loadtest-<timestamp>.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+PASSWORD = 'loadtest-password'
+DEFAULT_SCENARIOS = ('login', 'dashboard', 'customers_api', 'pay_offline', 'add_customer', 'add_all_bills:10')
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Minimal SMTP server that accepts and discards every message."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.messages = 0
+        self.lock = threading.Lock()
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 loadtest sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 loadtest')
+            elif command == 'DATA':
+                self.reply('354 end with <CRLF>.<CRLF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+class Client:
+    """Keep-alive HTTP client carrying the Flask session cookie."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.conn = None
+        self.cookie = None
+
+    def request(self, method, path, form=None):
+        body = urlencode(form) if form is not None else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body is not None else {}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server closed the keep-alive connection; reconnect once
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        if response.getheader('Connection', '').lower() == 'close':
+            self.conn.close()
+            self.conn = None
+        return response.status
+
+    def login(self, email):
+        self.cookie = None
+        return self.request('POST', '/', {'email': email, 'password': PASSWORD})
+
+def seed(db, hash_password, args):
+    """Create managers with customers, opening ledger entries and payment history."""
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    tag = uuid.uuid4().hex[:8]
+    password = hash_password(PASSWORD)
+    managers = []
+    now = datetime.now()
+    try:
+        for m in range(args.managers):
+            email = f"load-{tag}-{m}@example.invalid"
+            cursor.execute("""
+                INSERT INTO managers (username, email, mobile_number, password)
+                VALUES (%s, %s, %s, %s)
+            """, (f"load-{tag}-{m}", email, f"8{m:03d}{tag[:6]}", password))
+            manager_id = cursor.lastrowid
+            customers = []
+            for c in range(args.customers):
+                customers.append((
+                    f"L{tag}-{m}-{c}", f"9{m:03d}{c:06d}", f"Load Customer {c}",
+                    f"load-{tag}-{m}-{c}@example.invalid" if c % 2 == 0 else None,
+                    password, random.choice((199, 299, 499)), 'Load Street', manager_id,
+                    random.randint(500, 5000),
+                ))
+            for start in range(0, len(customers), 1000):
+                cursor.executemany("""
+                    INSERT INTO customers (box_number, mobile_number, name, email, password, plan_amount, address, manager_id, is_temp_password, balance)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, FALSE, %s)
+                """, customers[start:start + 1000])
+            cursor.execute("""
+                INSERT INTO balance_ledger (customer_id, manager_id, amount, balance_after, entry_type, reference)
+                SELECT id, manager_id, balance, balance, 'opening', 'loadtest'
+                FROM customers WHERE manager_id = %s
+            """, (manager_id,))
+            cursor.execute("SELECT id FROM customers WHERE manager_id = %s", (manager_id,))
+            customer_ids = [row[0] for row in cursor.fetchall()]
+            payments = []
+            for customer_id in customer_ids:
+                for _ in range(args.payments):
+                    paid_at = now - timedelta(days=random.randint(0, 365), seconds=random.randint(0, 86399))
+                    payments.append((customer_id, manager_id, random.choice((199, 299, 499)),
+                                     random.choice(('offline', 'online')), 'completed', None, paid_at, paid_at))
+            for start in range(0, len(payments), 1000):
+                cursor.executemany("""
+                    INSERT INTO payments (customer_id, manager_id, amount, payment_mode, payment_status, payment_reference, payment_date, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """, payments[start:start + 1000])
+            conn.commit()
+            managers.append({'id': manager_id, 'email': email, 'customer_ids': customer_ids, 'tag': f"{tag}-{m}"})
+    finally:
+        cursor.close()
+        conn.close()
+    for manager in managers:
+        db.rebuild_manager_summary(manager['id'])
+    return managers
+
+def cleanup(db, managers):
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        for manager in managers:
+            manager_id = manager['id']
+            cursor.execute("DELETE FROM email_outbox WHERE manager_id = %s", (manager_id,))
+            cursor.execute("""
+                DELETE i FROM billing_run_items i
+                JOIN billing_runs r ON r.id = i.run_id
+                WHERE r.manager_id = %s
+            """, (manager_id,))
+            for table in ('billing_runs', 'balance_ledger', 'payments', 'manager_collections', 'manager_summary', 'customers'):
+                cursor.execute(f"DELETE FROM {table} WHERE manager_id = %s", (manager_id,))
+            cursor.execute("DELETE FROM managers WHERE id = %s", (manager_id,))
+            conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def build_request(name, manager, worker):
+    """Return (method, path, form, expected_status) for one request of a scenario."""
+    if name == 'login':
+        return 'POST', '/', {'email': manager['email'], 'password': PASSWORD}, 302
+    if name == 'dashboard':
+        return 'GET', '/dashboard', None, 200
+    if name == 'customers_api':
+        return 'GET', '/api/customers?limit=50&sort=name', None, 200
+    if name == 'payments_api':
+        return 'GET', '/api/payments?limit=50', None, 200
+    if name == 'pay_offline':
+        return 'POST', f"/pay_offline/{random.choice(manager['customer_ids'])}", {'amount': '1.00'}, 200
+    if name == 'add_customer':
+        serial = f"{worker['id']}-{worker['sequence']}"
+        worker['sequence'] += 1
+        return 'POST', '/add_customer', {
+            'box_number': f"N{manager['tag']}-{serial}",
+            'mobile_number': f"7{random.randint(0, 999999999):09d}",
+            'name': f"New Customer {serial}",
+            'email': f"new-{manager['tag']}-{serial}@example.invalid",
+            'plan_amount': '299',
+            'address': 'Load Street',
+        }, 302
+    if name == 'add_all_bills':
+        return 'POST', '/add_all_bills', {'run_key': uuid.uuid4().hex}, 302
+    raise ValueError(f"Unknown scenario {name}")
+
+def scrape_metrics(client, token):
+    """Return {(metric, endpoint): value} for the per-endpoint request counters."""
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+    conn = http.client.HTTPConnection(client.host, client.port, timeout=30)
+    try:
+        conn.request('GET', '/metrics', headers=headers)
+        text = conn.getresponse().read().decode()
+    finally:
+        conn.close()
+    values = {}
+    for line in text.splitlines():
+        if line.startswith('#') or 'endpoint="' not in line:
+            continue
+        name = line.split('{', 1)[0]
+        if name not in ('http_request_queries_total', 'http_request_duration_seconds_count'):
+            continue
+        endpoint = line.split('endpoint="', 1)[1].split('"', 1)[0]
+        values[(name, endpoint)] = values.get((name, endpoint), 0) + float(line.rsplit(' ', 1)[1])
+    return values
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def run_scenario(name, total, args, base_url, managers):
+    clients = []
+    for worker_id in range(args.concurrency):
+        manager = managers[worker_id % len(managers)]
+        client = Client(base_url)
+        client.login(manager['email'])
+        clients.append((client, manager, {'id': worker_id, 'sequence': 0}))
+
+    samples = []
+    statuses = {}
+    errors = 0
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker(client, manager, state):
+        nonlocal errors
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            method, path, form, expected = build_request(name, manager, state)
+            started = time.perf_counter()
+            try:
+                status = client.request(method, path, form)
+            except (http.client.HTTPException, OSError):
+                status = 'connection_error'
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                samples.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status != expected:
+                    errors += 1
+
+    before = scrape_metrics(clients[0][0], args.metrics_token)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=client) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    after = scrape_metrics(clients[0][0], args.metrics_token)
+
+    queries = sum(value - before.get(key, 0) for key, value in after.items() if key[0] == 'http_request_queries_total')
+    handled = sum(value - before.get(key, 0) for key, value in after.items()
+                  if key[0] == 'http_request_duration_seconds_count' and key[1] != 'metrics_endpoint')
+    return {
+        'scenario': name,
+        'requests': len(samples),
+        'concurrency': args.concurrency,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(samples) / wall, 2) if wall else None,
+        'p50_ms': round(percentile(samples, 50), 2),
+        'p95_ms': round(percentile(samples, 95), 2),
+        'p99_ms': round(percentile(samples, 99), 2),
+        'max_ms': round(max(samples), 2),
+        'errors': errors,
+        'statuses': statuses,
+        'queries_per_request': round(queries / handled, 2) if handled else None,
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--managers', type=int, default=4)
+    parser.add_argument('--customers', type=int, default=2000, help='customers per manager')
+    parser.add_argument('--payments', type=int, default=5, help='payments per customer')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario unless given as name:count')
+    parser.add_argument('--scenarios', nargs='+', default=list(DEFAULT_SCENARIOS))
+    parser.add_argument('--url', help='target an already running server instead of serving app.py in-process')
+    parser.add_argument('--metrics-token', default=os.getenv('METRICS_TOKEN'))
+    parser.add_argument('--bcrypt-rounds', type=int, help='override BCRYPT_ROUNDS for the in-process app')
+    parser.add_argument('--output', help='JSON results path (default results/loadtest-<timestamp>.json)')
+    parser.add_argument('--keep', action='store_true', help='leave the seeded rows in place')
+    args = parser.parse_args()
+
+    sink = SMTPSink()
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    # Must be set before app.py (and mailer.py) read their configuration
+    os.environ.update({
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(sink.server_address[1]),
+        'SMTP_STARTTLS': '0',
+        'EMAIL_PASSWORD': '',
+        'EMAIL_ADDRESS': os.getenv('EMAIL_ADDRESS') or 'loadtest@example.invalid',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+        # A fresh checkout has no static/dist yet
+        'ASSETS_AUTOBUILD': os.getenv('ASSETS_AUTOBUILD', '1'),
+    })
+    if args.bcrypt_rounds:
+        os.environ['BCRYPT_ROUNDS'] = str(args.bcrypt_rounds)
+    if not args.url and not args.metrics_token:
+        # /metrics is only served with a token, so give the in-process app one
+        args.metrics_token = os.environ['METRICS_TOKEN'] = uuid.uuid4().hex
+
+    import db  # noqa: E402
+    from passwords import hash_password  # noqa: E402
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        from werkzeug.serving import make_server
+        from app import app
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    print(f"Seeding {args.managers} managers x {args.customers} customers x {args.payments} payments")
+    managers = seed(db, hash_password, args)
+    results = []
+    try:
+        print(f"{'scenario':<16} {'reqs':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'q/req':>6} {'errors':>6}")
+        for spec in args.scenarios:
+            name, _, count = spec.partition(':')
+            result = run_scenario(name, int(count or args.requests), args, base_url, managers)
+            results.append(result)
+            print(f"{name:<16} {result['requests']:>6} {result['throughput_rps']:>8} {result['p50_ms']:>8} "
+                  f"{result['p95_ms']:>8} {result['p99_ms']:>8} {result['queries_per_request'] or '-':>6} {result['errors']:>6}")
+    finally:
+        if server is not None:
+            server.shutdown()
+        if not args.keep:
+            cleanup(db, managers)
+        sink.shutdown()
+
+    report = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'target': args.url or 'in-process',
+        'seed': {'managers': args.managers, 'customers': args.customers, 'payments': args.payments},
+        'environment': {key: os.getenv(key) for key in ('DB_POOL_SIZE', 'CACHE_BACKEND', 'BCRYPT_ROUNDS', 'PASSWORD_HASH_WORKERS', 'EMAIL_WORKERS')},
+        'emails_delivered': sink.messages,
+        'results': results,
+    }
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Measure the bytes each manager page makes a browser download.
+
+Reads the page templates (from the working tree, or from a git revision with
+--rev to measure the "before"), follows their <script src> and stylesheet
+<link href> tags and totals raw and gzip sizes. Bundles referenced through
+asset_url() are measured from a fresh build in a temporary directory.
+Third-party URLs are only fetched with --fetch-external; otherwise they are
+listed as unmeasured.
+
+    python benchmarks/page_weight.py [--rev HEAD~1] [--fetch-external] [--json]
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import assets  # noqa: E402
+
+PAGES = ['manager_login.html', 'manager_signup.html', 'manager_dashboard.html']
+
+SCRIPT_SRC = re.compile(r'<script[^>]*\ssrc="([^"]+)"')
+STYLESHEET_HREF = re.compile(r'<link[^>]*\shref="([^"]+)"[^>]*>')
+ASSET_CALL = re.compile(r"""\{\{\s*asset_url\(['"]([^'"]+)['"]\)\s*\}\}""")
+
+def read_template(name, rev):
+    if rev is None:
+        with open(os.path.join(assets.TEMPLATES_DIR, name), encoding='utf-8') as f:
+            return f.read()
+    return subprocess.run(['git', 'show', f"{rev}:manager/templates/{name}"], cwd=assets.BASE_DIR,
+                          check=True, capture_output=True, text=True).stdout
+
+def sizes(data):
+    return {'raw': len(data), 'gzip': len(gzip.compress(data, 9, mtime=0))}
+
+def fetch(url, cache):
+    if url not in cache:
+        try:
+            with urllib.request.urlopen(url, timeout=15) as response:
+                cache[url] = sizes(response.read())
+        except OSError as e:
+            print(f"Could not fetch {url}: {e}", file=sys.stderr)
+            cache[url] = None
+    return cache[url]
+
+def measure(rev, fetch_external):
+    with tempfile.TemporaryDirectory(prefix='page-weight-') as dist_dir:
+        return _measure(rev, fetch_external, dist_dir)
+
+def _measure(rev, fetch_external, dist_dir):
+    manifest = assets.build(dist_dir)
+    fetched = {}
+    report = {}
+    for page in PAGES:
+        html = read_template(page, rev)
+        page_report = {'html': sizes(html.encode('utf-8')), 'assets': {}, 'unmeasured': []}
+        for ref in SCRIPT_SRC.findall(html) + STYLESHEET_HREF.findall(html):
+            bundle = ASSET_CALL.search(ref)
+            if bundle:
+                with open(os.path.join(dist_dir, manifest[bundle.group(1)]), 'rb') as f:
+                    page_report['assets'][bundle.group(1)] = sizes(f.read())
+            elif ref.startswith('http') and fetch_external and fetch(ref, fetched):
+                page_report['assets'][ref] = fetched[ref]
+            else:
+                page_report['unmeasured'].append(ref)
+        # Inline <style> and <script> blocks are part of the HTML and re-sent on every view
+        page_report['inline'] = sum(len(block) for block in re.findall(r'<(style|script)>.*?</\1>', html, re.S))
+        page_report['total'] = {
+            key: page_report['html'][key] + sum(a[key] for a in page_report['assets'].values())
+            for key in ('raw', 'gzip')
+        }
+        report[page] = page_report
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rev', help='git revision to measure instead of the working tree')
+    parser.add_argument('--fetch-external', action='store_true', help='download third-party scripts and styles to size them')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = measure(args.rev, args.fetch_external)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for page, page_report in report.items():
+        html, total = page_report['html'], page_report['total']
+        print(f"{page}: HTML {html['raw']:,} B ({html['gzip']:,} B gzip), "
+              f"inline CSS/JS {page_report['inline']:,} B, total {total['raw']:,} B ({total['gzip']:,} B gzip)")
+        for name, size in page_report['assets'].items():
+            print(f"    {name:<60} {size['raw']:>9,} B {size['gzip']:>9,} B gzip")
+        for ref in page_report['unmeasured']:
+            print(f"    {ref:<60} not measured")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Check read/write splitting against a primary and a replica MySQL instance.
+
+Two local instances are enough, for example:
+
+    docker run -d --name primary -p 3306:3306 -e MYSQL_ROOT_PASSWORD=root mysql:8 --server-id=1
+    docker run -d --name replica -p 3307:3306 -e MYSQL_ROOT_PASSWORD=root mysql:8 --server-id=2
+    DB_HOST=127.0.0.1 DB_PORT=3306 DB_REPLICA_HOSTS=127.0.0.1:3307 python benchmarks/replica_routing.py
+
+Replication does not have to be set up: a second instance that is not a
+replica reports no lag. Checks that replica_read functions and read-only
+routes are served by the replica, that a session reads from the primary for
+DB_READ_YOUR_WRITES_WINDOW seconds after it writes, and that reads fail over
+to the primary when the replica is unreachable or lagging.
+
+    python benchmarks/replica_routing.py [--window 1]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def server_of(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT @@server_id, @@port")
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--window', type=float, default=1, help='read-your-writes window to test with, in seconds')
+    args = parser.parse_args()
+    # Must be set before db.py reads its configuration
+    os.environ['DB_READ_YOUR_WRITES_WINDOW'] = str(args.window)
+
+    from flask import Flask
+    import db
+    from pool import ConnectionPool, ReplicaRouter
+
+    if db.replicas is None:
+        print("Set DB_REPLICA_HOSTS to the replica's host:port")
+        return 2
+
+    failures = 0
+
+    def check(name, actual, expected):
+        nonlocal failures
+        ok = actual == expected
+        failures += not ok
+        print(f"{'PASS' if ok else 'FAIL'} {name}: got {actual}, expected {expected}")
+
+    conn = db.connection_pool.get_connection()
+    primary = server_of(conn)
+    conn.close()
+    conn = db.replicas.replicas[0].pool.get_connection()
+    replica = server_of(conn)
+    conn.close()
+    print(f"primary server_id/port {primary}, replica {replica}")
+    if primary == replica:
+        print("The primary and replica are the same server")
+        return 2
+
+    @db.replica_read
+    def replica_probe():
+        conn = db.get_connection()
+        try:
+            return server_of(conn)
+        finally:
+            conn.close()
+
+    def primary_probe():
+        conn = db.get_connection()
+        try:
+            return server_of(conn)
+        finally:
+            conn.close()
+
+    check('replica_read outside a request', replica_probe(), replica)
+    check('unmarked function outside a request', primary_probe(), primary)
+
+    app = Flask(__name__)
+    app.secret_key = 'replica-routing'
+    db.init_app(app)
+
+    @app.route('/read')
+    @db.read_only_request
+    def read():
+        return {'server': list(server_of(db.get_connection()))}
+
+    @app.route('/write', methods=['POST'])
+    def write():
+        conn = db.get_connection()
+        server = server_of(conn)
+        conn.commit()
+        return {'server': list(server)}
+
+    client = app.test_client()
+
+    def served_by(method, path):
+        return tuple(getattr(client, method)(path).get_json()['server'])
+
+    check('read-only route', served_by('get', '/read'), replica)
+    check('write route', served_by('post', '/write'), primary)
+    check('read-only route right after a write', served_by('get', '/read'), primary)
+    time.sleep(args.window + 0.1)
+    check('read-only route after the window', served_by('get', '/read'), replica)
+
+    # An unreachable replica is marked down and reads fall back to the primary
+    configured = db.replicas
+    db.replicas = ReplicaRouter(
+        [('unreachable', ConnectionPool(dict(db.db_config, host='127.0.0.1', port=1), size=1, timeout=1))],
+        retry_after=60)
+    try:
+        check('unreachable replica', replica_probe(), primary)
+        check('unreachable replica marked down', db.replicas.stats()['replicas'][0]['down'], True)
+    finally:
+        db.replicas = configured
+
+    # A replica behind by more than max_lag is skipped
+    max_lag, check_interval = db.replicas.max_lag, db.replicas.check_interval
+    db.replicas.max_lag, db.replicas.check_interval = -1, 0
+    try:
+        check('lagging replica', replica_probe(), primary)
+    finally:
+        db.replicas.max_lag, db.replicas.check_interval = max_lag, check_interval
+    check('replica used again once caught up', replica_probe(), replica)
+
+    print(f"Router stats: {db.get_replica_stats()}")
+    print(f"{failures} failures")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
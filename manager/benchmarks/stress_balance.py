@@ -0,0 +1,87 @@
+"""Hammer one customer's balance from many threads and check nothing is lost.
+
+Creates a throwaway manager and customer in the database configured by the
+DB_* environment variables, runs concurrent bills and payments through
+db.update_customer_balance, then checks that the final balance equals the
+sum of the successful changes and matches the ledger.
+
+    python benchmarks/stress_balance.py [--threads 16] [--iterations 200]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import uuid
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db  # noqa: E402
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    tag = uuid.uuid4().hex[:12]
+    cursor.execute("""
+        INSERT INTO managers (username, email, mobile_number, password)
+        VALUES (%s, %s, %s, %s)
+    """, (f"stress-{tag}", f"stress-{tag}@example.invalid", tag[:10], 'x'))
+    manager_id = cursor.lastrowid
+    cursor.execute("""
+        INSERT INTO customers (box_number, mobile_number, name, email, password, plan_amount, address, manager_id, is_temp_password, balance)
+        VALUES (%s, %s, %s, NULL, 'x', 199.99, 'Stress Street', %s, FALSE, 0)
+    """, (f"S{tag}", tag[:10], 'Stress Customer', manager_id))
+    customer_id = cursor.lastrowid
+    conn.commit()
+
+    applied = []
+    rejected = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(args.iterations):
+            # Mostly bills, with payments that may race the balance towards zero
+            amount = Decimal('199.99') if rng.random() < 0.6 else -Decimal(rng.randint(1, 40000)) / 100
+            entry_type = 'bill' if amount > 0 else 'payment'
+            success, message = db.update_customer_balance(customer_id, amount, entry_type=entry_type)
+            with lock:
+                (applied if success else rejected).append((amount, message))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected = sum((amount for amount, _ in applied), Decimal('0.00'))
+        cursor.execute("SELECT balance FROM customers WHERE id = %s", (customer_id,))
+        balance = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(SUM(amount), 0) FROM balance_ledger WHERE customer_id = %s", (customer_id,))
+        ledger_balance = cursor.fetchone()[0]
+        reasons = {}
+        for _, message in rejected:
+            reasons[message] = reasons.get(message, 0) + 1
+        print(f"applied={len(applied)} rejected={len(rejected)} {reasons}")
+        print(f"expected={expected} balance={balance} ledger={ledger_balance}")
+        if balance != expected or ledger_balance != expected:
+            print("FAIL: balance drifted from the applied changes")
+            sys.exit(1)
+        print("OK")
+    finally:
+        cursor.execute("DELETE FROM balance_ledger WHERE customer_id = %s", (customer_id,))
+        cursor.execute("DELETE FROM customers WHERE id = %s", (customer_id,))
+        cursor.execute("DELETE FROM managers WHERE id = %s", (manager_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+from db import IST, schedule_billing_runs, bill_next_chunk
+
+# Load environment variables
+load_dotenv()
+
+# Day of the month managers without their own billing_day are billed
+BILLING_DAY = int(os.getenv('BILLING_DAY', 1))
+BILLING_WORKERS = int(os.getenv('BILLING_WORKERS', 4))
+BILLING_CHUNK_SIZE = int(os.getenv('BILLING_CHUNK_SIZE', 500))
+BILLING_POLL_INTERVAL = float(os.getenv('BILLING_POLL_INTERVAL', 5))
+# How often the scheduler looks for managers whose billing day has come
+BILLING_SCHEDULE_INTERVAL = float(os.getenv('BILLING_SCHEDULE_INTERVAL', 300))
+
+BILL_NOTIFICATION_SUBJECT = 'New Bill Generated for Your Time2Due Account'
+
+class BillingWorker:
+    """Scheduler plus a pool of threads billing queued runs chunk by chunk.
+
+    Runs come from two places: the scheduler queues one per manager on their
+    billing day each month, and the dashboard's "bill all" button queues one on
+    demand. Progress is checkpointed per item in the database, so the worker
+    can be stopped or killed at any point and a restart carries on.
+    """
+
+    def __init__(self, workers=BILLING_WORKERS, chunk_size=BILLING_CHUNK_SIZE, schedule=True):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.schedule = schedule
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        if self.schedule:
+            thread = threading.Thread(target=self._schedule, name="billing-scheduler", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"billing-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def _schedule(self):
+        while not self.stop_event.is_set():
+            self.schedule_runs()
+            self.stop_event.wait(BILLING_SCHEDULE_INTERVAL)
+
+    def schedule_runs(self, billing_date=None):
+        billing_date = billing_date or datetime.now(IST).date()
+        queued = schedule_billing_runs(billing_date, BILLING_DAY)
+        if queued:
+            print(f"Queued {queued} billing runs for {billing_date:%Y-%m}")
+        return queued
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            billed = bill_next_chunk(self.chunk_size, BILL_NOTIFICATION_SUBJECT)
+            if not billed:
+                self.stop_event.wait(BILLING_POLL_INTERVAL)
+
+    def drain(self):
+        """Bill everything currently queued on the calling thread."""
+        total = 0
+        while True:
+            billed = bill_next_chunk(self.chunk_size, BILL_NOTIFICATION_SUBJECT)
+            # 0 once nothing is left (finished runs are marked completed on that pass), None on error
+            if not billed:
+                return total
+            total += billed
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run scheduled and queued billing.')
+    parser.add_argument('--once', action='store_true', help='schedule due runs, bill everything queued and exit')
+    parser.add_argument('--no-schedule', action='store_true', help='only bill runs queued from the dashboard')
+    args = parser.parse_args()
+
+    worker = BillingWorker(schedule=not args.no_schedule)
+    if args.once:
+        if worker.schedule:
+            worker.schedule_runs()
+        print(f"Billed {worker.drain()} customers")
+    else:
+        worker.start()
+        print(f"Billing worker running with {worker.workers} workers, billing day {BILLING_DAY}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            worker.stop()
@@ -0,0 +1,230 @@
+import asyncio
+import inspect
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Cache configuration from environment variables. Off unless a backend is
+# chosen: 'redis' is shared by every worker and background process, 'local'
+# is only correct when a single process serves all reads and writes.
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'none')
+CACHE_URL = os.getenv('CACHE_URL', 'redis://localhost:6379/0')
+CACHE_TTL = float(os.getenv('CACHE_TTL', 30))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 2048))
+
+MISS = object()
+
+class LRUBackend:
+    """In-process LRU cache with a per-entry TTL.
+
+    Entries and versions live in this process only, so invalidations made by
+    any other process (another gunicorn worker, billing.py, the mailer or
+    rebalance.py) never reach it. Only use it with a single process.
+    """
+
+    # Calls only take a lock, so coroutines make them on the event loop
+    blocking = False
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Versions are kept apart from the entries so eviction can never reset them
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_version(self, name):
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def bump_version(self, name):
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+class SharedBackend:
+    """Cache shared by all workers through a Redis-compatible client.
+
+    Any object with get(key), set(key, value, ex=seconds) and incr(key) works,
+    so tests can pass a local stand-in instead of a Redis server.
+    """
+
+    # Every call is a network round trip, so coroutines make them on a worker thread
+    blocking = True
+
+    def __init__(self, client, ttl=CACHE_TTL, prefix='manager:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.evictions = 0
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return MISS if raw is None else pickle.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(1, int(self.ttl)))
+
+    def get_version(self, name):
+        raw = self.client.get(self.prefix + 'version:' + name)
+        return int(raw) if raw is not None else 0
+
+    def bump_version(self, name):
+        self.client.incr(self.prefix + 'version:' + name)
+
+class ManagerCache:
+    """Read-through cache of per-manager query results with versioned keys.
+
+    Every key embeds the manager's current version, so invalidate() only has to
+    bump that version; entries under old versions are never read again and
+    age out through TTL or LRU eviction.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def _version_name(self, manager_id):
+        return f"manager:{manager_id}"
+
+    def cached(self, name, cache_if=lambda result: result is not None, fill_when=None):
+        """Decorate a db function whose `manager_id` argument scopes its result.
+
+        Coroutine functions are supported too; an async function with the same
+        name and arguments shares its entries with the sync one, and reaches a
+        blocking backend from a worker thread. When given,
+        `fill_when()` is asked before each call whether its result may be
+        stored; results it refuses are still served from entries already there.
+        """
+        def decorator(f):
+            signature = inspect.signature(f)
+
+            if inspect.iscoroutinefunction(f):
+                @wraps(f)
+                async def wrap_async(*args, **kwargs):
+                    key, value = await self._off_loop(self._read, name, signature, args, kwargs)
+                    if value is not MISS:
+                        return value
+                    fill = fill_when is None or fill_when()
+                    value = await f(*args, **kwargs)
+                    if fill:
+                        await self._off_loop(self._write, key, value, cache_if)
+                    return value
+                return wrap_async
+
+            @wraps(f)
+            def wrap(*args, **kwargs):
+                key, value = self._read(name, signature, args, kwargs)
+                if value is not MISS:
+                    return value
+                fill = fill_when is None or fill_when()
+                value = f(*args, **kwargs)
+                if fill:
+                    self._write(key, value, cache_if)
+                return value
+            return wrap
+        return decorator
+
+    async def _off_loop(self, fn, *args):
+        if getattr(self.backend, 'blocking', False):
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def _read(self, name, signature, args, kwargs):
+        """Return (key, cached value or MISS); key is None when the call bypasses the cache."""
+        if self.backend is None:
+            return None, MISS
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        manager_id = arguments.pop('manager_id', None)
+        if manager_id is None:
+            return None, MISS
+        try:
+            version = self.backend.get_version(self._version_name(manager_id))
+            key = f"{name}:{manager_id}:{version}:{sorted(arguments.items())!r}"
+            value = self.backend.get(key)
+        except Exception as e:
+            self._count('errors')
+            print(f"Cache read failed: {str(e)}")
+            return None, MISS
+        self._count('hits' if value is not MISS else 'misses')
+        return key, value
+
+    def _write(self, key, value, cache_if):
+        if key is None or not cache_if(value):
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            self._count('errors')
+            print(f"Cache write failed: {str(e)}")
+
+    def invalidate(self, manager_id):
+        if self.backend is None or manager_id is None:
+            return
+        try:
+            self.backend.bump_version(self._version_name(manager_id))
+            self._count('invalidations')
+        except Exception as e:
+            self._count('errors')
+            print(f"Cache invalidation failed: {str(e)}")
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': type(self.backend).__name__ if self.backend else 'none',
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'errors': self.errors,
+                'evictions': getattr(self.backend, 'evictions', 0),
+            }
+
+def create_backend():
+    if CACHE_BACKEND == 'redis':
+        if redis is None:
+            print("CACHE_BACKEND=redis but the redis package is not installed; caching is off")
+            return None
+        return SharedBackend(redis.Redis.from_url(CACHE_URL))
+    if CACHE_BACKEND == 'local':
+        return LRUBackend()
+    return None
+
+manager_cache = ManagerCache(create_backend())
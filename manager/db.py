@@ -1,39 +1,428 @@
 import os
-import mysql.connector
+import json
+import base64
+import calendar
+import contextvars
+import inspect
+import itertools
+import time
 from mysql.connector import Error
-from mysql.connector.pooling import MySQLConnectionPool
-from flask_bcrypt import check_password_hash
-from datetime import datetime
+from pool import ConnectionPool, ReplicaRouter
+from cache import manager_cache
+from flask import g, has_app_context, has_request_context, session
+from passwords import verify_password
+from throttle import login_throttle
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 import pytz
 
 # Set timezone to Asia/Kolkata
 IST = pytz.timezone('Asia/Kolkata')
 
-# Database configuration from environment variables
+CENT = Decimal('0.01')
+
 # Database configuration from environment variables
 db_config = {
     'host': os.getenv('DB_HOST', 'localhost'),
     'database': os.getenv('DB_NAME', ''),
     'user': os.getenv('DB_USER', 'root'),
     'password': os.getenv('DB_PASSWORD', 'root'),
-    'port': int(os.getenv('DB_PORT', 3306))
+    'port': int(os.getenv('DB_PORT', 3306)),
+    # Applied when a pooled connection is opened, so queries never need SET time_zone
+    'time_zone': os.getenv('DB_TIME_ZONE', 'Asia/Kolkata')
 }
 
-# Create single connection pool
-connection_pool = MySQLConnectionPool(pool_name="main_pool", pool_size=5, **db_config)
+# Connection pool settings; connections are only opened when first needed
+pool_config = {
+    'size': int(os.getenv('DB_POOL_SIZE', 5)),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+    'recycle': float(os.getenv('DB_POOL_RECYCLE', 3600)),
+    'ping_after': float(os.getenv('DB_POOL_PING_AFTER', 30))
+}
 
-def get_connection():
+# Extra database nodes ("shards") as comma-separated number=host[:port][/database].
+# Every row of a manager lives on one shard. Shard 0 is the DB_* database: it
+# also holds the manager accounts, pending signups and the manager_shards
+# directory, and managers missing from the directory live there. Managers are
+# placed on a shard when approved and moved between shards with rebalance.py.
+MAIN_SHARD = 0
+# Each shard hands out AUTO_INCREMENT ids in its own residue class modulo the
+# stride, so ids are unique across shards and rows keep them when they move
+SHARD_ID_STRIDE = int(os.getenv('DB_SHARD_ID_STRIDE', 16))
+
+def _parse_shards(value):
+    configs = {MAIN_SHARD: db_config}
+    for spec in filter(None, (spec.strip() for spec in value.split(','))):
+        number, _, location = spec.partition('=')
+        address, _, database = location.partition('/')
+        host, _, port = address.partition(':')
+        if not 0 < int(number) < SHARD_ID_STRIDE:
+            raise ValueError(f"DB_SHARDS: shard numbers must be between 1 and {SHARD_ID_STRIDE - 1}")
+        configs[int(number)] = dict(db_config, host=host, port=int(port or db_config['port']),
+                                    database=database or db_config['database'])
+    return configs
+
+shard_configs = _parse_shards(os.getenv('DB_SHARDS', ''))
+SHARDED = len(shard_configs) > 1
+
+def shard_session_sql(shard):
+    """Statements run on every connection to `shard` so the ids it generates never collide."""
+    if not SHARDED:
+        return ()
+    return (f"SET SESSION auto_increment_increment = {SHARD_ID_STRIDE}",
+            f"SET SESSION auto_increment_offset = {shard + 1}")
+
+shard_pools = {
+    shard: ConnectionPool(config, session_sql=shard_session_sql(shard), **pool_config)
+    for shard, config in shard_configs.items()
+}
+connection_pool = shard_pools[MAIN_SHARD]
+
+# Read replicas of shard 0 as comma-separated host[:port]; without any every query goes to the primary.
+# The replica user needs REPLICATION CLIENT so lag can be read from SHOW REPLICA STATUS.
+replica_addresses = [address.strip() for address in os.getenv('DB_REPLICA_HOSTS', '').split(',') if address.strip()]
+replica_pool_config = dict(pool_config, size=int(os.getenv('DB_REPLICA_POOL_SIZE', pool_config['size'])))
+
+def _replica_config(address):
+    host, _, port = address.partition(':')
+    return dict(db_config, host=host, port=int(port or db_config['port']),
+                user=os.getenv('DB_REPLICA_USER', db_config['user']),
+                password=os.getenv('DB_REPLICA_PASSWORD', db_config['password']))
+
+replicas = ReplicaRouter(
+    [(address, ConnectionPool(_replica_config(address), **replica_pool_config)) for address in replica_addresses],
+    max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', 5)),
+    check_interval=float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', 5)),
+    retry_after=float(os.getenv('DB_REPLICA_RETRY_AFTER', 30)),
+    # Seconds a read waits for a busy replica's pool before trying the next replica or the primary
+    checkout_timeout=float(os.getenv('DB_REPLICA_CHECKOUT_TIMEOUT', 0)),
+    # Only for test setups: treat a server that is not replicating as an up-to-date replica
+    allow_standalone=os.getenv('DB_REPLICA_ALLOW_STANDALONE', '0') == '1',
+) if replica_addresses else None
+
+# Seconds a browser session keeps reading from the primary after one of its requests wrote
+READ_YOUR_WRITES_WINDOW = float(os.getenv('DB_READ_YOUR_WRITES_WINDOW', 5))
+PRIMARY_UNTIL_KEY = 'db_primary_until'
+
+# Set while a replica_read function runs outside a request
+_replica_read = contextvars.ContextVar('db_replica_read', default=False)
+
+# Start read-only request transactions with START TRANSACTION READ ONLY
+READ_ONLY_TRANSACTIONS = os.getenv('DB_READ_ONLY_TRANSACTIONS', '1') == '1'
+
+# Shard the db calls of the current context run against, and whether the
+# manager they serve is frozen by rebalance.py
+_current_shard = contextvars.ContextVar('db_shard', default=MAIN_SHARD)
+_shard_frozen = contextvars.ContextVar('db_shard_frozen', default=False)
+
+# Seconds a process trusts its cached directory entries; rebalance.py waits
+# this long after each change to the directory before relying on it
+SHARD_MAP_TTL = float(os.getenv('DB_SHARD_MAP_TTL', 10))
+
+MANAGER_SHARD_QUERY = "SELECT shard, frozen FROM manager_shards WHERE manager_id = %s"
+FROZEN_MANAGERS_QUERY = "SELECT manager_id FROM manager_shards WHERE frozen"
+CUSTOMER_MANAGER_QUERY = "SELECT manager_id FROM customers WHERE id = %s"
+
+# manager_id -> (expires at, (shard, frozen))
+_shard_map = {}
+# (expires at, ids of the frozen managers)
+_frozen_cache = (0, ())
+# Rotates the shard claim_pending_emails starts from
+_claim_rotation = itertools.count()
+
+# Threads running the per-shard calls of fan_out
+_fan_out_executor = ThreadPoolExecutor(max_workers=4 * len(shard_configs), thread_name_prefix='db-shard') if SHARDED else None
+
+def _checkout(read_only=False, shard=MAIN_SHARD):
+    """Check out a pooled connection to `shard`; read-only ones come from a replica when one is usable.
+
+    Returns None when the connection fails or the shard could not be looked up.
+    """
+    if shard is None:
+        return None
     try:
-        return connection_pool.get_connection()
+        if read_only and replicas is not None and shard == MAIN_SHARD:
+            conn = replicas.get_connection()
+            if conn:
+                return conn
+        return shard_pools[shard].get_connection()
     except Error as e:
         print(f"Error getting connection: {str(e)}")
         return None
+
+def _node_query(statement, query, params=(), shard=MAIN_SHARD):
+    """Run one statement on a shard's primary in a transaction of its own; returns its rows."""
+    conn = shard_pools[shard].get_connection()
+    try:
+        cursor = conn.cursor(statement=statement)
+        cursor.execute(query, params)
+        rows = cursor.fetchall() if cursor.with_rows else []
+        conn.commit()
+        return rows
+    finally:
+        cursor.close()
+        conn.close()
+
+def cached_manager_shard(manager_id):
+    """Return the cached (shard, frozen) of a manager, or None when it has to be read."""
+    entry = _shard_map.get(manager_id)
+    return entry[1] if entry and entry[0] > time.monotonic() else None
+
+def remember_manager_shard(manager_id, row):
+    """Cache a manager's directory row, None if it has none; returns (shard, frozen)."""
+    location = (row[0], bool(row[1])) if row else (MAIN_SHARD, False)
+    _shard_map[manager_id] = (time.monotonic() + SHARD_MAP_TTL, location)
+    return location
+
+def manager_shard(manager_id):
+    """Return (shard, frozen) for a manager, cached for DB_SHARD_MAP_TTL seconds."""
+    if not SHARDED:
+        return MAIN_SHARD, False
+    location = cached_manager_shard(manager_id)
+    if location is None:
+        rows = _node_query('manager_shard', MANAGER_SHARD_QUERY, (manager_id,))
+        location = remember_manager_shard(manager_id, rows[0] if rows else None)
+    return location
+
+def frozen_managers():
+    """Ids of the managers rebalance.py is moving, which the background workers leave alone."""
+    global _frozen_cache
+    if not SHARDED:
+        return ()
+    expires, manager_ids = _frozen_cache
+    if expires <= time.monotonic():
+        manager_ids = tuple(row[0] for row in _node_query('frozen_managers', FROZEN_MANAGERS_QUERY))
+        _frozen_cache = (time.monotonic() + SHARD_MAP_TTL, manager_ids)
+    return manager_ids
+
+def _frozen_filter(column):
+    """SQL condition and params leaving out the rows of frozen managers."""
+    manager_ids = frozen_managers()
+    if not manager_ids:
+        return '', []
+    placeholders = ', '.join(['%s'] * len(manager_ids))
+    return f"AND ({column} IS NULL OR {column} NOT IN ({placeholders}))", list(manager_ids)
+
+@contextmanager
+def on_shard(shard, frozen=False):
+    """Run the db calls in the block against `shard`; while `frozen` their commits fail."""
+    shard_token = _current_shard.set(shard)
+    frozen_token = _shard_frozen.set(frozen)
+    try:
+        yield
+    finally:
+        _shard_frozen.reset(frozen_token)
+        _current_shard.reset(shard_token)
+
+@contextmanager
+def for_manager(manager_id):
+    """Run the db calls in the block on the shard of `manager_id`, shard 0 for None."""
+    try:
+        shard, frozen = manager_shard(manager_id) if manager_id is not None else (MAIN_SHARD, False)
+    except Error as e:
+        print(f"Error looking up shard: {str(e)}")
+        shard, frozen = None, False
+    with on_shard(shard, frozen):
+        yield
+
+def fan_out(f, *args, **kwargs):
+    """Call f on every shard at once; returns {shard: result}."""
+    if not SHARDED:
+        return {MAIN_SHARD: f(*args, **kwargs)}
+
+    def call(shard):
+        with on_shard(shard):
+            return f(*args, **kwargs)
+
+    futures = {shard: _fan_out_executor.submit(call, shard) for shard in sorted(shard_pools)}
+    return {shard: future.result() for shard, future in futures.items()}
+
+def _customer_manager_id(customer_id):
+    """Find a customer's manager by asking every shard; None if no shard has the customer."""
+    results = fan_out(lambda: _node_query('customer_manager_id', CUSTOMER_MANAGER_QUERY, (customer_id,), _current_shard.get()))
+    return next((rows[0][0] for rows in results.values() if rows), None)
+
+def sharded(f):
+    """Run f on the shard that holds its manager's rows.
+
+    The manager is f's manager_id argument or, failing that, the owner of its
+    customer_id. A call naming neither runs on every shard and the returned
+    lists are concatenated.
+    """
+    signature = inspect.signature(f)
+
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        if not SHARDED:
+            return f(*args, **kwargs)
+        arguments = signature.bind(*args, **kwargs).arguments
+        manager_id = arguments.get('manager_id')
+        customer_id = arguments.get('customer_id')
+        if manager_id is None and customer_id is None:
+            results = list(fan_out(f, *args, **kwargs).values())
+            return None if None in results else [row for rows in results for row in rows]
+        if manager_id is None:
+            try:
+                manager_id = _customer_manager_id(customer_id)
+            except Error as e:
+                print(f"Error looking up customer's manager: {str(e)}")
+        with for_manager(manager_id):
+            return f(*args, **kwargs)
+    return wrap
+
+def on_every_shard(combine):
+    """Run the decorated function on every shard and merge the list of results with combine."""
+    def decorator(f):
+        @wraps(f)
+        def wrap(*args, **kwargs):
+            return combine(list(fan_out(f, *args, **kwargs).values()))
+        return wrap
+    return decorator
+
+def _first_found(results):
+    return next((result for result in results if result is not None), None)
+
+def _total(results):
+    return None if None in results else sum(results)
+
+def _first_failure(results):
+    return next((result for result in results if not result[0]), results[0])
+
+class RequestConnection:
+    """Request-scoped connection shared by every db call in a request.
+
+    close() is a no-op; the connection goes back to the pool when the app
+    context is torn down.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        # Pins the session to the primary for READ_YOUR_WRITES_WINDOW after the response
+        g.db_wrote = True
+        return self._conn.commit()
+
+    def close(self):
+        pass
+
+class FrozenConnection:
+    """Connection serving a manager that rebalance.py is moving: reads work, commits fail."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def commit(self):
+        raise Error(msg="This account is being moved to another database server; please try again shortly")
+
+def _replica_allowed():
+    """False while the current browser session is inside its read-your-writes window."""
+    return not (has_request_context() and session.get(PRIMARY_UNTIL_KEY, 0) > time.time())
+
+def _reads_primary():
+    """True when a replica_read function called now is sure to read from the primary.
+
+    Only such reads may fill manager_cache: a lagging replica could otherwise
+    store rows from before a write under the version that write bumped.
+    """
+    if replicas is None:
+        return True
+    if has_app_context() and g.get('db_request_scope'):
+        return not g.get('db_read_only') or not _replica_allowed()
+    return False
+
+def get_connection():
+    """Return a pooled connection to the current shard, reusing the request's inside Flask requests.
+
+    A request keeps one connection per shard it touches. Its shard 0
+    connection comes from a replica when the route is marked with
+    read_only_request; outside requests, functions marked with replica_read
+    use one. Either way the primary is used when no replica is healthy.
+    """
+    shard = _current_shard.get()
+    if not (has_app_context() and g.get('db_request_scope')):
+        conn = _checkout(_replica_read.get(), shard)
+    else:
+        conn = _request_connection(shard)
+    if conn and _shard_frozen.get():
+        return FrozenConnection(conn)
+    return conn
+
+def _request_connection(shard):
+    conns = g.setdefault('db_conns', {})
+    if shard not in conns:
+        conn = _checkout(bool(g.get('db_read_only')) and _replica_allowed(), shard)
+        if not conn:
+            return None
+        if g.get('db_read_only') and READ_ONLY_TRANSACTIONS:
+            try:
+                conn.start_transaction(readonly=True)
+            except Error as e:
+                print(f"Error starting read-only transaction: {str(e)}")
+        conns[shard] = conn
+    return RequestConnection(conns[shard])
+
+def release_request_connection(exception=None):
+    for conn in g.pop('db_conns', {}).values():
+        conn.close()
+
+def init_app(app):
+    """Give every request of `app` a single connection per shard, checked out on first use."""
+    @app.before_request
+    def start_request_scope():
+        g.db_request_scope = True
+
+    @app.after_request
+    def pin_session_to_primary(response):
+        if replicas is not None and g.get('db_wrote'):
+            session[PRIMARY_UNTIL_KEY] = time.time() + READ_YOUR_WRITES_WINDOW
+        return response
+
+    app.teardown_appcontext(release_request_connection)
+
+def read_only_request(f):
+    """Mark a route as read-only so its connection runs in a READ ONLY transaction on a replica."""
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        g.db_read_only = True
+        return f(*args, **kwargs)
+    return wrap
+
+def replica_read(f):
+    """Let f read from a replica when called outside a request; inside one the route decides."""
+    @wraps(f)
+    def wrap(*args, **kwargs):
+        token = _replica_read.set(True)
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _replica_read.reset(token)
+    return wrap
+
+def get_pool_stats():
+    return connection_pool.stats()
+
+def get_shard_pool_stats():
+    """Pool stats of every shard other than 0, which get_pool_stats covers."""
+    return {shard: pool.stats() for shard, pool in shard_pools.items() if shard != MAIN_SHARD}
+
+def get_replica_stats():
+    return replicas.stats() if replicas is not None else None
 def get_user_by_email_and_password(email, password):
     conn = get_connection()
     if not conn:
         return None
     try:
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor(dictionary=True, statement='get_user_by_email_and_password')
         cursor.execute("SELECT * FROM users WHERE email = %s AND password = %s", (email, password))
         user = cursor.fetchone()
         return user
@@ -41,43 +430,77 @@ def get_user_by_email_and_password(email, password):
         cursor.close()
         conn.close()
 
+MANAGER_LOGIN_QUERY = "SELECT id, password FROM managers WHERE email = %s"
+MANAGER_REHASH_QUERY = "UPDATE managers SET password = %s WHERE id = %s"
+
 def get_manager_by_email_and_password(email, password):
+    # Emails recently found to have no account skip both the query and bcrypt
+    if login_throttle.is_unknown_email(email):
+        return None
     conn = get_connection()
     if not conn:
         return None
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM managers WHERE email = %s", (email,))
+        cursor = conn.cursor(dictionary=True, statement='get_manager_by_email_and_password')
+        cursor.execute(MANAGER_LOGIN_QUERY, (email,))
         manager = cursor.fetchone()
-        if manager and check_password_hash(manager['password'], password):
-            return manager
-        return None
+        if not manager:
+            login_throttle.remember_unknown_email(email)
+            return None
+        matches, new_hash = verify_password(manager['password'], password)
+        if not matches:
+            return None
+        if new_hash and _rehash_allowed(manager['id']):
+            # The cost factor changed since this hash was stored; save the upgraded hash
+            cursor.execute(MANAGER_REHASH_QUERY, (new_hash, manager['id']))
+            conn.commit()
+        return manager
     finally:
         cursor.close()
         conn.close()
 
+def _rehash_allowed(manager_id):
+    """False while rebalance.py is moving the manager, so its rows do not change mid-copy."""
+    try:
+        return manager_id not in frozen_managers()
+    except Error as e:
+        print(f"Error checking frozen managers: {str(e)}")
+        return False
+
+# Customers of every shard share one login form
+@on_every_shard(_first_found)
 def get_customer_by_mobile_and_password(mobile_number, password):
     conn = get_connection()
     if not conn:
         return None
     try:
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor(dictionary=True, statement='get_customer_by_mobile_and_password')
         cursor.execute("SELECT * FROM customers WHERE mobile_number = %s", (mobile_number,))
         customer = cursor.fetchone()
-        if customer and check_password_hash(customer['password'], password):
-            return customer
-        return None
+        if not customer:
+            return None
+        matches, new_hash = verify_password(customer['password'], password)
+        if not matches:
+            return None
+        # fan_out does not apply the freeze, so a frozen manager's customers keep their old hash until moved
+        if new_hash and _rehash_allowed(customer['manager_id']):
+            cursor.execute("UPDATE customers SET password = %s WHERE id = %s", (new_hash, customer['id']))
+            conn.commit()
+        return customer
     finally:
         cursor.close()
         conn.close()
 
+@manager_cache.cached('all_customers', fill_when=_reads_primary)
+@replica_read
+@sharded
 def get_all_customers(customer_id=None, manager_id=None):
     conn = get_connection()
     if not conn:
         print("Database connection failed in get_all_customers")
-        return []
+        return None
     try:
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor(dictionary=True, statement='get_all_customers')
         if customer_id:
             cursor.execute("""
                 SELECT id, box_number, mobile_number, name, email, plan_amount, address, created_at, manager_id, balance, is_temp_password
@@ -97,25 +520,134 @@ def get_all_customers(customer_id=None, manager_id=None):
         return customers if customers else []
     except Error as e:
         print(f"Error fetching customers: {str(e)}")
-        return []
+        return None
     finally:
         cursor.close()
         conn.close()
 
-def get_payment_history(manager_id):
+@sharded
+def get_customer(customer_id, manager_id):
+    """Fetch one customer by primary key, only if it belongs to the manager."""
     conn = get_connection()
     if not conn:
-        print("Database connection failed in get_payment_history")
-        return []
+        print("Database connection failed in get_customer")
+        return None
     try:
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor(dictionary=True, statement='get_customer')
         cursor.execute("""
-            SELECT p.id, p.customer_id, p.amount, p.payment_mode, p.payment_status, p.payment_date
-            FROM payments p
-            JOIN customers c ON p.customer_id = c.id
-            WHERE c.manager_id = %s
-            ORDER BY p.payment_date DESC
-        """, (manager_id,))
+            SELECT id, box_number, mobile_number, name, email, plan_amount, address, created_at, manager_id, balance, is_temp_password
+            FROM customers WHERE id = %s AND manager_id = %s
+        """, (customer_id, manager_id))
+        return cursor.fetchone()
+    except Error as e:
+        print(f"Error fetching customer: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+# Sortable columns for the paginated customer listing; each is backed by a
+# (manager_id, column, id) index
+CUSTOMER_SORT_COLUMNS = ('box_number', 'name', 'mobile_number', 'balance')
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def decode_cursor(cursor):
+    """Return the list encode_cursor was given, or None for anything else a client sends."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+def _customers_page_query(manager_id, sort, direction, search, status, balance, balance_op, cursor, limit):
+    """Build the keyset-paginated customer query; returns (query, params, sort column)."""
+    if sort not in CUSTOMER_SORT_COLUMNS:
+        sort = 'box_number'
+    descending = direction == 'desc'
+    where = ["manager_id = %s"]
+    params = [manager_id]
+    if search:
+        prefix = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append("(box_number LIKE %s OR name LIKE %s OR mobile_number LIKE %s)")
+        params.extend([prefix, prefix, prefix])
+    if status == 'paid':
+        where.append("balance = 0")
+    elif status == 'unpaid':
+        where.append("balance > 0")
+    if balance is not None and balance_op in ('gte', 'lte', 'eq'):
+        where.append(f"balance {({'gte': '>=', 'lte': '<=', 'eq': '='})[balance_op]} %s")
+        params.append(balance)
+    after = decode_cursor(cursor) if cursor else None
+    if after and len(after) == 2:
+        op = '<' if descending else '>'
+        where.append(f"({sort} {op} %s OR ({sort} = %s AND id {op} %s))")
+        params.extend([after[0], after[0], after[1]])
+    order = 'DESC' if descending else 'ASC'
+    query = f"""
+        SELECT id, box_number, mobile_number, name, email, plan_amount, address, balance
+        FROM customers
+        WHERE {' AND '.join(where)}
+        ORDER BY {sort} {order}, id {order}
+        LIMIT %s
+    """
+    return query, params + [limit + 1], sort
+
+def _next_page(rows, limit, cursor_values):
+    """Drop the extra row fetched past `limit`; return (rows, cursor for the next page)."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(cursor_values(rows[-1]))
+
+@manager_cache.cached('customers_page', cache_if=lambda result: result[0] is not None,
+                      fill_when=_reads_primary)
+@replica_read
+@sharded
+def get_customers_page(manager_id, sort='box_number', direction='asc', search=None, status=None,
+                       balance=None, balance_op=None, cursor=None, limit=50):
+    """Return one page of a manager's customers and the cursor for the next page.
+
+    Pages are keyed on (sort column, id) rather than OFFSET, so every page costs
+    the same no matter how deep into the list it is. `search` is a prefix match
+    on box number, name or mobile number.
+    """
+    conn = get_connection()
+    if not conn:
+        print("Database connection failed in get_customers_page")
+        return None, None
+    try:
+        cur = conn.cursor(dictionary=True, statement='get_customers_page')
+        query, params, sort = _customers_page_query(manager_id, sort, direction, search, status, balance, balance_op, cursor, limit)
+        cur.execute(query, params)
+        return _next_page(cur.fetchall(), limit, lambda last: [last[sort], last['id']])
+    except Error as e:
+        print(f"Error fetching customers page: {str(e)}")
+        return None, None
+    finally:
+        cur.close()
+        conn.close()
+
+@manager_cache.cached('payment_history', fill_when=_reads_primary)
+@replica_read
+@sharded
+def get_payment_history(manager_id, start_date=None):
+    """Return a manager's bill history, newest first, from start_date onwards.
+
+    Without a start_date only the last PAYMENT_HISTORY_MONTHS months are read.
+    """
+    conn = get_connection()
+    if not conn:
+        print("Database connection failed in get_payment_history")
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True, statement='get_payment_history')
+        where, params, start_date = _payment_filters(manager_id, start_date=start_date)
+        query, params = _history_query(
+            "p.id, p.customer_id, p.amount, p.payment_mode, p.payment_status, p.payment_date",
+            where, params, start_date, 'DESC')
+        cursor.execute(query, params)
         payments = cursor.fetchall()
         for payment in payments:
             if isinstance(payment['payment_date'], str):
@@ -123,23 +655,211 @@ def get_payment_history(manager_id):
         return payments if payments else []
     except Error as e:
         print(f"Error fetching payment history: {str(e)}")
-        return []
+        return None
     finally:
         cursor.close()
         conn.close()
 
+PAYMENT_STATUSES = ('completed', 'pending', 'failed')
+
+# Bill history reads this many months (including the current one) unless given an older start date
+PAYMENT_HISTORY_MONTHS = int(os.getenv('PAYMENT_HISTORY_MONTHS', 12))
+# Months older than this are moved to payments_archive by `python partitions.py maintain`
+PAYMENT_ARCHIVE_MONTHS = int(os.getenv('PAYMENT_ARCHIVE_MONTHS', 24))
+
+def month_start(months_back, today=None):
+    """First day of the month months_back months before today's (IST)."""
+    today = today or datetime.now(IST).date()
+    index = today.year * 12 + today.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+def archive_cutoff(today=None):
+    """Payments dated before this day may have been moved to payments_archive."""
+    return month_start(PAYMENT_ARCHIVE_MONTHS, today)
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    return value
+
+def _payment_filters(manager_id, status=None, customer_id=None, mobile_number=None, start_date=None, end_date=None):
+    """Build the WHERE conditions and parameters shared by bill history queries.
+
+    Returns (where, params, start_date). Without a start_date the history is
+    limited to the last PAYMENT_HISTORY_MONTHS months, so queries only touch
+    the newest monthly partitions of payments.
+    """
+    start_date = _as_date(start_date) or month_start(PAYMENT_HISTORY_MONTHS - 1)
+    where = ["p.manager_id = %s"]
+    params = [manager_id]
+    if status in PAYMENT_STATUSES:
+        where.append("p.payment_status = %s")
+        params.append(status)
+    if customer_id:
+        where.append("p.customer_id = %s")
+        params.append(customer_id)
+    if mobile_number:
+        where.append("""p.customer_id IN (
+            SELECT id FROM customers WHERE manager_id = %s AND mobile_number LIKE %s
+        )""")
+        params.extend([manager_id, mobile_number.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'])
+    where.append("p.payment_date >= %s")
+    params.append(start_date)
+    if end_date:
+        where.append("p.payment_date < %s + INTERVAL 1 DAY")
+        params.append(end_date)
+    return where, params, start_date
+
+def _history_query(columns, where, params, start_date, order, limit=None):
+    """Select columns from the bill history rows matching where, ordered by (payment_date, id).
+
+    payments_archive is only read when start_date reaches back before the
+    archive cutoff. In that case each table is filtered, ordered and limited on
+    its own (manager_id, payment_date, id) index before the two are merged.
+    """
+    limit_clause = "LIMIT %s" if limit else ""
+    limit_params = [limit] if limit else []
+
+    def branch(table):
+        return f"""
+            SELECT {columns}
+            FROM {table} p
+            WHERE {' AND '.join(where)}
+            ORDER BY p.payment_date {order}, p.id {order}
+            {limit_clause}
+        """
+
+    if start_date >= archive_cutoff():
+        return branch('payments'), params + limit_params
+    query = f"""
+        SELECT * FROM (({branch('payments')}) UNION ALL ({branch('payments_archive')})) p
+        ORDER BY p.payment_date {order}, p.id {order}
+        {limit_clause}
+    """
+    return query, (params + limit_params) * 2 + limit_params
+
+def _payments_page_query(manager_id, status, customer_id, mobile_number, start_date, end_date, direction, cursor, limit):
+    """Build the keyset-paginated bill history query; returns (query, params)."""
+    descending = direction != 'asc'
+    where, params, start_date = _payment_filters(manager_id, status, customer_id, mobile_number, start_date, end_date)
+    after = decode_cursor(cursor) if cursor else None
+    if after and len(after) == 2:
+        op = '<' if descending else '>'
+        where.append(f"(p.payment_date {op} %s OR (p.payment_date = %s AND p.id {op} %s))")
+        params.extend([after[0], after[0], after[1]])
+    order = 'DESC' if descending else 'ASC'
+    return _history_query("p.id, p.customer_id, p.amount, p.payment_mode, p.payment_status, p.payment_date",
+                          where, params, start_date, order, limit + 1)
+
+def _payment_cursor(last):
+    return [str(last['payment_date']), last['id']]
+
+@manager_cache.cached('payments_page', cache_if=lambda result: result[0] is not None,
+                      fill_when=_reads_primary)
+@replica_read
+@sharded
+def get_payments_page(manager_id, status=None, customer_id=None, mobile_number=None, start_date=None,
+                      end_date=None, direction='desc', cursor=None, limit=50):
+    """Return one page of a manager's bill history and the cursor for the next page.
+
+    Filters are applied in SQL and pages are keyed on (payment_date, id), so the
+    query walks the (manager_id, payment_date, id) index instead of sorting the
+    manager's whole history. `end_date` is inclusive of the whole day, and
+    without a `start_date` only the last PAYMENT_HISTORY_MONTHS are listed.
+    """
+    conn = get_connection()
+    if not conn:
+        print("Database connection failed in get_payments_page")
+        return None, None
+    try:
+        cur = conn.cursor(dictionary=True, statement='get_payments_page')
+        query, params = _payments_page_query(manager_id, status, customer_id, mobile_number, start_date, end_date, direction, cursor, limit)
+        cur.execute(query, params)
+        return _next_page(cur.fetchall(), limit, _payment_cursor)
+    except Error as e:
+        print(f"Error fetching payments page: {str(e)}")
+        return None, None
+    finally:
+        cur.close()
+        conn.close()
+
+def _stream_rows(statement, query, params, batch_size, read_only=False, shard=MAIN_SHARD):
+    """Yield rows of a query from an unbuffered cursor, batch_size rows at a time.
+
+    Uses its own pooled connection rather than the request's, because the rows
+    are consumed while the response is streamed after the view has returned.
+    If the consumer stops early the connection cannot be reused and is dropped
+    by the pool. The shard is passed in because the body only runs once the
+    caller's shard context is gone.
+    """
+    conn = _checkout(read_only, shard)
+    if not conn:
+        raise Error("Database connection failed")
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True, buffered=False, statement=statement)
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        try:
+            if cursor is not None:
+                cursor.close()
+        except Error:
+            pass
+        conn.close()
+
+CUSTOMER_EXPORT_QUERY = """
+    SELECT id, box_number, mobile_number, name, email, plan_amount, address, balance, created_at
+    FROM customers WHERE manager_id = %s
+    ORDER BY box_number, id
+"""
+
+@sharded
+def iter_customers(manager_id, batch_size=1000):
+    return _stream_rows('iter_customers', CUSTOMER_EXPORT_QUERY, (manager_id,), batch_size, _replica_allowed(), _current_shard.get())
+
+def _payments_export_query(manager_id, status, customer_id, mobile_number, start_date, end_date, direction):
+    where, params, start_date = _payment_filters(manager_id, status, customer_id, mobile_number, start_date, end_date)
+    order = 'ASC' if direction == 'asc' else 'DESC'
+    history, params = _history_query(
+        "p.id, p.customer_id, p.amount, p.payment_mode, p.payment_status, p.payment_reference, p.payment_date",
+        where, params, start_date, order)
+    return f"""
+        SELECT p.id, p.customer_id, c.box_number, c.name, c.mobile_number,
+               p.amount, p.payment_mode, p.payment_status, p.payment_reference, p.payment_date
+        FROM ({history}) p
+        JOIN customers c ON c.id = p.customer_id
+        ORDER BY p.payment_date {order}, p.id {order}
+    """, params
+
+@sharded
+def iter_payments(manager_id, status=None, customer_id=None, mobile_number=None, start_date=None,
+                  end_date=None, direction='desc', batch_size=1000):
+    """Stream a manager's bill history with the same filters as get_payments_page."""
+    query, params = _payments_export_query(manager_id, status, customer_id, mobile_number, start_date, end_date, direction)
+    return _stream_rows('iter_payments', query, params, batch_size, _replica_allowed(), _current_shard.get())
+
+@sharded
 def add_customer(box_number, mobile_number, name, email, password, plan_amount, address, manager_id, is_temp_password=False):
     conn = get_connection()
     if not conn:
         print("Database connection failed in add_customer")
         return False, "Database connection failed"
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(statement='add_customer')
         cursor.execute("""
             INSERT INTO customers (box_number, mobile_number, name, email, password, plan_amount, address, manager_id, is_temp_password)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """, (box_number, mobile_number, name, email, password, plan_amount, address, manager_id, is_temp_password))
+        _summary_apply_customers(cursor, manager_id, "id = %s", (cursor.lastrowid,))
         conn.commit()
+        manager_cache.invalidate(manager_id)
         return True, "Customer added successfully"
     except Error as e:
         conn.rollback()
@@ -149,25 +869,295 @@ def add_customer(box_number, mobile_number, name, email, password, plan_amount,
         cursor.close()
         conn.close()
 
-def update_customer(customer_id, box_number, mobile_number, name, email, password, plan_amount, address, is_temp_password):
+@sharded
+def add_customers_bulk(manager_id, customers):
+    """Insert a batch of customers in one transaction.
+
+    `customers` are dicts with the add_customer fields (password already hashed)
+    and the source `row` number. Rows whose box or mobile number already exists
+    for the manager are reported instead of inserted. If the batch insert fails,
+    rows are retried one by one so a single bad row does not reject the batch.
+    Returns (inserted, errors) where errors is a list of (row, message).
+    """
+    if not customers:
+        return [], []
+    conn = get_connection()
+    if not conn:
+        return [], [(c['row'], "Database connection failed") for c in customers]
+    errors = []
+    try:
+        cursor = conn.cursor(statement='add_customers_bulk')
+        placeholders = ', '.join(['%s'] * len(customers))
+        cursor.execute(f"""
+            SELECT box_number, mobile_number FROM customers
+            WHERE manager_id = %s AND (box_number IN ({placeholders}) OR mobile_number IN ({placeholders}))
+        """, [manager_id] + [c['box_number'] for c in customers] + [c['mobile_number'] for c in customers])
+        existing_boxes = set()
+        existing_mobiles = set()
+        for box_number, mobile_number in cursor.fetchall():
+            existing_boxes.add(box_number)
+            existing_mobiles.add(mobile_number)
+        pending = []
+        for customer in customers:
+            if customer['box_number'] in existing_boxes:
+                errors.append((customer['row'], f"Box number {customer['box_number']} already exists"))
+            elif customer['mobile_number'] in existing_mobiles:
+                errors.append((customer['row'], f"Mobile number {customer['mobile_number']} already exists"))
+            else:
+                pending.append(customer)
+        insert_sql = """
+            INSERT INTO customers (box_number, mobile_number, name, email, password, plan_amount, address, manager_id, is_temp_password)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        values = [
+            (c['box_number'], c['mobile_number'], c['name'], c['email'], c['password'], c['plan_amount'], c['address'], manager_id, True)
+            for c in pending
+        ]
+        inserted = []
+        try:
+            if values:
+                cursor.executemany(insert_sql, values)
+                box_placeholders = ', '.join(['%s'] * len(pending))
+                _summary_apply_customers(cursor, manager_id, f"box_number IN ({box_placeholders})", [c['box_number'] for c in pending])
+            conn.commit()
+            inserted = pending
+        except Error:
+            conn.rollback()
+            for customer, row_values in zip(pending, values):
+                try:
+                    cursor.execute(insert_sql, row_values)
+                    _summary_apply_customers(cursor, manager_id, "id = %s", (cursor.lastrowid,))
+                    conn.commit()
+                    inserted.append(customer)
+                except Error as e:
+                    conn.rollback()
+                    errors.append((customer['row'], f"Error: {str(e)}"))
+        if inserted:
+            manager_cache.invalidate(manager_id)
+        return inserted, errors
+    except Error as e:
+        conn.rollback()
+        print(f"Error importing customers: {str(e)}")
+        return [], errors + [(c['row'], f"Error: {str(e)}") for c in customers if c['row'] not in {r for r, _ in errors}]
+    finally:
+        cursor.close()
+        conn.close()
+
+@sharded
+def create_import_job(manager_id, customers, errors):
+    """Queue validated customers for the import worker.
+
+    `customers` are dicts with the add_customer fields except the password and
+    the source `row` number; `errors` are the {'row', 'error'} dicts of the rows
+    that failed validation and start the job's error list. A job with no rows
+    is recorded as completed. Returns (success, message, job_id).
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed", None
+    try:
+        cursor = conn.cursor(statement='create_import_job')
+        cursor.execute("""
+            INSERT INTO import_jobs (manager_id, status, total_rows, errors, completed_at)
+            VALUES (%s, %s, %s, %s, IF(%s, NULL, NOW()))
+        """, (manager_id, 'pending' if customers else 'completed', len(customers), json.dumps(errors), bool(customers)))
+        job_id = cursor.lastrowid
+        if customers:
+            cursor.executemany("""
+                INSERT INTO import_job_rows (job_id, source_row, customer)
+                VALUES (%s, %s, %s)
+            """, [
+                (job_id, c['row'], json.dumps({key: str(value) if isinstance(value, Decimal) else value
+                                               for key, value in c.items() if key != 'row'}))
+                for c in customers
+            ])
+        conn.commit()
+        return True, "Import queued", job_id
+    except Error as e:
+        conn.rollback()
+        print(f"Error queuing import: {str(e)}")
+        return False, f"Error queuing import: {str(e)}", None
+    finally:
+        cursor.close()
+        conn.close()
+
+def claim_import_rows(limit, stale_after_seconds=600):
+    """Claim up to `limit` waiting rows of one import job for saving.
+
+    Rows are locked with SKIP LOCKED so several workers can share a job, and
+    rows left locked by a crashed worker are reclaimed once older than
+    `stale_after_seconds`. Shards are tried in turn like claim_pending_emails,
+    skipping managers frozen by rebalance.py. Returns (job_id, manager_id,
+    customers) with customers in the create_import_job form, or None when no
+    rows are waiting.
+    """
+    shards = sorted(shard_pools)
+    start = next(_claim_rotation) % len(shards)
+    for shard in shards[start:] + shards[:start]:
+        with on_shard(shard):
+            claimed = _claim_shard_import_rows(limit, stale_after_seconds)
+        if claimed:
+            return claimed
+    return None
+
+def _claim_shard_import_rows(limit, stale_after_seconds):
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True, statement='claim_import_rows')
+        frozen, frozen_params = _frozen_filter('j.manager_id')
+        cursor.execute(f"""
+            SELECT r.job_id, j.manager_id, j.status, r.source_row, r.customer
+            FROM import_jobs j
+            JOIN import_job_rows r ON r.job_id = j.id
+            WHERE j.status IN ('pending', 'running')
+              AND (r.locked_at IS NULL OR r.locked_at < NOW() - INTERVAL %s SECOND) {frozen}
+            ORDER BY j.id, r.source_row
+            LIMIT %s
+            FOR UPDATE OF r SKIP LOCKED
+        """, [stale_after_seconds] + frozen_params + [limit])
+        rows = cursor.fetchall()
+        if not rows:
+            conn.commit()
+            return None
+        # Rows of any later job are left for the next claim and unlocked by the commit
+        job_id, manager_id = rows[0]['job_id'], rows[0]['manager_id']
+        rows = [row for row in rows if row['job_id'] == job_id]
+        placeholders = ', '.join(['%s'] * len(rows))
+        cursor.execute(f"""
+            UPDATE import_job_rows SET locked_at = NOW()
+            WHERE job_id = %s AND source_row IN ({placeholders})
+        """, [job_id] + [row['source_row'] for row in rows])
+        if rows[0]['status'] == 'pending':
+            cursor.execute("UPDATE import_jobs SET status = 'running' WHERE id = %s", (job_id,))
+        conn.commit()
+        customers = []
+        for row in rows:
+            customer = json.loads(row['customer'])
+            customer['plan_amount'] = Decimal(customer['plan_amount'])
+            customer['row'] = row['source_row']
+            customers.append(customer)
+        return job_id, manager_id, customers
+    except Error as e:
+        conn.rollback()
+        print(f"Error claiming import rows: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@sharded
+def finish_import_rows(manager_id, job_id, rows, imported, emails_queued, errors):
+    """Record a saved batch of an import job and complete the job once no rows are left.
+
+    `rows` are the source row numbers of the batch and `errors` its
+    {'row', 'error'} dicts. Returns (success, message).
+    """
+    if not rows:
+        return True, "No rows to update"
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cursor = conn.cursor(statement='finish_import_rows')
+        placeholders = ', '.join(['%s'] * len(rows))
+        cursor.execute(f"DELETE FROM import_job_rows WHERE job_id = %s AND source_row IN ({placeholders})",
+                       [job_id] + list(rows))
+        cursor.execute("""
+            UPDATE import_jobs
+            SET imported = imported + %s, emails_queued = emails_queued + %s,
+                errors = JSON_MERGE_PRESERVE(errors, CAST(%s AS JSON))
+            WHERE id = %s AND manager_id = %s
+        """, (imported, emails_queued, json.dumps(errors), job_id, manager_id))
+        cursor.execute("""
+            UPDATE import_jobs SET status = 'completed', completed_at = NOW()
+            WHERE id = %s AND status <> 'completed'
+              AND NOT EXISTS (SELECT 1 FROM import_job_rows WHERE job_id = %s)
+        """, (job_id, job_id))
+        conn.commit()
+        return True, "Import rows recorded"
+    except Error as e:
+        conn.rollback()
+        print(f"Error recording import rows: {str(e)}")
+        return False, f"Error: {str(e)}"
+    finally:
+        cursor.close()
+        conn.close()
+
+@sharded
+def release_import_rows(manager_id, job_id, rows):
+    """Unlock claimed rows of an import job so the next claim retries them."""
+    if not rows:
+        return True, "No rows to update"
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cursor = conn.cursor(statement='release_import_rows')
+        placeholders = ', '.join(['%s'] * len(rows))
+        cursor.execute(f"""
+            UPDATE import_job_rows SET locked_at = NULL
+            WHERE job_id = %s AND source_row IN ({placeholders})
+        """, [job_id] + list(rows))
+        conn.commit()
+        return True, "Import rows released"
+    except Error as e:
+        conn.rollback()
+        return False, f"Error: {str(e)}"
+    finally:
+        cursor.close()
+        conn.close()
+
+@sharded
+def get_import_job(job_id, manager_id):
+    """Return an import job's progress, or None if the manager has no such job.
+
+    The dict holds status, total_rows, imported, emails_queued and errors,
+    sorted by row.
+    """
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True, statement='get_import_job')
+        cursor.execute("""
+            SELECT status, total_rows, imported, emails_queued, errors
+            FROM import_jobs
+            WHERE id = %s AND manager_id = %s
+        """, (job_id, manager_id))
+        job = cursor.fetchone()
+        if job:
+            job['errors'] = sorted(json.loads(job['errors']), key=lambda error: error['row'] or 0)
+        return job
+    except Error as e:
+        print(f"Error fetching import job: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@sharded
+def update_customer(customer_id, box_number, mobile_number, name, email, password, plan_amount, address, is_temp_password, manager_id):
     conn = get_connection()
     if not conn:
         return False, "Database connection failed"
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(statement='update_customer')
         if password:
             cursor.execute("""
                 UPDATE customers
                 SET box_number = %s, mobile_number = %s, name = %s, email = %s, password = %s, plan_amount = %s, address = %s, is_temp_password = %s
-                WHERE id = %s
-            """, (box_number, mobile_number, name, email, password, plan_amount, address, is_temp_password, customer_id))
+                WHERE id = %s AND manager_id = %s
+            """, (box_number, mobile_number, name, email, password, plan_amount, address, is_temp_password, customer_id, manager_id))
         else:
             cursor.execute("""
                 UPDATE customers
                 SET box_number = %s, mobile_number = %s, name = %s, email = %s, plan_amount = %s, address = %s, is_temp_password = %s
-                WHERE id = %s
-            """, (box_number, mobile_number, name, email, plan_amount, address, is_temp_password, customer_id))
+                WHERE id = %s AND manager_id = %s
+            """, (box_number, mobile_number, name, email, plan_amount, address, is_temp_password, customer_id, manager_id))
         conn.commit()
+        manager_cache.invalidate(manager_id)
         return True, "Customer updated successfully"
     except Error as e:
         conn.rollback()
@@ -176,14 +1166,17 @@ def update_customer(customer_id, box_number, mobile_number, name, email, passwor
         cursor.close()
         conn.close()
 
-def delete_customer(customer_id):
+@sharded
+def delete_customer(customer_id, manager_id):
     conn = get_connection()
     if not conn:
         return False, "Database connection failed"
     try:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM customers WHERE id = %s", (customer_id,))
+        cursor = conn.cursor(statement='delete_customer')
+        _summary_apply_customers(cursor, manager_id, "id = %s", (customer_id,), sign=-1)
+        cursor.execute("DELETE FROM customers WHERE id = %s AND manager_id = %s", (customer_id, manager_id))
         conn.commit()
+        manager_cache.invalidate(manager_id)
         return True, "Customer deleted successfully"
     except Error as e:
         conn.rollback()
@@ -197,7 +1190,7 @@ def add_pending_manager(username, email, mobile_number, password):
     if not conn:
         return False, "Database connection failed"
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(statement='add_pending_manager')
         cursor.execute("""
             INSERT INTO pending_users (username, email, mobile_number, password)
             VALUES (%s, %s, %s, %s)
@@ -211,12 +1204,13 @@ def add_pending_manager(username, email, mobile_number, password):
         cursor.close()
         conn.close()
 
+@replica_read
 def get_pending_managers():
     conn = get_connection()
     if not conn:
         return None
     try:
-        cursor = conn.cursor(dictionary=True)
+        cursor = conn.cursor(dictionary=True, statement='get_pending_managers')
         cursor.execute("SELECT id, username, email, mobile_number FROM pending_users")
         pending_managers = cursor.fetchall()
         return pending_managers
@@ -229,7 +1223,7 @@ def approve_manager(pending_user_id):
     if not conn:
         return False, "Database connection failed"
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(statement='approve_manager')
         cursor.execute("SELECT * FROM pending_users WHERE id = %s", (pending_user_id,))
         pending_manager = cursor.fetchone()
         if not pending_manager:
@@ -238,8 +1232,11 @@ def approve_manager(pending_user_id):
             INSERT INTO managers (username, email, mobile_number, password)
             VALUES (%s, %s, %s, %s)
         """, (pending_manager[1], pending_manager[2], pending_manager[3], pending_manager[4]))
+        if SHARDED:
+            _place_new_manager(cursor, cursor.lastrowid)
         cursor.execute("DELETE FROM pending_users WHERE id = %s", (pending_user_id,))
         conn.commit()
+        login_throttle.forget_unknown_email(pending_manager[2])
         return True, "Manager approved successfully"
     except Error as e:
         conn.rollback()
@@ -248,12 +1245,41 @@ def approve_manager(pending_user_id):
         cursor.close()
         conn.close()
 
+# Shard newly approved managers are placed on; by default the one with the fewest managers
+NEW_MANAGER_SHARD = os.getenv('DB_NEW_MANAGER_SHARD')
+
+def _place_new_manager(cursor, manager_id):
+    """Pick a shard for a new manager, record it in the directory and copy the account row there.
+
+    The account itself stays on shard 0, where logins read it; the copy backs
+    the foreign keys of the manager's rows on the other shard.
+    """
+    if NEW_MANAGER_SHARD:
+        shard = int(NEW_MANAGER_SHARD)
+    else:
+        cursor.execute("""
+            SELECT COALESCE(s.shard, 0) AS shard, COUNT(*) AS managers
+            FROM managers m
+            LEFT JOIN manager_shards s ON s.manager_id = m.id
+            GROUP BY COALESCE(s.shard, 0)
+        """)
+        counts = dict(cursor.fetchall())
+        shard = min(shard_pools, key=lambda number: (counts.get(number, 0), number))
+    cursor.execute("INSERT INTO manager_shards (manager_id, shard) VALUES (%s, %s)", (manager_id, shard))
+    if shard != MAIN_SHARD:
+        cursor.execute("SELECT * FROM managers WHERE id = %s", (manager_id,))
+        row = cursor.fetchone()
+        columns = ', '.join(cursor.column_names)
+        placeholders = ', '.join(['%s'] * len(row))
+        _node_query('approve_manager', f"INSERT INTO managers ({columns}) VALUES ({placeholders})", row, shard)
+    return shard
+
 def reject_manager(pending_user_id):
     conn = get_connection()
     if not conn:
         return False, "Database connection failed"
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(statement='reject_manager')
         cursor.execute("DELETE FROM pending_users WHERE id = %s", (pending_user_id,))
         conn.commit()
         return True, "Manager signup request rejected"
@@ -264,47 +1290,264 @@ def reject_manager(pending_user_id):
         cursor.close()
         conn.close()
 
-def update_customer_balance(customer_id, amount):
+# Balance buckets for the dashboard summary: paid (<= 0), low, medium and high arrears
+ARREARS_LOW_LIMIT = 500
+ARREARS_MEDIUM_LIMIT = 2000
+SUMMARY_BUCKETS = ('bucket_paid', 'bucket_low', 'bucket_medium', 'bucket_high')
+
+SUMMARY_UPSERT = """
+    ON DUPLICATE KEY UPDATE
+        customer_count = customer_count + VALUES(customer_count),
+        total_outstanding = total_outstanding + VALUES(total_outstanding),
+        bucket_paid = bucket_paid + VALUES(bucket_paid),
+        bucket_low = bucket_low + VALUES(bucket_low),
+        bucket_medium = bucket_medium + VALUES(bucket_medium),
+        bucket_high = bucket_high + VALUES(bucket_high)
+"""
+
+def balance_bucket(balance):
+    if balance <= 0:
+        return 'bucket_paid'
+    if balance <= ARREARS_LOW_LIMIT:
+        return 'bucket_low'
+    if balance <= ARREARS_MEDIUM_LIMIT:
+        return 'bucket_medium'
+    return 'bucket_high'
+
+def _bucket_conditions(expr):
+    """SQL conditions, in SUMMARY_BUCKETS order, testing which bucket `expr` falls in."""
+    return (
+        f"{expr} <= 0",
+        f"{expr} > 0 AND {expr} <= {ARREARS_LOW_LIMIT}",
+        f"{expr} > {ARREARS_LOW_LIMIT} AND {expr} <= {ARREARS_MEDIUM_LIMIT}",
+        f"{expr} > {ARREARS_MEDIUM_LIMIT}",
+    )
+
+def _summary_apply_customers(cursor, manager_id, condition, params, sign=1):
+    """Add (sign=1) or remove (sign=-1) the selected customers from the manager summary.
+
+    Must run while the customers still exist, i.e. after an insert or before a delete.
+    """
+    buckets = ', '.join(f"%s * COALESCE(SUM({c}), 0)" for c in _bucket_conditions('balance'))
+    cursor.execute(f"""
+        INSERT INTO manager_summary (manager_id, customer_count, total_outstanding, {', '.join(SUMMARY_BUCKETS)})
+        SELECT %s, %s * COUNT(*), %s * COALESCE(SUM(balance), 0), {buckets}
+        FROM customers WHERE manager_id = %s AND {condition}
+        {SUMMARY_UPSERT}
+    """, [manager_id, sign, sign] + [sign] * len(SUMMARY_BUCKETS) + [manager_id] + list(params))
+
+def _summary_apply_balance_change(cursor, manager_id, old_balance, new_balance):
+    deltas = dict.fromkeys(SUMMARY_BUCKETS, 0)
+    deltas[balance_bucket(old_balance)] -= 1
+    deltas[balance_bucket(new_balance)] += 1
+    cursor.execute(f"""
+        INSERT INTO manager_summary (manager_id, customer_count, total_outstanding, {', '.join(SUMMARY_BUCKETS)})
+        VALUES (%s, 0, %s, %s, %s, %s, %s)
+        {SUMMARY_UPSERT}
+    """, [manager_id, new_balance - old_balance] + [deltas[bucket] for bucket in SUMMARY_BUCKETS])
+
+def _record_collection(cursor, manager_id, amount, paid_at):
+    """Add a completed payment to the manager's daily and monthly collection totals."""
+    day = paid_at.date()
+    cursor.execute("""
+        INSERT INTO manager_collections (manager_id, period_type, period_start, amount, payment_count)
+        VALUES (%s, 'day', %s, %s, 1), (%s, 'month', %s, %s, 1)
+        ON DUPLICATE KEY UPDATE amount = amount + VALUES(amount), payment_count = payment_count + 1
+    """, (manager_id, day, amount, manager_id, day.replace(day=1), amount))
+
+@manager_cache.cached('summary', fill_when=_reads_primary)
+@replica_read
+@sharded
+def get_manager_summary(manager_id):
+    """Dashboard header totals: three primary-key lookups, whatever the data size."""
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True, statement='get_manager_summary')
+        cursor.execute(f"""
+            SELECT customer_count, total_outstanding, {', '.join(SUMMARY_BUCKETS)}
+            FROM manager_summary WHERE manager_id = %s
+        """, (manager_id,))
+        summary = cursor.fetchone() or {
+            'customer_count': 0, 'total_outstanding': Decimal('0.00'), **dict.fromkeys(SUMMARY_BUCKETS, 0)
+        }
+        summary['customers_in_arrears'] = summary['bucket_low'] + summary['bucket_medium'] + summary['bucket_high']
+        today = datetime.now(IST).date()
+        cursor.execute("""
+            SELECT period_type, amount, payment_count FROM manager_collections
+            WHERE manager_id = %s AND ((period_type = 'day' AND period_start = %s) OR (period_type = 'month' AND period_start = %s))
+        """, (manager_id, today, today.replace(day=1)))
+        collected = {row['period_type']: row for row in cursor.fetchall()}
+        summary['collected_today'] = collected.get('day', {}).get('amount', Decimal('0.00'))
+        summary['collected_this_month'] = collected.get('month', {}).get('amount', Decimal('0.00'))
+        return summary
+    except Error as e:
+        print(f"Error fetching manager summary: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@sharded
+def rebuild_manager_summary(manager_id):
+    """Recompute a manager's summary and collection totals from customers and payments."""
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cursor = conn.cursor(statement='rebuild_manager_summary')
+        cursor.execute("DELETE FROM manager_summary WHERE manager_id = %s", (manager_id,))
+        _summary_apply_customers(cursor, manager_id, "1 = 1", ())
+        cursor.execute("DELETE FROM manager_collections WHERE manager_id = %s", (manager_id,))
+        for period_type, period_expr in (('day', "DATE(payment_date)"), ('month', "DATE_FORMAT(payment_date, '%%Y-%%m-01')")):
+            cursor.execute(f"""
+                INSERT INTO manager_collections (manager_id, period_type, period_start, amount, payment_count)
+                SELECT manager_id, %s, {period_expr}, SUM(amount), COUNT(*)
+                FROM (
+                    SELECT manager_id, amount, payment_date FROM payments
+                    WHERE manager_id = %s AND payment_status = 'completed'
+                    UNION ALL
+                    SELECT manager_id, amount, payment_date FROM payments_archive
+                    WHERE manager_id = %s AND payment_status = 'completed'
+                ) p
+                GROUP BY manager_id, {period_expr}
+            """, (period_type, manager_id, manager_id))
+        conn.commit()
+        manager_cache.invalidate(manager_id)
+        return True, "Summary rebuilt"
+    except Error as e:
+        conn.rollback()
+        return False, f"Error rebuilding summary: {str(e)}"
+    finally:
+        cursor.close()
+        conn.close()
+
+def to_money(amount):
+    """Convert an amount to a Decimal rounded to paise; money never goes through float."""
+    return Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+def _apply_balance_change(cursor, customer_id, amount, entry_type, reference=None, manager_id=None):
+    """Atomically add `amount` to a balance and append the ledger entry.
+
+    Runs on the caller's cursor and transaction. The balance is changed in a
+    single conditional UPDATE, so concurrent writers cannot lose updates and the
+    balance can never go negative. When `manager_id` is given the customer must
+    belong to that manager. Returns (success, message, new_balance, manager_id).
+    """
+    scope = " AND manager_id = %s" if manager_id is not None else ""
+    scope_params = (manager_id,) if manager_id is not None else ()
+    cursor.execute(f"""
+        UPDATE customers SET balance = balance + %s
+        WHERE id = %s AND balance + %s >= 0{scope}
+    """, (amount, customer_id, amount) + scope_params)
+    if cursor.rowcount == 0:
+        cursor.execute(f"SELECT 1 FROM customers WHERE id = %s{scope}", (customer_id,) + scope_params)
+        if cursor.fetchone() is None:
+            return False, "Customer not found", None, None
+        return False, "Balance cannot be negative", None, None
+    cursor.execute("""
+        INSERT INTO balance_ledger (customer_id, manager_id, amount, balance_after, entry_type, reference)
+        SELECT id, manager_id, %s, balance, %s, %s FROM customers WHERE id = %s
+    """, (amount, entry_type, reference, customer_id))
+    cursor.execute("SELECT balance, manager_id FROM customers WHERE id = %s", (customer_id,))
+    new_balance, owner_id = cursor.fetchone()
+    _summary_apply_balance_change(cursor, owner_id, new_balance - amount, new_balance)
+    return True, "Balance updated successfully", new_balance, owner_id
+
+@sharded
+def update_customer_balance(customer_id, amount, entry_type='adjustment', reference=None):
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cursor = conn.cursor(statement='update_customer_balance')
+        success, message, _, owner_id = _apply_balance_change(cursor, customer_id, to_money(amount), entry_type, reference)
+        if not success:
+            conn.rollback()
+            return False, message
+        conn.commit()
+        manager_cache.invalidate(owner_id)
+        return True, message
+    except (Error, InvalidOperation) as e:
+        conn.rollback()
+        return False, f"Error updating balance: {str(e)}"
+    finally:
+        cursor.close()
+        conn.close()
+
+@replica_read
+@sharded
+def audit_customer_balances(manager_id):
+    """Return customers whose balance differs from the sum of their ledger entries."""
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True, statement='audit_customer_balances')
+        cursor.execute("""
+            SELECT c.id, c.balance, COALESCE(l.ledger_balance, 0) AS ledger_balance
+            FROM customers c
+            LEFT JOIN (
+                SELECT customer_id, SUM(amount) AS ledger_balance
+                FROM balance_ledger WHERE manager_id = %s GROUP BY customer_id
+            ) l ON l.customer_id = c.id
+            WHERE c.manager_id = %s AND c.balance <> COALESCE(l.ledger_balance, 0)
+        """, (manager_id, manager_id))
+        return cursor.fetchall()
+    except Error as e:
+        print(f"Error auditing balances: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@sharded
+def rebuild_customer_balance(customer_id):
+    """Reset a customer's balance to the sum of their ledger entries."""
     conn = get_connection()
     if not conn:
         return False, "Database connection failed"
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT balance FROM customers WHERE id = %s", (customer_id,))
+        cursor = conn.cursor(statement='rebuild_customer_balance')
+        cursor.execute("SELECT manager_id FROM customers WHERE id = %s FOR UPDATE", (customer_id,))
         customer = cursor.fetchone()
-        if not customer:
+        if customer is None:
+            conn.rollback()
             return False, "Customer not found"
-        current_balance = float(customer['balance'])
-        amount = float(amount)
-        new_balance = current_balance + amount
-        if new_balance < 0:
-            return False, "Balance cannot be negative"
-        cursor.execute(
-            "UPDATE customers SET balance = %s WHERE id = %s",
-            (new_balance, customer_id)
-        )
+        _summary_apply_customers(cursor, customer[0], "id = %s", (customer_id,), sign=-1)
+        cursor.execute("""
+            UPDATE customers
+            SET balance = (SELECT COALESCE(SUM(amount), 0) FROM balance_ledger WHERE customer_id = %s)
+            WHERE id = %s
+        """, (customer_id, customer_id))
+        _summary_apply_customers(cursor, customer[0], "id = %s", (customer_id,))
         conn.commit()
-        return True, "Balance updated successfully"
+        manager_cache.invalidate(customer[0])
+        return True, "Balance rebuilt from ledger"
     except Error as e:
         conn.rollback()
-        return False, f"Error updating balance: {str(e)}"
+        return False, f"Error rebuilding balance: {str(e)}"
     finally:
         cursor.close()
         conn.close()
 
+@sharded
 def add_payment(customer_id, manager_id, amount, payment_mode, payment_status, payment_reference, payment_date=None, created_at=None):
     conn = get_connection()
     if not conn:
         return False, "Database connection failed"
     try:
-        cursor = conn.cursor()
-        cursor.execute("SET time_zone = 'Asia/Kolkata'")
+        cursor = conn.cursor(statement='add_payment')
         ist_timestamp = datetime.now(IST)
         cursor.execute("""
             INSERT INTO payments (customer_id, manager_id, amount, payment_mode, payment_status, payment_reference, payment_date, created_at)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
         """, (customer_id, manager_id, amount, payment_mode, payment_status, payment_reference, ist_timestamp, ist_timestamp))
+        if payment_status == 'completed':
+            _record_collection(cursor, manager_id, amount, ist_timestamp)
         conn.commit()
+        manager_cache.invalidate(manager_id)
         return True, "Payment recorded successfully"
     except Error as e:
         conn.rollback()
@@ -312,3 +1555,444 @@ def add_payment(customer_id, manager_id, amount, payment_mode, payment_status, p
     finally:
         cursor.close()
         conn.close()
+
+def _create_billing_run(cursor, manager_id, run_key, billing_period=None):
+    """Record a run and snapshot the manager's customers and plan amounts into it.
+
+    Returns (run_id, is_new_run). Nothing is billed here; the billing worker
+    bills the run's items in chunks.
+    """
+    cursor.execute("""
+        INSERT IGNORE INTO billing_runs (manager_id, run_key, status, billing_period)
+        VALUES (%s, %s, 'pending', %s)
+    """, (manager_id, run_key, billing_period))
+    is_new_run = cursor.rowcount == 1
+    cursor.execute(
+        "SELECT id FROM billing_runs WHERE manager_id = %s AND run_key = %s",
+        (manager_id, run_key)
+    )
+    run_id = cursor.fetchone()['id']
+    if is_new_run:
+        cursor.execute("""
+            INSERT INTO billing_run_items (run_id, customer_id, amount)
+            SELECT %s, id, plan_amount FROM customers WHERE manager_id = %s
+        """, (run_id, manager_id))
+    return run_id, is_new_run
+
+@sharded
+def create_billing_run(manager_id, run_key):
+    """Queue a run billing every customer of a manager their plan amount.
+
+    The run is recorded under (manager_id, run_key); queuing again with the same
+    key does not bill anyone twice. Returns (success, message, customer_count).
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed", 0
+    try:
+        cursor = conn.cursor(dictionary=True, statement='create_billing_run')
+        run_id, is_new_run = _create_billing_run(cursor, manager_id, run_key)
+        cursor.execute("SELECT COUNT(*) AS count FROM billing_run_items WHERE run_id = %s", (run_id,))
+        customer_count = cursor.fetchone()['count']
+        conn.commit()
+        if not is_new_run:
+            return True, "Billing run already processed", customer_count
+        return True, "Billing run queued", customer_count
+    except Error as e:
+        conn.rollback()
+        print(f"Error queuing billing run: {str(e)}")
+        return False, f"Error adding bills: {str(e)}", 0
+    finally:
+        cursor.close()
+        conn.close()
+
+def schedule_billing_runs(billing_date, default_day):
+    """Queue this month's run for every manager whose billing day has come.
+
+    Runs are keyed `auto:YYYY-MM`, so calling this repeatedly during a month
+    queues each manager once. A billing day past the end of a short month falls
+    on its last day. Managers are read from the directory on shard 0 and each
+    run is queued on its manager's shard; managers frozen by rebalance.py are
+    left for a later call. Returns the number of runs queued, or None on error.
+    """
+    conn = get_connection()
+    if not conn:
+        return None
+    shard_conns = {}
+    try:
+        cursor = conn.cursor(dictionary=True, statement='schedule_billing_runs')
+        last_day = calendar.monthrange(billing_date.year, billing_date.month)[1]
+        cursor.execute("""
+            SELECT m.id, COALESCE(s.shard, 0) AS shard, COALESCE(s.frozen, FALSE) AS frozen
+            FROM managers m
+            LEFT JOIN manager_shards s ON s.manager_id = m.id
+            WHERE LEAST(COALESCE(m.billing_day, %s), %s) <= %s
+        """, (default_day, last_day, billing_date.day))
+        managers = cursor.fetchall()
+        conn.commit()
+        queued = 0
+        for manager in managers:
+            if manager['frozen']:
+                continue
+            shard_conn, shard_cursor = conn, cursor
+            if manager['shard'] != MAIN_SHARD:
+                if manager['shard'] not in shard_conns:
+                    other = _checkout(shard=manager['shard'])
+                    if not other:
+                        raise Error(msg=f"Connection to shard {manager['shard']} failed")
+                    shard_conns[manager['shard']] = (other, other.cursor(dictionary=True, statement='schedule_billing_runs'))
+                shard_conn, shard_cursor = shard_conns[manager['shard']]
+            _, is_new_run = _create_billing_run(shard_cursor, manager['id'], f"auto:{billing_date:%Y-%m}", billing_date.replace(day=1))
+            shard_conn.commit()
+            queued += is_new_run
+        return queued
+    except Error as e:
+        conn.rollback()
+        for other, _ in shard_conns.values():
+            other.rollback()
+        print(f"Error scheduling billing runs: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+        for other, other_cursor in shard_conns.values():
+            other_cursor.close()
+            other.close()
+
+def _bill_run_items(cursor, run_id, manager_id, customer_ids, notification_subject):
+    """Bill the given items of a run and queue their bill notifications.
+
+    Touches only rows of the given customers and items, so chunks of one run
+    billed by different workers do not wait on each other.
+    """
+    placeholders = ', '.join(['%s'] * len(customer_ids))
+    cursor.execute(f"""
+        UPDATE customers c
+        JOIN billing_run_items i ON i.customer_id = c.id
+        SET c.balance = c.balance + i.amount
+        WHERE i.run_id = %s AND i.customer_id IN ({placeholders}) AND c.manager_id = %s
+    """, [run_id] + customer_ids + [manager_id])
+    cursor.execute(f"""
+        INSERT INTO balance_ledger (customer_id, manager_id, amount, balance_after, entry_type, reference)
+        SELECT c.id, c.manager_id, i.amount, c.balance, 'bill', CONCAT('run:', i.run_id)
+        FROM billing_run_items i
+        JOIN customers c ON c.id = i.customer_id
+        WHERE i.run_id = %s AND i.customer_id IN ({placeholders})
+    """, [run_id] + customer_ids)
+    cursor.execute(f"""
+        INSERT INTO email_outbox (manager_id, to_email, subject, template_type, payload)
+        SELECT c.manager_id, c.email, %s, 'bill_notification', JSON_OBJECT('name', c.name, 'amount', i.amount)
+        FROM billing_run_items i
+        JOIN customers c ON c.id = i.customer_id
+        WHERE i.run_id = %s AND i.customer_id IN ({placeholders}) AND c.email IS NOT NULL AND c.email <> ''
+    """, [notification_subject, run_id] + customer_ids)
+    cursor.execute(f"""
+        UPDATE billing_run_items SET billed_at = NOW()
+        WHERE run_id = %s AND customer_id IN ({placeholders})
+    """, [run_id] + customer_ids)
+
+def _summary_apply_billed(cursor, run_id, manager_id, customer_ids):
+    """Add billed items to the manager's summary; run last in the chunk since it locks the summary row."""
+    placeholders = ', '.join(['%s'] * len(customer_ids))
+    new_buckets = _bucket_conditions('c.balance')
+    old_buckets = _bucket_conditions('(c.balance - i.amount)')
+    bucket_deltas = ', '.join(
+        f"COALESCE(SUM({new}), 0) - COALESCE(SUM({old}), 0)" for new, old in zip(new_buckets, old_buckets)
+    )
+    cursor.execute(f"""
+        INSERT INTO manager_summary (manager_id, customer_count, total_outstanding, {', '.join(SUMMARY_BUCKETS)})
+        SELECT %s, 0, COALESCE(SUM(i.amount), 0), {bucket_deltas}
+        FROM billing_run_items i
+        JOIN customers c ON c.id = i.customer_id
+        WHERE i.run_id = %s AND i.customer_id IN ({placeholders})
+        {SUMMARY_UPSERT}
+    """, [manager_id, run_id] + customer_ids)
+
+@on_every_shard(_total)
+def bill_next_chunk(chunk_size, notification_subject):
+    """Bill up to `chunk_size` unbilled items of the open runs in one transaction.
+
+    Items are claimed with SKIP LOCKED so several workers can share a run. An
+    item's billed_at is set in the same transaction as its balance change, so a
+    worker that dies mid-run leaves the remaining items for the next one and
+    nobody is billed twice. When nothing is left to claim, runs whose items
+    are all billed are marked completed. Every shard bills its own chunk,
+    skipping managers frozen by rebalance.py. Returns the number of items
+    billed, or None on error.
+    """
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True, statement='bill_next_chunk')
+        frozen, frozen_params = _frozen_filter('r.manager_id')
+        cursor.execute(f"""
+            SELECT i.run_id, r.manager_id, r.status, i.customer_id
+            FROM billing_runs r
+            JOIN billing_run_items i ON i.run_id = r.id AND i.billed_at IS NULL
+            WHERE r.status IN ('pending', 'running') {frozen}
+            ORDER BY r.id, i.customer_id
+            LIMIT %s
+            FOR UPDATE OF i SKIP LOCKED
+        """, frozen_params + [chunk_size])
+        items = cursor.fetchall()
+        runs = {}
+        for item in items:
+            runs.setdefault((item['run_id'], item['manager_id']), []).append(item['customer_id'])
+        for (run_id, manager_id), customer_ids in runs.items():
+            _bill_run_items(cursor, run_id, manager_id, customer_ids, notification_subject)
+        for (run_id, manager_id), customer_ids in runs.items():
+            _summary_apply_billed(cursor, run_id, manager_id, customer_ids)
+        if not items:
+            cursor.execute("""
+                SELECT r.id FROM billing_runs r
+                WHERE r.status IN ('pending', 'running')
+                  AND NOT EXISTS (SELECT 1 FROM billing_run_items i WHERE i.run_id = r.id AND i.billed_at IS NULL)
+            """)
+            for run in cursor.fetchall():
+                cursor.execute("""
+                    UPDATE billing_runs
+                    SET status = 'completed', completed_at = NOW(),
+                        customer_count = (SELECT COUNT(*) FROM billing_run_items WHERE run_id = %s),
+                        total_amount = (SELECT COALESCE(SUM(amount), 0) FROM billing_run_items WHERE run_id = %s)
+                    WHERE id = %s
+                """, (run['id'], run['id'], run['id']))
+        conn.commit()
+        started = sorted({item['run_id'] for item in items if item['status'] == 'pending'})
+        if started:
+            # A transaction of its own, so the run rows are not locked for the length of a chunk
+            cursor.execute(f"""
+                UPDATE billing_runs SET status = 'running'
+                WHERE id IN ({', '.join(['%s'] * len(started))}) AND status = 'pending'
+            """, started)
+            conn.commit()
+        for run_id, manager_id in runs:
+            manager_cache.invalidate(manager_id)
+        return len(items)
+    except Error as e:
+        conn.rollback()
+        print(f"Error billing chunk: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def enqueue_emails(emails):
+    """Queue emails for the mailer workers.
+
+    Each item is a dict with to_email, subject, template_type, payload and
+    optionally manager_id. Emails are stored on their manager's shard, those
+    without a manager on shard 0.
+    """
+    if not emails:
+        return True, "No emails to queue"
+    manager_ids = {e.get('manager_id') for e in emails}
+    if SHARDED and len(manager_ids) > 1:
+        for manager_id in manager_ids:
+            success, message = enqueue_emails([e for e in emails if e.get('manager_id') == manager_id])
+            if not success:
+                return False, message
+        return True, f"{len(emails)} emails queued"
+    with for_manager(manager_ids.pop()):
+        conn = get_connection()
+        if not conn:
+            return False, "Database connection failed"
+        try:
+            cursor = conn.cursor(statement='enqueue_emails')
+            cursor.executemany("""
+                INSERT INTO email_outbox (manager_id, to_email, subject, template_type, payload)
+                VALUES (%s, %s, %s, %s, %s)
+            """, [
+                (e.get('manager_id'), e['to_email'], e['subject'], e['template_type'], json.dumps(e.get('payload') or {}))
+                for e in emails
+            ])
+            conn.commit()
+            return True, f"{len(emails)} emails queued"
+        except Error as e:
+            conn.rollback()
+            print(f"Error queueing emails: {str(e)}")
+            return False, f"Error queueing emails: {str(e)}"
+        finally:
+            cursor.close()
+            conn.close()
+
+def claim_pending_emails(limit, stale_after_seconds=600):
+    """Claim up to `limit` due emails for sending.
+
+    Rows are locked with SKIP LOCKED so several workers can drain the outbox
+    concurrently. Emails left in 'sending' by a crashed worker are reclaimed
+    once they are older than `stale_after_seconds`. Shards are drained in
+    turn, each call starting from the next one, and emails of managers frozen
+    by rebalance.py wait until they have moved.
+    """
+    shards = sorted(shard_pools)
+    start = next(_claim_rotation) % len(shards)
+    emails = []
+    for shard in shards[start:] + shards[:start]:
+        if len(emails) >= limit:
+            break
+        with on_shard(shard):
+            emails.extend(_claim_shard_emails(limit - len(emails), stale_after_seconds))
+    return emails
+
+def _claim_shard_emails(limit, stale_after_seconds):
+    conn = get_connection()
+    if not conn:
+        return []
+    try:
+        cursor = conn.cursor(dictionary=True, statement='claim_pending_emails')
+        frozen, frozen_params = _frozen_filter('manager_id')
+        cursor.execute(f"""
+            SELECT id, to_email, subject, template_type, payload, attempts
+            FROM email_outbox
+            WHERE ((status = 'pending' AND next_attempt_at <= NOW())
+               OR (status = 'sending' AND locked_at < NOW() - INTERVAL %s SECOND)) {frozen}
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, [stale_after_seconds] + frozen_params + [limit])
+        emails = cursor.fetchall()
+        if emails:
+            ids = [e['id'] for e in emails]
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"""
+                UPDATE email_outbox
+                SET status = 'sending', attempts = attempts + 1, locked_at = NOW()
+                WHERE id IN ({placeholders})
+            """, ids)
+        conn.commit()
+        for email in emails:
+            email['attempts'] += 1
+            email['payload'] = json.loads(email['payload']) if email['payload'] else {}
+        return emails
+    except Error as e:
+        conn.rollback()
+        print(f"Error claiming emails: {str(e)}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+# Outbox ids are unique across shards, so every shard is told and only the owner matches
+@on_every_shard(_first_failure)
+def mark_emails_sent(email_ids):
+    if not email_ids:
+        return True, "No emails to update"
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cursor = conn.cursor(statement='mark_emails_sent')
+        placeholders = ', '.join(['%s'] * len(email_ids))
+        # The payload may hold a temporary password, so it is not kept after delivery
+        cursor.execute(f"""
+            UPDATE email_outbox
+            SET status = 'sent', sent_at = NOW(), locked_at = NULL, last_error = NULL, payload = NULL
+            WHERE id IN ({placeholders})
+        """, list(email_ids))
+        conn.commit()
+        return True, "Emails marked as sent"
+    except Error as e:
+        conn.rollback()
+        return False, f"Error: {str(e)}"
+    finally:
+        cursor.close()
+        conn.close()
+
+@on_every_shard(_first_failure)
+def mark_email_failed(email_id, error, retry_in_seconds=None):
+    """Record a failed delivery; retry after `retry_in_seconds` or give up if None."""
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed"
+    try:
+        cursor = conn.cursor(statement='mark_email_failed')
+        if retry_in_seconds is None:
+            # Nothing will send it again, so drop the payload and any temporary password in it
+            cursor.execute("""
+                UPDATE email_outbox
+                SET status = 'failed', locked_at = NULL, last_error = %s, payload = NULL
+                WHERE id = %s
+            """, (error[:500], email_id))
+        else:
+            cursor.execute("""
+                UPDATE email_outbox
+                SET status = 'pending', locked_at = NULL, last_error = %s,
+                    next_attempt_at = NOW() + INTERVAL %s SECOND
+                WHERE id = %s
+            """, (error[:500], int(retry_in_seconds), email_id))
+        conn.commit()
+        return True, "Email failure recorded"
+    except Error as e:
+        conn.rollback()
+        return False, f"Error: {str(e)}"
+    finally:
+        cursor.close()
+        conn.close()
+
+EMAIL_STATUS_QUERY = """
+    SELECT status, COUNT(*) AS count
+    FROM email_outbox
+    WHERE manager_id = %s
+    GROUP BY status
+"""
+
+def _email_counts(rows):
+    counts = {'pending': 0, 'sending': 0, 'sent': 0, 'failed': 0}
+    for row in rows:
+        counts[row['status']] = row['count']
+    return counts
+
+@replica_read
+@sharded
+def get_email_status_counts(manager_id):
+    conn = get_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True, statement='get_email_status_counts')
+        cursor.execute(EMAIL_STATUS_QUERY, (manager_id,))
+        return _email_counts(cursor.fetchall())
+    except Error as e:
+        print(f"Error fetching email status: {str(e)}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+@sharded
+def post_payment(customer_id, manager_id, amount, payment_mode, payment_status, payment_reference):
+    """Record a payment and deduct it from the balance in one transaction.
+
+    Returns (success, message, new_balance) with the balance read back from the
+    database after the update.
+    """
+    conn = get_connection()
+    if not conn:
+        return False, "Database connection failed", None
+    try:
+        cursor = conn.cursor(statement='post_payment')
+        amount = to_money(amount)
+        ist_timestamp = datetime.now(IST)
+        cursor.execute("""
+            INSERT INTO payments (customer_id, manager_id, amount, payment_mode, payment_status, payment_reference, payment_date, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (customer_id, manager_id, amount, payment_mode, payment_status, payment_reference, ist_timestamp, ist_timestamp))
+        payment_id = cursor.lastrowid
+        success, message, new_balance, _ = _apply_balance_change(
+            cursor, customer_id, -amount, 'payment', f"payment:{payment_id}", manager_id=manager_id
+        )
+        if not success:
+            conn.rollback()
+            return False, message, None
+        if payment_status == 'completed':
+            _record_collection(cursor, manager_id, amount, ist_timestamp)
+        conn.commit()
+        manager_cache.invalidate(manager_id)
+        return True, "Payment recorded successfully", new_balance
+    except (Error, InvalidOperation) as e:
+        conn.rollback()
+        return False, f"Error recording payment: {str(e)}", None
+    finally:
+        cursor.close()
+        conn.close()
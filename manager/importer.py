@@ -0,0 +1,216 @@
+import csv
+import io
+import os
+import re
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from dotenv import load_dotenv
+from db import add_customers_bulk, enqueue_emails, create_import_job, claim_import_rows, finish_import_rows, release_import_rows
+from passwords import generate_password, hash_passwords, PasswordServiceBusy
+
+# Load environment variables
+load_dotenv()
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Rows the import worker hashes and saves per claim; one batch must finish within IMPORT_STALE_AFTER
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 100))
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', 1))
+IMPORT_POLL_INTERVAL = float(os.getenv('IMPORT_POLL_INTERVAL', 2))
+# Seconds before rows claimed by a worker that died are claimed again
+IMPORT_STALE_AFTER = int(os.getenv('IMPORT_STALE_AFTER', 600))
+# The request only parses and validates the file, so this bounds upload size rather than hashing time
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', 20000))
+
+REQUIRED_COLUMNS = ('box_number', 'mobile_number', 'name', 'plan_amount', 'address')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+def read_rows(file_storage):
+    """Yield row dicts from an uploaded CSV or Excel file without loading it whole."""
+    filename = (file_storage.filename or '').lower()
+    if filename.endswith('.xlsx'):
+        if openpyxl is None:
+            raise ValueError("Excel import needs the openpyxl package; upload a CSV instead")
+        workbook = openpyxl.load_workbook(file_storage.stream, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(value or '').strip().lower() for value in next(rows, ())]
+        for values in rows:
+            yield {key: '' if value is None else str(value) for key, value in zip(header, values)}
+        workbook.close()
+        return
+    stream = io.TextIOWrapper(file_storage.stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(stream)
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+    for row in reader:
+        yield row
+
+def validate_row(row, row_number, seen_boxes, seen_mobiles):
+    """Return (customer, None) for a valid row or (None, error message)."""
+    customer = {key: (row.get(key) or '').strip() for key in REQUIRED_COLUMNS + ('email',)}
+    missing = [key for key in REQUIRED_COLUMNS if not customer[key]]
+    if missing:
+        return None, f"Missing {', '.join(missing)}"
+    try:
+        customer['plan_amount'] = Decimal(customer['plan_amount']).quantize(Decimal('0.01'))
+        if customer['plan_amount'] < 0:
+            return None, "Plan amount cannot be negative"
+    except InvalidOperation:
+        return None, f"Invalid plan amount {customer['plan_amount']}"
+    if customer['email'] and not EMAIL_PATTERN.match(customer['email']):
+        return None, f"Invalid email {customer['email']}"
+    customer['email'] = customer['email'] or None
+    if customer['box_number'] in seen_boxes:
+        return None, f"Box number {customer['box_number']} repeated in file"
+    if customer['mobile_number'] in seen_mobiles:
+        return None, f"Mobile number {customer['mobile_number']} repeated in file"
+    seen_boxes.add(customer['box_number'])
+    seen_mobiles.add(customer['mobile_number'])
+    customer['row'] = row_number
+    return customer, None
+
+def import_batch(manager_id, batch):
+    """Hash, insert and queue credential emails for one batch of valid rows."""
+    plain_passwords = [generate_password() for _ in batch]
+    for customer, hashed in zip(batch, hash_passwords(plain_passwords)):
+        customer['password'] = hashed
+    inserted, errors = add_customers_bulk(manager_id, batch)
+    passwords_by_row = {customer['row']: password for customer, password in zip(batch, plain_passwords)}
+    emails = [{
+        'manager_id': manager_id,
+        'to_email': customer['email'],
+        'subject': 'Your Time2Due Account Credentials',
+        'template_type': 'credential',
+        'payload': {'mobile_number': customer['mobile_number'], 'password': passwords_by_row[customer['row']]},
+    } for customer in inserted if customer['email']]
+    queued = 0
+    if emails:
+        success, message = enqueue_emails(emails)
+        if success:
+            queued = len(emails)
+        else:
+            errors.append((None, f"Customers imported but credential emails were not queued: {message}"))
+    return len(inserted), queued, errors
+
+class ImportTooLarge(ValueError):
+    """Raised when an upload has more than IMPORT_MAX_ROWS rows."""
+
+def import_customers(manager_id, file_storage):
+    """Validate an uploaded file and queue its valid rows for the import worker.
+
+    Every row costs a bcrypt hash, which is too slow to do for a large file
+    inside a request, so the rows are saved in the background by ImportWorker
+    and the dashboard polls get_import_job for progress. A file that cannot be
+    decoded or parsed, or has more than IMPORT_MAX_ROWS rows, raises without
+    queuing anything. Returns (success, message, job_id); the job's errors
+    start with the rows that failed validation, numbered counting the header
+    as row 1.
+    """
+    errors = []
+    seen_boxes = set()
+    seen_mobiles = set()
+    customers = []
+    for index, row in enumerate(read_rows(file_storage)):
+        if index >= IMPORT_MAX_ROWS:
+            raise ImportTooLarge(f"Import is limited to {IMPORT_MAX_ROWS} rows; split the file and upload each part")
+        row_number = index + 2
+        customer, error = validate_row(row, row_number, seen_boxes, seen_mobiles)
+        if error:
+            errors.append({'row': row_number, 'error': error})
+            continue
+        customers.append(customer)
+    return create_import_job(manager_id, customers, errors)
+
+class ImportWorker:
+    """Threads saving the rows of queued imports batch by batch.
+
+    Each batch is claimed, hashed, saved and then deleted from the job, so a
+    worker can be stopped at any point and the rest is picked up later. A
+    worker killed between saving a batch and recording it leaves the batch to
+    be claimed again after IMPORT_STALE_AFTER, when its rows are reported as
+    already existing and their credential emails are not sent.
+    """
+
+    def __init__(self, workers=IMPORT_WORKERS, batch_size=IMPORT_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"import-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            if not self.process_next():
+                self.stop_event.wait(IMPORT_POLL_INTERVAL)
+
+    def process_next(self):
+        """Save one claimed batch; returns the number of rows handled, 0 when idle or busy."""
+        claimed = claim_import_rows(self.batch_size, IMPORT_STALE_AFTER)
+        if not claimed:
+            return 0
+        job_id, manager_id, batch = claimed
+        rows = [customer['row'] for customer in batch]
+        try:
+            imported, queued, errors = import_batch(manager_id, batch)
+        except PasswordServiceBusy:
+            # Logins come first; the batch is retried on a later pass
+            release_import_rows(manager_id, job_id, rows)
+            return 0
+        success, message = finish_import_rows(manager_id, job_id, rows, imported, queued,
+                                              [{'row': row, 'error': error} for row, error in errors])
+        if not success:
+            print(f"Could not record import batch of job {job_id}: {message}")
+        return len(batch)
+
+    def drain(self):
+        """Save everything currently queued on the calling thread."""
+        total = 0
+        while True:
+            handled = self.process_next()
+            if not handled:
+                return total
+            total += handled
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start_import_worker():
+    """Start the in-process import worker once per process."""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = ImportWorker()
+            _worker.start()
+        return _worker
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Save queued customer imports.')
+    parser.add_argument('--once', action='store_true', help='save everything queued and exit')
+    args = parser.parse_args()
+
+    worker = ImportWorker()
+    if args.once:
+        print(f"Saved {worker.drain()} rows")
+    else:
+        worker.start()
+        print(f"Import worker running with {worker.workers} workers")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            worker.stop()
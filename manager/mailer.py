@@ -0,0 +1,457 @@
+import asyncio
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from db import claim_pending_emails, mark_emails_sent, mark_email_failed
+from metrics import timed
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
+
+# Load environment variables
+load_dotenv()
+
+# Email configuration
+EMAIL_ADDRESS = os.getenv('EMAIL_ADDRESS')
+EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') == '1'
+
+# Dispatcher tuning
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', 2))
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 50))
+# Sends per second across every dispatcher process
+EMAIL_RATE_PER_SECOND = float(os.getenv('EMAIL_RATE_PER_SECOND', 5))
+# Web processes running the inline dispatcher, each sending its share of EMAIL_RATE_PER_SECOND;
+# WEB_CONCURRENCY is the worker count gunicorn and uvicorn read
+EMAIL_INLINE_PROCESSES = int(os.getenv('EMAIL_INLINE_PROCESSES', os.getenv('WEB_CONCURRENCY', 1)))
+EMAIL_INLINE_RATE_PER_SECOND = EMAIL_RATE_PER_SECOND / max(1, EMAIL_INLINE_PROCESSES)
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 5))
+EMAIL_POLL_INTERVAL = float(os.getenv('EMAIL_POLL_INTERVAL', 2))
+# Sessions are re-opened after this many messages or seconds idle
+SMTP_MAX_MESSAGES_PER_SESSION = int(os.getenv('SMTP_MAX_MESSAGES_PER_SESSION', 100))
+SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', 60))
+# Longest pause after a batch fails unexpectedly; pauses double from EMAIL_POLL_INTERVAL up to it
+EMAIL_ERROR_BACKOFF_MAX = float(os.getenv('EMAIL_ERROR_BACKOFF_MAX', 60))
+
+logger = logging.getLogger('manager.mailer')
+
+# Email bodies are Jinja templates compiled once and kept for the life of the process
+email_env = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')),
+    autoescape=select_autoescape(['html']),
+    auto_reload=False,
+    trim_blocks=True
+)
+EMAIL_TEMPLATES = {
+    template_type: (email_env.get_template(f"{template_type}.html"), email_env.get_template(f"{template_type}.txt"))
+    for template_type in ('credential', 'bill_notification')
+}
+
+def render_email(template_type, **kwargs):
+    """Render (html_body, text_body) for a template type, or None if it is unknown."""
+    templates = EMAIL_TEMPLATES.get(template_type)
+    if templates is None:
+        return None
+    html_template, text_template = templates
+    return html_template.render(**kwargs), text_template.render(**kwargs)
+
+def build_message(to_email, subject, html_body, text_body):
+    """Build a multipart/alternative message with plain-text and HTML parts."""
+    msg = MIMEMultipart('alternative')
+    msg['From'] = EMAIL_ADDRESS
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(text_body, 'plain', 'utf-8'))
+    msg.attach(MIMEText(html_body, 'html', 'utf-8'))
+    return msg.as_bytes()
+
+def render_messages(emails):
+    """Render a batch of queued emails into (email, message bytes) pairs.
+
+    Templates are looked up once per batch, and each message is serialised
+    straight to bytes so the MIME tree can be freed before the next one.
+    Emails that cannot be rendered are yielded with None and the reason in
+    email['render_error'].
+    """
+    for email in emails:
+        templates = EMAIL_TEMPLATES.get(email['template_type'])
+        if templates is None:
+            email['render_error'] = "Invalid template type"
+            yield email, None
+            continue
+        payload = email['payload']
+        try:
+            message_bytes = build_message(
+                email['to_email'], email['subject'], templates[0].render(payload), templates[1].render(payload)
+            )
+        except Exception as e:
+            email['render_error'] = f"Could not render email: {str(e)}"
+            yield email, None
+            continue
+        yield email, message_bytes
+
+class RateLimiter:
+    """Token bucket shared by the worker threads of one dispatcher so the SMTP relay is not flooded.
+
+    Each process has its own bucket: a standalone `python mailer.py` sends at
+    the full EMAIL_RATE_PER_SECOND, while the dispatchers started inside web
+    processes split it between EMAIL_INLINE_PROCESSES.
+    """
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate = rate_per_second
+        self.capacity = burst or max(1.0, rate_per_second)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class SMTPSession:
+    """An authenticated SMTP connection reused across many messages."""
+
+    def __init__(self):
+        self.server = None
+        self.sent_count = 0
+        self.last_used = 0
+
+    def _connect(self):
+        with timed('smtp_duration_seconds', operation='connect'):
+            self.server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+            if SMTP_STARTTLS:
+                self.server.starttls()
+            if EMAIL_PASSWORD:
+                self.server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+        self.sent_count = 0
+
+    def _expired(self):
+        return (self.sent_count >= SMTP_MAX_MESSAGES_PER_SESSION
+                or time.monotonic() - self.last_used > SMTP_IDLE_TIMEOUT)
+
+    def send(self, to_email, message_bytes):
+        if self.server is not None and self._expired():
+            self.close()
+        if self.server is None:
+            self._connect()
+        try:
+            with timed('smtp_duration_seconds', operation='send'):
+                self.server.sendmail(EMAIL_ADDRESS, to_email, message_bytes)
+        except smtplib.SMTPServerDisconnected:
+            # The relay dropped an idle session; reconnect once and retry
+            self.close()
+            self._connect()
+            with timed('smtp_duration_seconds', operation='send'):
+                self.server.sendmail(EMAIL_ADDRESS, to_email, message_bytes)
+        self.sent_count += 1
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+        self.server = None
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter: ~30s, 1m, 2m, 4m ... capped at one hour."""
+    delay = min(3600, 30 * (2 ** (attempts - 1)))
+    return delay + random.uniform(0, delay / 4)
+
+def record_send_failure(email, error):
+    """Schedule a retry with backoff, or give up after EMAIL_MAX_ATTEMPTS."""
+    logger.warning("Email %s attempt %s failed: %s", email['id'], email['attempts'], error)
+    if email['attempts'] >= EMAIL_MAX_ATTEMPTS:
+        mark_email_failed(email['id'], error)
+    else:
+        mark_email_failed(email['id'], error, retry_delay(email['attempts']))
+
+def error_backoff(failures):
+    """Pause after `failures` unexpected batch errors in a row."""
+    return min(EMAIL_ERROR_BACKOFF_MAX, EMAIL_POLL_INTERVAL * 2 ** (failures - 1))
+
+def record_sent(email):
+    """Mark one email sent right after the relay accepted it.
+
+    Marking per email means a crash resends at most the email in flight.
+    Delivery is still at least once: if the mark fails, the row stays
+    'sending' and is sent again after the stale reclaim.
+    """
+    success, message = mark_emails_sent([email['id']])
+    if not success:
+        logger.warning("Could not mark email %s as sent: %s", email['id'], message)
+
+def release_unsent(emails, handled_ids, error):
+    """Schedule a retry for claimed emails a failed batch never reached.
+
+    Without this they would sit in 'sending' until the stale reclaim. Emails
+    already sent are left alone, so they are not sent twice.
+    """
+    for email in emails:
+        if email['id'] in handled_ids:
+            continue
+        try:
+            record_send_failure(email, f"Batch failed: {str(error)}")
+        except Exception:
+            logger.exception("Could not release email %s", email['id'])
+
+class EmailDispatcher:
+    """Pool of worker threads draining the email_outbox table."""
+
+    def __init__(self, workers=EMAIL_WORKERS, rate_per_second=EMAIL_RATE_PER_SECOND):
+        self.workers = workers
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"email-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def _run(self):
+        session = SMTPSession()
+        failures = 0
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    sent = self.process_batch(session)
+                except Exception:
+                    # Keep the worker alive through database, fan-out or other unexpected errors
+                    failures += 1
+                    logger.exception("Email batch failed; retrying in %.0fs", error_backoff(failures))
+                    session.close()
+                    self.stop_event.wait(error_backoff(failures))
+                    continue
+                failures = 0
+                if not sent:
+                    session.close()
+                    self.stop_event.wait(EMAIL_POLL_INTERVAL)
+        finally:
+            session.close()
+
+    def process_batch(self, session):
+        """Send one claimed batch; return the number of emails handled."""
+        emails = claim_pending_emails(EMAIL_BATCH_SIZE)
+        handled_ids = set()
+        try:
+            for email, message_bytes in render_messages(emails):
+                if message_bytes is None:
+                    handled_ids.add(email['id'])
+                    mark_email_failed(email['id'], email['render_error'])
+                    continue
+                self.rate_limiter.acquire()
+                try:
+                    session.send(email['to_email'], message_bytes)
+                except (smtplib.SMTPException, OSError) as e:
+                    session.close()
+                    record_send_failure(email, f"Failed to send email: {str(e)}")
+                    handled_ids.add(email['id'])
+                else:
+                    # Sent, so never released for a retry even if marking it fails
+                    handled_ids.add(email['id'])
+                    record_sent(email)
+        except Exception as e:
+            release_unsent(emails, handled_ids, e)
+            raise
+        return len(emails)
+
+class AsyncRateLimiter:
+    """RateLimiter for tasks on one event loop."""
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate = rate_per_second
+        self.capacity = burst or max(1.0, rate_per_second)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                # Holding the lock while sleeping keeps waiters in FIFO order
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated = time.monotonic()
+            self.tokens -= 1
+
+class AsyncSMTPSession:
+    """SMTPSession on aiosmtplib, for dispatching from the ASGI app's event loop."""
+
+    def __init__(self):
+        self.server = None
+        self.sent_count = 0
+        self.last_used = 0
+
+    async def _connect(self):
+        with timed('smtp_duration_seconds', operation='connect'):
+            self.server = aiosmtplib.SMTP(hostname=SMTP_HOST, port=SMTP_PORT, timeout=30, start_tls=False)
+            await self.server.connect()
+            if SMTP_STARTTLS:
+                await self.server.starttls()
+            if EMAIL_PASSWORD:
+                await self.server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
+        self.sent_count = 0
+
+    def _expired(self):
+        return (self.sent_count >= SMTP_MAX_MESSAGES_PER_SESSION
+                or time.monotonic() - self.last_used > SMTP_IDLE_TIMEOUT)
+
+    async def send(self, to_email, message_bytes):
+        if self.server is not None and self._expired():
+            await self.close()
+        if self.server is None:
+            await self._connect()
+        try:
+            with timed('smtp_duration_seconds', operation='send'):
+                await self.server.sendmail(EMAIL_ADDRESS, [to_email], message_bytes)
+        except aiosmtplib.SMTPServerDisconnected:
+            # The relay dropped an idle session; reconnect once and retry
+            await self.close()
+            await self._connect()
+            with timed('smtp_duration_seconds', operation='send'):
+                await self.server.sendmail(EMAIL_ADDRESS, [to_email], message_bytes)
+        self.sent_count += 1
+        self.last_used = time.monotonic()
+
+    async def close(self):
+        if self.server is not None:
+            try:
+                await self.server.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                pass
+        self.server = None
+
+class AsyncEmailDispatcher:
+    """EmailDispatcher as asyncio tasks: SMTP is awaited instead of holding a thread.
+
+    Claiming and marking rows reuse the db.py outbox functions on a worker
+    thread; they are a few statements per batch next to one SMTP round trip
+    per message.
+    """
+
+    def __init__(self, workers=EMAIL_WORKERS, rate_per_second=EMAIL_RATE_PER_SECOND):
+        if aiosmtplib is None:
+            raise RuntimeError("The async email dispatcher needs the aiosmtplib package")
+        self.workers = workers
+        self.rate_limiter = AsyncRateLimiter(rate_per_second)
+        self.stop_event = asyncio.Event()
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._run(), name=f"email-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        self.stop_event.set()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _run(self):
+        session = AsyncSMTPSession()
+        failures = 0
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    sent = await self.process_batch(session)
+                except Exception:
+                    failures += 1
+                    logger.exception("Email batch failed; retrying in %.0fs", error_backoff(failures))
+                    await session.close()
+                    try:
+                        await asyncio.wait_for(self.stop_event.wait(), error_backoff(failures))
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                failures = 0
+                if not sent:
+                    await session.close()
+                    try:
+                        await asyncio.wait_for(self.stop_event.wait(), EMAIL_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            await session.close()
+
+    async def process_batch(self, session):
+        """Send one claimed batch; return the number of emails handled."""
+        emails = await asyncio.to_thread(claim_pending_emails, EMAIL_BATCH_SIZE)
+        handled_ids = set()
+        try:
+            for email, message_bytes in render_messages(emails):
+                if message_bytes is None:
+                    handled_ids.add(email['id'])
+                    await asyncio.to_thread(mark_email_failed, email['id'], email['render_error'])
+                    continue
+                await self.rate_limiter.acquire()
+                try:
+                    await session.send(email['to_email'], message_bytes)
+                except (aiosmtplib.SMTPException, OSError) as e:
+                    await session.close()
+                    await asyncio.to_thread(record_send_failure, email, f"Failed to send email: {str(e)}")
+                    handled_ids.add(email['id'])
+                else:
+                    handled_ids.add(email['id'])
+                    await asyncio.to_thread(record_sent, email)
+        except Exception as e:
+            await asyncio.to_thread(release_unsent, emails, handled_ids, e)
+            raise
+        return len(emails)
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def start_dispatcher():
+    """Start the in-process dispatcher once per process, at this process's share of the rate."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = EmailDispatcher(rate_per_second=EMAIL_INLINE_RATE_PER_SECOND)
+            _dispatcher.start()
+        return _dispatcher
+
+if __name__ == '__main__':
+    dispatcher = EmailDispatcher()
+    dispatcher.start()
+    print(f"Email dispatcher running with {dispatcher.workers} workers against {SMTP_HOST}:{SMTP_PORT}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        dispatcher.stop()
@@ -0,0 +1,308 @@
+import contextvars
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+# Queries slower than this are logged individually
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+# Requests slower than this are logged at WARNING instead of INFO
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 1000))
+# Bearer token scrapers must send; /metrics is not served at all without one
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger('manager.metrics')
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+class Registry:
+    """Thread-safe counters and histograms rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self, samples=()):
+        """Render all metrics, plus `samples` taken at scrape time.
+
+        `samples` are (kind, name, labels, value) tuples where kind is
+        'counter' or 'gauge', or 'histogram' with value a (buckets, sum, count)
+        tuple and buckets cumulative (upper bound, count) pairs ending at +Inf.
+        """
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                header(name, 'counter')
+                lines.append(f"{name}{_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                header(name, 'histogram')
+                cumulative = 0
+                buckets = []
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                lines.extend(_histogram_lines(name, labels, buckets, histogram.total, histogram.count))
+        # Every series of a metric has to follow its TYPE line, so samples are grouped by name
+        grouped = {}
+        for kind, name, labels, value in samples:
+            grouped.setdefault(name, (kind, []))[1].append((labels, value))
+        for name, (kind, series) in grouped.items():
+            header(name, kind)
+            for labels, value in series:
+                if kind == 'histogram':
+                    lines.extend(_histogram_lines(name, labels, *value))
+                else:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+def _histogram_lines(name, labels, buckets, total, count):
+    for bound, cumulative in buckets:
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        yield f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}"
+    yield f"{name}_sum{_labels(labels)} {total}"
+    yield f"{name}_count{_labels(labels)} {count}"
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+def _escape(value):
+    # The text format escapes backslashes, quotes and newlines in label values
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+registry = Registry()
+registry.describe('http_request_duration_seconds', 'Time spent handling requests by endpoint.')
+registry.describe('http_request_queries_total', 'SQL statements executed while handling requests by endpoint.')
+registry.describe('db_query_duration_seconds', 'Time spent executing SQL by db.py function.')
+registry.describe('db_rows_fetched_total', 'Rows fetched by db.py function.')
+registry.describe('smtp_duration_seconds', 'Time spent in SMTP operations.')
+registry.describe('password_duration_seconds', 'Time spent hashing or checking passwords.')
+registry.describe('template_render_duration_seconds', 'Time spent rendering page templates.')
+
+# Per-request accumulator; None outside a request
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+class RequestStats:
+    __slots__ = ('started', 'sql_count', 'sql_seconds', 'rows', 'slow_queries', 'render_seconds', 'render_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.slow_queries = []
+        self.render_seconds = 0.0
+        self.render_started = None
+
+def record_query(statement, seconds):
+    registry.observe('db_query_duration_seconds', seconds, (('statement', statement),))
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_seconds += seconds
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        logger.warning(json.dumps({'event': 'slow_query', 'statement': statement, 'duration_ms': round(seconds * 1000, 2)}))
+        if stats is not None:
+            stats.slow_queries.append(statement)
+
+def record_rows(statement, rows):
+    if rows:
+        registry.inc('db_rows_fetched_total', (('statement', statement),), rows)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.rows += rows
+
+class InstrumentedCursor:
+    """Cursor proxy timing execute calls and counting fetched rows under `statement`."""
+
+    def __init__(self, cursor, statement):
+        self._cursor = cursor
+        self._statement = statement
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        finally:
+            record_query(self._statement, time.perf_counter() - started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        finally:
+            record_query(self._statement, time.perf_counter() - started)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            record_rows(self._statement, 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        record_rows(self._statement, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        record_rows(self._statement, len(rows))
+        return rows
+
+request_logger = logging.getLogger('manager.requests')
+
+def start_request():
+    """Begin collecting stats for a request; returns the token for end_request()."""
+    return _request_stats.set(RequestStats())
+
+def end_request(token):
+    _request_stats.reset(token)
+
+def finish_request(method, path, endpoint, status):
+    """Record the current request's latency and SQL count and log it as one JSON line."""
+    stats = _request_stats.get()
+    if stats is None:
+        return
+    seconds = time.perf_counter() - stats.started
+    registry.observe('http_request_duration_seconds', seconds,
+                     (('endpoint', endpoint), ('method', method), ('status', str(status))))
+    registry.inc('http_request_queries_total', (('endpoint', endpoint),), stats.sql_count)
+    duration_ms = seconds * 1000
+    request_logger.log(
+        logging.WARNING if duration_ms >= SLOW_REQUEST_MS else logging.INFO,
+        json.dumps({
+            'event': 'request',
+            'method': method,
+            'path': path,
+            'endpoint': endpoint,
+            'status': status,
+            'duration_ms': round(duration_ms, 2),
+            'sql_count': stats.sql_count,
+            'sql_ms': round(stats.sql_seconds * 1000, 2),
+            'rows': stats.rows,
+            'render_ms': round(stats.render_seconds * 1000, 2),
+            'slow_queries': stats.slow_queries,
+        })
+    )
+
+class timed:
+    """Context manager recording the duration of a block into a histogram."""
+
+    __slots__ = ('name', 'labels', 'started')
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = tuple(sorted(labels.items()))
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        registry.observe(self.name, time.perf_counter() - self.started, self.labels)
+
+def init_app(app, samples=None):
+    """Time every request, log it as one JSON line and serve /metrics.
+
+    `samples` is an optional callable returning the scrape-time samples
+    described in Registry.render.
+    """
+    from flask import Response, request, abort, before_render_template, template_rendered
+
+    @app.before_request
+    def start_request_stats():
+        request.environ['metrics.token'] = start_request()
+
+    @app.after_request
+    def remember_status(response):
+        request.environ['metrics.status'] = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exception=None):
+        # Teardown runs even when the view or an after_request hook raised, so failed requests are counted too
+        token = request.environ.pop('metrics.token', None)
+        if token is None:
+            return
+        try:
+            status = 500 if exception is not None else request.environ.get('metrics.status', 500)
+            finish_request(request.method, request.path, request.endpoint or 'unknown', status)
+        finally:
+            end_request(token)
+
+    def render_started(sender, template, context, **extra):
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+
+    def render_finished(sender, template, context, **extra):
+        stats = _request_stats.get()
+        if stats is not None and stats.render_started is not None:
+            seconds = time.perf_counter() - stats.render_started
+            stats.render_seconds += seconds
+            stats.render_started = None
+            registry.observe('template_render_duration_seconds', seconds, (('template', template.name),))
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if not METRICS_TOKEN:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            abort(403)
+        return Response(registry.render(samples() if samples else ()), mimetype='text/plain; version=0.0.4')
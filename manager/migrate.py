@@ -0,0 +1,357 @@
+"""Apply the SQL files in migrations/ in order and check query plans.
+
+    python migrate.py [up]          apply pending migrations
+    python migrate.py status        list applied and pending migrations
+    python migrate.py baseline N    record migrations up to N as applied without running them
+    python migrate.py explain --scratch-db
+                                    EXPLAIN every query db.py runs and fail on full table scans
+
+Applied versions are recorded in schema_migrations with a checksum of the file,
+so an edited migration is reported instead of silently diverging. MySQL commits
+DDL implicitly, so a migration that fails part way must be fixed by hand before
+it is re-run.
+
+Databases that already had the tables from migrations 001-007 applied by hand
+should run `python migrate.py baseline 7` once before `up`.
+
+`up`, `status` and `baseline` run against every shard in DB_SHARDS in turn, so
+all shards share one schema; `explain` checks the plans on shard 0.
+
+`explain` calls every db.py function in one transaction that is rolled back,
+but the billing, outbox and import claims in it lock any queued rows they find
+until the run ends, stalling the workers. It refuses to start unless told the
+database is a scratch copy, with --scratch-db or EXPLAIN_SCRATCH_DB=1.
+"""
+import hashlib
+import os
+import re
+import sys
+import uuid
+from datetime import date
+import mysql.connector
+from mysql.connector import Error
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Queries allowed to scan a whole table, with the reason
+ALLOW_FULL_SCAN = {
+    'get_pending_managers': 'lists every pending signup for review; the table only holds unapproved signups',
+    'schedule_billing_runs': "checks every manager's billing day every few minutes from the billing worker",
+}
+# db.py functions not exercised by `explain`, with the reason
+EXPLAIN_SKIP = {
+    'get_user_by_email_and_password': 'legacy lookup against a users table that is not part of the schema',
+    '_node_query': 'directory lookups and shard copies, only run with DB_SHARDS set; all use primary or unique keys',
+    '_place_new_manager': 'only runs with DB_SHARDS set; counts managers per shard once per approval',
+}
+
+def connect(shard=0):
+    from db import shard_configs
+    return mysql.connector.connect(**shard_configs[shard])
+
+def each_shard(command):
+    """Run command(shard) on every shard in turn, stopping at the first one that fails."""
+    from db import shard_configs
+    for shard in sorted(shard_configs):
+        if len(shard_configs) > 1:
+            print(f"Shard {shard}:")
+        result = command(shard)
+        if result:
+            return result
+    return 0
+
+def load_migrations():
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r'(\d+)_(.+)\.sql$', filename)
+        if not match:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding='utf-8') as f:
+            sql = f.read()
+        migrations.append({
+            'version': int(match.group(1)),
+            'name': match.group(2),
+            'sql': sql,
+            'checksum': hashlib.sha256(sql.encode('utf-8')).hexdigest(),
+        })
+    return migrations
+
+def split_statements(sql):
+    """Split a migration into statements on semicolons that end a line."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in re.split(r';\s*$', '\n'.join(lines), flags=re.M) if statement.strip()]
+
+def applied_migrations(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            checksum CHAR(64) NOT NULL,
+            applied_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return dict(cursor.fetchall())
+
+def record(cursor, migration):
+    cursor.execute("INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                   (migration['version'], migration['name'], migration['checksum']))
+
+def upgrade(shard=0):
+    conn = connect(shard)
+    cursor = conn.cursor()
+    try:
+        applied = applied_migrations(cursor)
+        pending = [m for m in load_migrations() if m['version'] not in applied]
+        if not pending:
+            print("Schema is up to date")
+        for migration in pending:
+            print(f"Applying {migration['version']:03d}_{migration['name']}")
+            for statement in split_statements(migration['sql']):
+                cursor.execute(statement)
+            record(cursor, migration)
+            conn.commit()
+        return 0
+    except Error as e:
+        conn.rollback()
+        print(f"Migration failed: {str(e)}")
+        return 1
+    finally:
+        cursor.close()
+        conn.close()
+
+def status(shard=0):
+    conn = connect(shard)
+    cursor = conn.cursor()
+    try:
+        applied = applied_migrations(cursor)
+        conn.commit()
+        for migration in load_migrations():
+            checksum = applied.get(migration['version'])
+            if checksum is None:
+                state = 'pending'
+            elif checksum != migration['checksum']:
+                state = 'applied, file changed since'
+            else:
+                state = 'applied'
+            print(f"{migration['version']:03d}_{migration['name']:<40} {state}")
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+def baseline(version, shard=0):
+    conn = connect(shard)
+    cursor = conn.cursor()
+    try:
+        applied = applied_migrations(cursor)
+        for migration in load_migrations():
+            if migration['version'] <= version and migration['version'] not in applied:
+                record(cursor, migration)
+                print(f"Marked {migration['version']:03d}_{migration['name']} as applied")
+        conn.commit()
+        return 0
+    finally:
+        cursor.close()
+        conn.close()
+
+EXPLAINABLE = re.compile(r'^\s*(SELECT|UPDATE|DELETE|(INSERT|REPLACE)\b.*\bSELECT\b)', re.I | re.S)
+
+class ExplainConnection:
+    """Connection handed to db.py while `explain` runs.
+
+    Every statement is EXPLAINed with its real parameters before it executes.
+    commit() and rollback() do nothing, so all the data the run creates stays
+    in one transaction that is rolled back at the end.
+    """
+
+    def __init__(self, cnx):
+        self._cnx = cnx
+        self.plans = []
+        self.callers = set()
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def cursor(self, *args, statement=None, **kwargs):
+        # Plans are reported under the function that runs each statement, which sql_functions() can see
+        return ExplainCursor(self, self._cnx.cursor(*args, **kwargs))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def start_transaction(self, *args, **kwargs):
+        pass
+
+    def explain(self, statement, query, params):
+        self.callers.add(statement)
+        if not EXPLAINABLE.match(query):
+            return
+        cursor = self._cnx.cursor(dictionary=True, buffered=True)
+        try:
+            cursor.execute("EXPLAIN " + query, params)
+            self.plans.append((statement, ' '.join(query.split()), cursor.fetchall()))
+        finally:
+            cursor.close()
+
+class ExplainCursor:
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, params=()):
+        self._conn.explain(sys._getframe(1).f_code.co_name, query, params)
+        return self._cursor.execute(query, params)
+
+    def executemany(self, query, seq_params):
+        seq_params = list(seq_params)
+        if seq_params:
+            self._conn.explain(sys._getframe(1).f_code.co_name, query, seq_params[0])
+        return self._cursor.executemany(query, seq_params)
+
+def exercise(db):
+    """Call every db.py function that runs SQL against a throwaway manager."""
+    from passwords import hash_password
+    tag = uuid.uuid4().hex[:10]
+    password = hash_password('explain')
+    email = f"explain-{tag}@example.invalid"
+    db.add_pending_manager(f"explain-{tag}", email, tag, password)
+    db.add_pending_manager(f"explain-{tag}-rejected", f"rejected-{email}", tag, password)
+    pending = {p['email']: p['id'] for p in db.get_pending_managers()}
+    db.approve_manager(pending[email])
+    db.reject_manager(pending[f"rejected-{email}"])
+    manager_id = db.get_manager_by_email_and_password(email, 'explain')['id']
+
+    db.add_customer(f"E{tag}-1", f"6{tag[:9]}", 'Explain One', f"one-{email}", password, 199, 'Explain Street', manager_id)
+    db.add_customers_bulk(manager_id, [
+        {'row': row, 'box_number': f"E{tag}-{row}", 'mobile_number': f"{row}{tag[:9]}", 'name': f"Explain {row}",
+         'email': None, 'password': password, 'plan_amount': 299, 'address': 'Explain Street'}
+        for row in (2, 3)
+    ])
+    customer = db.get_all_customers(manager_id=manager_id)[0]
+    customer_id = customer['id']
+    db.get_customer(customer_id, manager_id)
+    db.get_customer_by_mobile_and_password(customer['mobile_number'], 'explain')
+    for sort in db.CUSTOMER_SORT_COLUMNS:
+        for direction in ('asc', 'desc'):
+            _, cursor = db.get_customers_page(manager_id, sort, direction, limit=1)
+            db.get_customers_page(manager_id, sort, direction, cursor=cursor, limit=1)
+    db.get_customers_page(manager_id, search='E', status='unpaid', balance=100, balance_op='gte')
+    db.update_customer(customer_id, customer['box_number'], customer['mobile_number'], 'Explain Renamed',
+                       customer['email'], password, 249, 'Explain Street', False, manager_id)
+
+    db.update_customer_balance(customer_id, 500, 'bill')
+    db.add_payment(customer_id, manager_id, 100, 'offline', 'completed', None)
+    db.post_payment(customer_id, manager_id, 50, 'offline', 'completed', None)
+    db.create_billing_run(manager_id, f"explain-{tag}")
+    # Day 1 with a default billing day of 2 keeps the scheduler from queuing real managers
+    db.schedule_billing_runs(date.today().replace(day=1), 2)
+    while db.bill_next_chunk(100, 'Explain'):
+        pass
+    db.get_payment_history(manager_id)
+    _, cursor = db.get_payments_page(manager_id, limit=1)
+    db.get_payments_page(manager_id, cursor=cursor, limit=1)
+    db.get_payments_page(manager_id, status='completed', customer_id=customer_id, direction='asc')
+    db.get_payments_page(manager_id, mobile_number=customer['mobile_number'][:4], start_date='2000-01-01', end_date='2100-01-01')
+    list(db.iter_customers(manager_id))
+    list(db.iter_payments(manager_id, start_date='2000-01-01'))
+    db.get_manager_summary(manager_id)
+    db.rebuild_manager_summary(manager_id)
+    db.audit_customer_balances(manager_id)
+    db.rebuild_customer_balance(customer_id)
+
+    db.enqueue_emails([{'manager_id': manager_id, 'to_email': f"one-{email}", 'subject': 'Explain',
+                        'template_type': 'credential', 'payload': {}}])
+    claimed = db.claim_pending_emails(1)
+    if claimed:
+        db.mark_emails_sent([claimed[0]['id']])
+        db.mark_email_failed(claimed[0]['id'], 'explain', 60)
+    db.get_email_status_counts(manager_id)
+
+    _, _, job_id = db.create_import_job(manager_id, [
+        {'row': row, 'box_number': f"E{tag}-{row}", 'mobile_number': f"{row}{tag[:9]}", 'name': f"Explain {row}",
+         'email': None, 'plan_amount': 299, 'address': 'Explain Street'}
+        for row in (4, 5)
+    ], [])
+    claimed = db.claim_import_rows(2)
+    if claimed:
+        claimed_job, claimed_manager, rows = claimed[0], claimed[1], [c['row'] for c in claimed[2]]
+        db.release_import_rows(claimed_manager, claimed_job, rows)
+        # Another job queued on this database is only released, never finished
+        if claimed_job == job_id:
+            db.finish_import_rows(manager_id, job_id, rows, 0, 0, [])
+    db.get_import_job(job_id, manager_id)
+    db.delete_customer(customer_id, manager_id)
+
+def sql_functions():
+    """Names of the db.py functions that execute SQL themselves."""
+    import ast
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'db.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef):
+            for call in ast.walk(node):
+                if (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute)
+                        and call.func.attr in ('execute', 'executemany')):
+                    names.add(node.name)
+    return names
+
+def explain():
+    import db
+    conn = ExplainConnection(connect())
+    db.get_connection = db._checkout = lambda *args: conn
+    # Every shard has the same schema, so the whole run stays on shard 0
+    db.SHARDED = False
+    # Cached reads would skip their queries
+    db.manager_cache.backend = None
+    try:
+        exercise(db)
+    finally:
+        conn._cnx.rollback()
+        conn._cnx.close()
+
+    failures = 0
+    for statement, query, plan in conn.plans:
+        scans = [row['table'] for row in plan if row.get('type') == 'ALL' and not str(row.get('table', '')).startswith('<')]
+        if scans and statement not in ALLOW_FULL_SCAN:
+            failures += 1
+            print(f"FULL SCAN in {statement} on {', '.join(scans)}: {query[:200]}")
+    missing = sql_functions() - conn.callers - set(EXPLAIN_SKIP)
+    for name in sorted(missing):
+        failures += 1
+        print(f"NOT EXERCISED: {name}")
+    print(f"Explained {len(conn.plans)} statements from {len(conn.callers)} functions, {failures} problems")
+    return 1 if failures else 0
+
+def main(argv):
+    command = argv[0] if argv else 'up'
+    if command == 'up':
+        return each_shard(upgrade)
+    if command == 'status':
+        return each_shard(status)
+    if command == 'baseline' and len(argv) == 2:
+        return each_shard(lambda shard: baseline(int(argv[1]), shard))
+    if command == 'explain':
+        if '--scratch-db' not in argv[1:] and os.getenv('EXPLAIN_SCRATCH_DB') != '1':
+            print("explain locks the queued rows of the database it runs on; "
+                  "point it at a scratch copy and pass --scratch-db (or set EXPLAIN_SCRATCH_DB=1)")
+            return 2
+        return explain()
+    print(__doc__)
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,46 @@
+-- Core tables as the application has always used them; later migrations tighten them
+CREATE TABLE IF NOT EXISTS managers (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    username VARCHAR(100) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    mobile_number VARCHAR(20) NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Manager signups waiting for approval
+CREATE TABLE IF NOT EXISTS pending_users (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    username VARCHAR(100) NOT NULL,
+    email VARCHAR(255) NOT NULL,
+    mobile_number VARCHAR(20) NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS customers (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    box_number VARCHAR(50) NOT NULL,
+    mobile_number VARCHAR(20) NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    email VARCHAR(255) NULL,
+    password VARCHAR(255) NOT NULL,
+    plan_amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    address VARCHAR(500) NULL,
+    manager_id INT NOT NULL,
+    is_temp_password BOOLEAN NOT NULL DEFAULT FALSE,
+    balance DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    customer_id INT NOT NULL,
+    manager_id INT NOT NULL,
+    amount DECIMAL(12, 2) NOT NULL,
+    payment_mode VARCHAR(20) NOT NULL,
+    payment_status VARCHAR(20) NOT NULL,
+    payment_reference VARCHAR(255) NULL,
+    payment_date DATETIME NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,19 @@
+-- Billing runs: one row per bulk billing request so a retried request is not billed twice
+CREATE TABLE IF NOT EXISTS billing_runs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    manager_id INT NOT NULL,
+    run_key VARCHAR(64) NOT NULL,
+    customer_count INT NOT NULL DEFAULT 0,
+    total_amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_billing_runs_manager_key (manager_id, run_key)
+);
+
+-- Amount billed to each customer in a run
+CREATE TABLE IF NOT EXISTS billing_run_items (
+    run_id INT NOT NULL,
+    customer_id INT NOT NULL,
+    amount DECIMAL(10, 2) NOT NULL,
+    PRIMARY KEY (run_id, customer_id),
+    KEY idx_billing_run_items_customer (customer_id)
+);
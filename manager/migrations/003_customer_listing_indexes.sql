@@ -0,0 +1,6 @@
+-- Keyset pagination over a manager's customers: one index per sortable column,
+-- each ending in id so (sort value, id) cursors are resolved from the index
+CREATE INDEX idx_customers_manager_box ON customers (manager_id, box_number, id);
+CREATE INDEX idx_customers_manager_name ON customers (manager_id, name, id);
+CREATE INDEX idx_customers_manager_mobile ON customers (manager_id, mobile_number, id);
+CREATE INDEX idx_customers_manager_balance ON customers (manager_id, balance, id);
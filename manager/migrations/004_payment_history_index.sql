@@ -0,0 +1,2 @@
+-- Bill history is always read per manager in payment_date order
+CREATE INDEX idx_payments_manager_date ON payments (manager_id, payment_date, id);
@@ -0,0 +1,19 @@
+-- Append-only record of every balance change; SUM(amount) per customer equals customers.balance
+CREATE TABLE IF NOT EXISTS balance_ledger (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    customer_id INT NOT NULL,
+    manager_id INT NOT NULL,
+    amount DECIMAL(12, 2) NOT NULL,
+    balance_after DECIMAL(12, 2) NOT NULL,
+    entry_type ENUM('opening', 'bill', 'payment', 'adjustment') NOT NULL,
+    reference VARCHAR(100) NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_balance_ledger_customer (customer_id, id),
+    KEY idx_balance_ledger_manager_created (manager_id, created_at)
+);
+
+-- Open the ledger with each customer's current balance
+INSERT INTO balance_ledger (customer_id, manager_id, amount, balance_after, entry_type, reference)
+SELECT c.id, c.manager_id, c.balance, c.balance, 'opening', 'migration 005'
+FROM customers c
+WHERE NOT EXISTS (SELECT 1 FROM balance_ledger l WHERE l.customer_id = c.id);
@@ -0,0 +1,44 @@
+-- Per-manager totals kept up to date by the write paths in db.py
+CREATE TABLE IF NOT EXISTS manager_summary (
+    manager_id INT PRIMARY KEY,
+    customer_count INT NOT NULL DEFAULT 0,
+    total_outstanding DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    bucket_paid INT NOT NULL DEFAULT 0,
+    bucket_low INT NOT NULL DEFAULT 0,
+    bucket_medium INT NOT NULL DEFAULT 0,
+    bucket_high INT NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- Completed payments summed per manager per day and per month
+CREATE TABLE IF NOT EXISTS manager_collections (
+    manager_id INT NOT NULL,
+    period_type ENUM('day', 'month') NOT NULL,
+    period_start DATE NOT NULL,
+    amount DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    payment_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (manager_id, period_type, period_start)
+);
+
+-- Backfill from existing data; bucket limits match ARREARS_LOW_LIMIT and ARREARS_MEDIUM_LIMIT in db.py
+INSERT INTO manager_summary (manager_id, customer_count, total_outstanding, bucket_paid, bucket_low, bucket_medium, bucket_high)
+SELECT manager_id, COUNT(*), SUM(balance),
+       SUM(balance <= 0), SUM(balance > 0 AND balance <= 500),
+       SUM(balance > 500 AND balance <= 2000), SUM(balance > 2000)
+FROM customers
+GROUP BY manager_id
+ON DUPLICATE KEY UPDATE customer_count = VALUES(customer_count), total_outstanding = VALUES(total_outstanding),
+    bucket_paid = VALUES(bucket_paid), bucket_low = VALUES(bucket_low),
+    bucket_medium = VALUES(bucket_medium), bucket_high = VALUES(bucket_high);
+
+INSERT INTO manager_collections (manager_id, period_type, period_start, amount, payment_count)
+SELECT manager_id, 'day', DATE(payment_date), SUM(amount), COUNT(*)
+FROM payments WHERE payment_status = 'completed'
+GROUP BY manager_id, DATE(payment_date)
+ON DUPLICATE KEY UPDATE amount = VALUES(amount), payment_count = VALUES(payment_count);
+
+INSERT INTO manager_collections (manager_id, period_type, period_start, amount, payment_count)
+SELECT manager_id, 'month', DATE_FORMAT(payment_date, '%Y-%m-01'), SUM(amount), COUNT(*)
+FROM payments WHERE payment_status = 'completed'
+GROUP BY manager_id, DATE_FORMAT(payment_date, '%Y-%m-01')
+ON DUPLICATE KEY UPDATE amount = VALUES(amount), payment_count = VALUES(payment_count);
@@ -0,0 +1,2 @@
+-- Manager login looks managers up by email
+CREATE INDEX idx_managers_email ON managers (email);
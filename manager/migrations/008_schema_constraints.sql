@@ -0,0 +1,31 @@
+-- Money columns hold exact amounts on databases created before the baseline
+ALTER TABLE customers
+    MODIFY plan_amount DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    MODIFY balance DECIMAL(12, 2) NOT NULL DEFAULT 0;
+ALTER TABLE payments MODIFY amount DECIMAL(12, 2) NOT NULL;
+
+-- Box and mobile numbers identify a customer within a manager's account;
+-- the unique keys replace the plain listing indexes on the same columns
+ALTER TABLE customers
+    ADD UNIQUE KEY uq_customers_manager_box (manager_id, box_number),
+    ADD UNIQUE KEY uq_customers_manager_mobile (manager_id, mobile_number),
+    DROP INDEX idx_customers_manager_box,
+    DROP INDEX idx_customers_manager_mobile;
+
+-- One manager account per email
+ALTER TABLE managers
+    ADD UNIQUE KEY uq_managers_email (email),
+    DROP INDEX idx_managers_email;
+
+-- Customer login looks customers up by mobile number alone
+CREATE INDEX idx_customers_mobile ON customers (mobile_number);
+
+-- A customer's payments in date order
+CREATE INDEX idx_payments_customer_date ON payments (customer_id, payment_date);
+
+-- payments.customer_id has no foreign key on purpose: bill history is kept
+-- after a customer is deleted
+ALTER TABLE customers ADD CONSTRAINT fk_customers_manager FOREIGN KEY (manager_id) REFERENCES managers (id);
+ALTER TABLE payments ADD CONSTRAINT fk_payments_manager FOREIGN KEY (manager_id) REFERENCES managers (id);
+ALTER TABLE billing_runs ADD CONSTRAINT fk_billing_runs_manager FOREIGN KEY (manager_id) REFERENCES managers (id);
+ALTER TABLE billing_run_items ADD CONSTRAINT fk_billing_run_items_run FOREIGN KEY (run_id) REFERENCES billing_runs (id);
@@ -0,0 +1,19 @@
+-- Billing runs are queued and then billed in chunks by the billing worker;
+-- runs recorded before this migration were billed in one go and are complete
+ALTER TABLE billing_runs
+    ADD COLUMN status ENUM('pending', 'running', 'completed') NOT NULL DEFAULT 'completed',
+    ADD COLUMN billing_period DATE NULL,
+    ADD COLUMN completed_at DATETIME NULL,
+    ADD KEY idx_billing_runs_status (status, id);
+ALTER TABLE billing_runs ALTER COLUMN status SET DEFAULT 'pending';
+
+-- billed_at is the checkpoint: an item is billed in the same transaction that sets it
+ALTER TABLE billing_run_items
+    ADD COLUMN billed_at DATETIME NULL,
+    ADD KEY idx_billing_run_items_pending (run_id, billed_at, customer_id);
+UPDATE billing_run_items i
+JOIN billing_runs r ON r.id = i.run_id
+SET i.billed_at = r.created_at;
+
+-- Day of the month each manager's customers are billed; NULL uses BILLING_DAY
+ALTER TABLE managers ADD COLUMN billing_day TINYINT NULL;
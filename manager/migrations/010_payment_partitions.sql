@@ -0,0 +1,27 @@
+-- Partitioned tables cannot have foreign keys
+ALTER TABLE payments DROP FOREIGN KEY fk_payments_manager;
+
+-- Every unique key of a partitioned table must include the partitioning column
+ALTER TABLE payments DROP PRIMARY KEY, ADD PRIMARY KEY (id, payment_date);
+
+-- Range partitions on payment_date; `python partitions.py maintain` splits
+-- p_future into one partition per month and folds archived months into p_archived
+ALTER TABLE payments PARTITION BY RANGE COLUMNS (payment_date) (
+    PARTITION p_archived VALUES LESS THAN ('2000-01-01'),
+    PARTITION p_future VALUES LESS THAN (MAXVALUE)
+);
+
+-- Closed months older than PAYMENT_ARCHIVE_MONTHS, moved out of payments and stored compressed
+CREATE TABLE IF NOT EXISTS payments_archive (
+    id INT NOT NULL PRIMARY KEY,
+    customer_id INT NOT NULL,
+    manager_id INT NOT NULL,
+    amount DECIMAL(12, 2) NOT NULL,
+    payment_mode VARCHAR(20) NOT NULL,
+    payment_status VARCHAR(20) NOT NULL,
+    payment_reference VARCHAR(255) NULL,
+    payment_date DATETIME NOT NULL,
+    created_at DATETIME NOT NULL,
+    KEY idx_payments_archive_manager_date (manager_id, payment_date, id),
+    KEY idx_payments_archive_customer_date (customer_id, payment_date)
+) ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
@@ -0,0 +1,11 @@
+-- Which shard holds each manager's rows, read on shard 0; managers without a row live on shard 0.
+-- frozen is set by rebalance.py while a manager's rows are copied to another shard.
+-- The table exists on every shard so they all share one schema, but is only filled on shard 0.
+CREATE TABLE IF NOT EXISTS manager_shards (
+    manager_id INT NOT NULL PRIMARY KEY,
+    shard SMALLINT NOT NULL,
+    frozen BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    KEY idx_manager_shards_frozen (frozen),
+    KEY idx_manager_shards_shard (shard)
+);
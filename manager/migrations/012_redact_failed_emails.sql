@@ -0,0 +1,2 @@
+-- Failed emails are never retried, so their payloads (which may hold temporary passwords) are not needed.
+UPDATE email_outbox SET payload = NULL WHERE status = 'failed' AND payload IS NOT NULL;
@@ -0,0 +1,26 @@
+-- Customer imports: the upload is validated in the request and its rows are
+-- saved by the import worker in batches, so large files do not hold a web worker
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    manager_id INT NOT NULL,
+    status ENUM('pending', 'running', 'completed') NOT NULL DEFAULT 'pending',
+    total_rows INT NOT NULL,
+    imported INT NOT NULL DEFAULT 0,
+    emails_queued INT NOT NULL DEFAULT 0,
+    errors JSON NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    completed_at DATETIME NULL,
+    KEY idx_import_jobs_status (status, id),
+    KEY idx_import_jobs_manager (manager_id, id),
+    CONSTRAINT fk_import_jobs_manager FOREIGN KEY (manager_id) REFERENCES managers (id)
+);
+
+-- Valid rows waiting to be saved, deleted as each batch is saved; locked_at
+-- marks a batch a worker is hashing and saving
+CREATE TABLE IF NOT EXISTS import_job_rows (
+    job_id BIGINT NOT NULL,
+    source_row INT NOT NULL,
+    customer JSON NOT NULL,
+    locked_at DATETIME NULL,
+    PRIMARY KEY (job_id, source_row)
+);
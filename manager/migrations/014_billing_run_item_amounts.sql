@@ -0,0 +1,2 @@
+-- Item amounts are copied from customers.plan_amount, which is DECIMAL(12, 2) since 008
+ALTER TABLE billing_run_items MODIFY amount DECIMAL(12, 2) NOT NULL;
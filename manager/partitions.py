@@ -0,0 +1,177 @@
+"""Maintain the monthly partitions of payments and archive old months.
+
+    python partitions.py maintain [--ahead 3] [--batch-size 5000]
+    python partitions.py status
+
+`maintain` is safe to run as often as wanted (daily from cron is plenty):
+
+1. Splits p_future so every month up to --ahead months from now has its own
+   partition. p_future normally holds no rows, so this only touches metadata.
+   The first run after migration 010 also splits out the existing history,
+   which copies the table once.
+2. Moves every month older than PAYMENT_ARCHIVE_MONTHS into the compressed
+   payments_archive table in batches, each one a transaction, then merges the
+   emptied partition into p_archived. A payment dated into an archived month
+   later on lands in p_archived and is swept up by the next run.
+
+Bill history queries read payments_archive only when asked for a start date
+before the archive cutoff (see db.archive_cutoff). Lowering
+PAYMENT_ARCHIVE_MONTHS is safe; raising it does not bring archived months back.
+
+Both commands go through every shard in DB_SHARDS. Do not run `maintain`
+while rebalance.py is moving a manager.
+"""
+import argparse
+import sys
+from datetime import date
+import mysql.connector
+from mysql.connector import Error
+from db import shard_configs, month_start, archive_cutoff
+
+PAYMENT_COLUMNS = "id, customer_id, manager_id, amount, payment_mode, payment_status, payment_reference, payment_date, created_at"
+
+def connect(shard):
+    return mysql.connector.connect(**shard_configs[shard])
+
+def next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+def list_partitions(cursor):
+    """Return [(name, upper bound or None for MAXVALUE, estimated rows)] in order."""
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+        FROM INFORMATION_SCHEMA.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'payments'
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """)
+    partitions = []
+    for name, description, rows in cursor.fetchall():
+        if name is None:
+            raise Error("payments is not partitioned; run `python migrate.py` first")
+        bound = None if description == 'MAXVALUE' else date.fromisoformat(description.strip("'")[:10])
+        partitions.append((name, bound, rows))
+    return partitions
+
+def add_future_partitions(cursor, ahead, today=None):
+    """Give each month up to `ahead` months from now its own partition; returns their names."""
+    partitions = list_partitions(cursor)
+    last_bound = max(bound for _, bound, _ in partitions if bound is not None)
+    if len(partitions) == 2:
+        # Only p_archived and p_future: start at the oldest payment instead of at p_archived's bound
+        cursor.execute("SELECT MIN(payment_date) FROM payments PARTITION (p_future)")
+        oldest = cursor.fetchone()[0]
+        month = month_start(0, oldest.date() if oldest else today)
+    else:
+        month = last_bound
+    last_month = month_start(-ahead, today)
+    added = []
+    while month <= last_month:
+        added.append((f"p{month:%Y%m}", next_month(month)))
+        month = next_month(month)
+    if added:
+        definitions = ', '.join(f"PARTITION {name} VALUES LESS THAN ('{bound}')" for name, bound in added)
+        cursor.execute(f"""
+            ALTER TABLE payments REORGANIZE PARTITION p_future INTO (
+                {definitions}, PARTITION p_future VALUES LESS THAN (MAXVALUE)
+            )
+        """)
+    return [name for name, _ in added]
+
+def move_to_archive(conn, partition, batch_size):
+    """Move the rows of one partition into payments_archive, batch_size rows per transaction."""
+    cursor = conn.cursor()
+    moved = 0
+    try:
+        while True:
+            # Locks the batch so it cannot change between the copy and the delete
+            cursor.execute(f"SELECT id FROM payments PARTITION ({partition}) ORDER BY id LIMIT %s FOR UPDATE", (batch_size,))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                conn.commit()
+                return moved
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"""
+                INSERT INTO payments_archive ({PAYMENT_COLUMNS})
+                SELECT {PAYMENT_COLUMNS} FROM payments PARTITION ({partition}) WHERE id IN ({placeholders})
+            """, ids)
+            cursor.execute(f"DELETE FROM payments PARTITION ({partition}) WHERE id IN ({placeholders})", ids)
+            conn.commit()
+            moved += len(ids)
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def archive_closed_months(conn, batch_size, today=None):
+    """Archive every month before the archive cutoff; returns {partition: rows moved}."""
+    cutoff = archive_cutoff(today)
+    cursor = conn.cursor()
+    try:
+        partitions = list_partitions(cursor)
+    finally:
+        cursor.close()
+    archived = {'p_archived': move_to_archive(conn, 'p_archived', batch_size)}
+    for name, bound, _ in partitions:
+        if name in ('p_archived', 'p_future') or bound > cutoff:
+            continue
+        archived[name] = move_to_archive(conn, name, batch_size)
+        cursor = conn.cursor()
+        try:
+            # Partitions are merged oldest first, so p_archived always sits right before this one
+            cursor.execute(f"""
+                ALTER TABLE payments REORGANIZE PARTITION p_archived, {name} INTO (
+                    PARTITION p_archived VALUES LESS THAN ('{bound}')
+                )
+            """)
+        finally:
+            cursor.close()
+    return archived
+
+def maintain(ahead, batch_size, shard=0):
+    conn = connect(shard)
+    cursor = conn.cursor()
+    try:
+        added = add_future_partitions(cursor, ahead)
+        print(f"Added partitions: {', '.join(added)}" if added else "Future partitions already exist")
+        for name, moved in archive_closed_months(conn, batch_size).items():
+            if moved or name != 'p_archived':
+                print(f"Archived {moved} payments from {name}")
+        return 0
+    except Error as e:
+        print(f"Partition maintenance failed: {str(e)}")
+        return 1
+    finally:
+        cursor.close()
+        conn.close()
+
+def status(shard=0):
+    conn = connect(shard)
+    cursor = conn.cursor()
+    try:
+        for name, bound, rows in list_partitions(cursor):
+            print(f"{name:<12} < {bound or 'MAXVALUE'!s:<10} ~{rows} rows")
+        cursor.execute("SELECT COUNT(*), MIN(payment_date), MAX(payment_date) FROM payments_archive")
+        count, oldest, newest = cursor.fetchone()
+        print(f"payments_archive: {count} rows" + (f" from {oldest:%Y-%m-%d} to {newest:%Y-%m-%d}" if count else ""))
+        print(f"Archive cutoff: {archive_cutoff()}")
+        return 0
+    except Error as e:
+        print(f"Could not read partitions: {str(e)}")
+        return 1
+    finally:
+        cursor.close()
+        conn.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', nargs='?', choices=('maintain', 'status'), default='maintain')
+    parser.add_argument('--ahead', type=int, default=3, help='months after the current one to create partitions for')
+    parser.add_argument('--batch-size', type=int, default=5000, help='payments moved to the archive per transaction')
+    args = parser.parse_args()
+    failed = 0
+    for shard in sorted(shard_configs):
+        if len(shard_configs) > 1:
+            print(f"Shard {shard}:")
+        failed |= maintain(args.ahead, args.batch_size, shard) if args.command == 'maintain' else status(shard)
+    sys.exit(failed)
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import random
+import string
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask_bcrypt import generate_password_hash, check_password_hash
+from metrics import timed
+
+# bcrypt cost factor for new hashes; existing hashes are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+# bcrypt is CPU-bound, so hashing runs in a bounded pool of processes
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+PASSWORD_HASH_OFFLOAD = os.getenv('PASSWORD_HASH_OFFLOAD', '1') == '1'
+# Requests waiting for a hashing slot beyond this many are rejected instead of queued
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', PASSWORD_HASH_WORKERS * 4))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+# Bulk hashing (customer imports) sends passwords in chunks of this size, and keeps at most
+# PASSWORD_HASH_BULK_SLOTS chunks in flight so logins still find free workers
+PASSWORD_HASH_BULK_CHUNK = int(os.getenv('PASSWORD_HASH_BULK_CHUNK', 8))
+PASSWORD_HASH_BULK_SLOTS = int(os.getenv('PASSWORD_HASH_BULK_SLOTS', max(1, PASSWORD_HASH_WORKERS // 2)))
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+class PasswordServiceBusy(Exception):
+    """Raised when too many password operations are already waiting."""
+
+def generate_password(length=8):
+    """Generate a random password."""
+    characters = string.ascii_letters + string.digits + string.punctuation
+    return ''.join(random.choice(characters) for _ in range(length))
+
+def _hash(password, rounds):
+    return generate_password_hash(password, rounds).decode('utf-8')
+
+def _hash_many(passwords, rounds):
+    return [_hash(password, rounds) for password in passwords]
+
+def _check(hashed, password):
+    return check_password_hash(hashed, password)
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        return _executor
+
+def _run(fn, *args, timeout=None):
+    """Run a bcrypt operation in the process pool, or inline if offload is disabled."""
+    if not PASSWORD_HASH_OFFLOAD:
+        return fn(*args)
+    if not _pending.acquire(timeout=PASSWORD_HASH_TIMEOUT):
+        raise PasswordServiceBusy("Too many password operations in progress")
+    try:
+        future = get_executor().submit(fn, *args)
+        try:
+            return future.result(timeout=timeout or PASSWORD_HASH_TIMEOUT)
+        except FutureTimeoutError:
+            # Drops it if still queued; one already running finishes in the pool and is discarded
+            future.cancel()
+            raise PasswordServiceBusy("Password operation timed out")
+    finally:
+        _pending.release()
+
+async def _run_async(fn, *args):
+    """Like _run, but awaits the process pool instead of blocking the event loop.
+
+    There is no waiting for a slot here: when PASSWORD_HASH_MAX_PENDING
+    operations are already in flight the call fails at once.
+    """
+    if not PASSWORD_HASH_OFFLOAD:
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+    if not _pending.acquire(blocking=False):
+        raise PasswordServiceBusy("Too many password operations in progress")
+    try:
+        # wait_for cancels the pool future when it gives up
+        return await asyncio.wait_for(asyncio.wrap_future(get_executor().submit(fn, *args)), PASSWORD_HASH_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PasswordServiceBusy("Password operation timed out")
+    finally:
+        _pending.release()
+
+def hash_password(password, rounds=None):
+    with timed('password_duration_seconds', operation='hash'):
+        return _run(_hash, password, rounds or BCRYPT_ROUNDS)
+
+def hash_passwords(passwords, rounds=None):
+    """Hash many passwords in parallel, returning hashes in the same order.
+
+    Each chunk goes through _run, so it takes an admission slot and is bounded
+    by PASSWORD_HASH_TIMEOUT per password like a single hash.
+    """
+    rounds = rounds or BCRYPT_ROUNDS
+    with timed('password_duration_seconds', operation='hash_bulk'):
+        if len(passwords) < 2 or not PASSWORD_HASH_OFFLOAD:
+            return _hash_many(passwords, rounds)
+        chunks = [passwords[i:i + PASSWORD_HASH_BULK_CHUNK] for i in range(0, len(passwords), PASSWORD_HASH_BULK_CHUNK)]
+        with ThreadPoolExecutor(max_workers=PASSWORD_HASH_BULK_SLOTS) as dispatch:
+            hashed = dispatch.map(
+                lambda chunk: _run(_hash_many, chunk, rounds, timeout=PASSWORD_HASH_TIMEOUT * len(chunk)), chunks
+            )
+            return [h for chunk in hashed for h in chunk]
+
+def hash_cost(hashed):
+    """Return the cost factor stored in a bcrypt hash such as $2b$12$..."""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def needs_rehash(hashed):
+    return hash_cost(hashed) != BCRYPT_ROUNDS
+
+def verify_password(hashed, password):
+    """Check a password; return (matches, new_hash).
+
+    new_hash is set when the password matched but was stored with a different
+    cost factor, so the caller can save the upgraded hash.
+    """
+    if not hashed:
+        return False, None
+    with timed('password_duration_seconds', operation='check'):
+        matches = _run(_check, hashed, password)
+    if not matches:
+        return False, None
+    if needs_rehash(hashed):
+        return True, hash_password(password)
+    return True, None
+
+async def verify_password_async(hashed, password):
+    """verify_password for the async app; bcrypt runs in the same process pool."""
+    if not hashed:
+        return False, None
+    with timed('password_duration_seconds', operation='check'):
+        matches = await _run_async(_check, hashed, password)
+    if not matches:
+        return False, None
+    if needs_rehash(hashed):
+        with timed('password_duration_seconds', operation='hash'):
+            return True, await _run_async(_hash, password, BCRYPT_ROUNDS)
+    return True, None
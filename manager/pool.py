@@ -0,0 +1,283 @@
+import queue
+import threading
+import time
+import mysql.connector
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+from metrics import InstrumentedCursor
+
+# Upper bounds (seconds) of the checkout wait-time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Slot:
+    """A raw connection plus the bookkeeping needed to recycle it."""
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+class PooledConnection:
+    """Proxy handed out by the pool; close() returns the connection instead of closing it."""
+
+    def __init__(self, pool, slot):
+        self._pool = pool
+        self._slot = slot
+
+    def __getattr__(self, name):
+        return getattr(self._slot.cnx, name)
+
+    def cursor(self, *args, statement='unknown', **kwargs):
+        """A cursor whose statements are timed under `statement`, normally the db.py function name."""
+        return InstrumentedCursor(self._slot.cnx.cursor(*args, **kwargs), statement)
+
+    def close(self):
+        if self._slot is not None:
+            slot, self._slot = self._slot, None
+            self._pool._release(slot)
+
+class ConnectionPool:
+    """Blocking MySQL connection pool with health checks, recycling and metrics.
+
+    Connections are opened lazily on first use, so importing db.py does not need
+    a reachable database. Checkout waits up to `timeout` seconds for a free
+    connection before raising PoolError. Idle connections older than `recycle`
+    seconds are replaced, and ones idle for more than `ping_after` seconds are
+    pinged before being handed out. `session_sql` statements run on every new
+    connection.
+    """
+
+    def __init__(self, config, size=5, timeout=10, recycle=3600, ping_after=30, session_sql=()):
+        self.config = config
+        self.session_sql = session_sql
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._open_count = 0
+        self._stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'connect_errors': 0,
+            'recycled': 0,
+            'broken': 0,
+            'wait_seconds_total': 0.0,
+        }
+        self._wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def get_connection(self, timeout=None):
+        """Check out a connection, waiting up to `timeout` seconds (default: the pool's timeout)."""
+        if timeout is None:
+            timeout = self.timeout
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolError(f"Timed out after {timeout}s waiting for a database connection")
+        waited = time.perf_counter() - started
+        try:
+            slot = self._checkout_idle() or self._open()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['wait_seconds_total'] += waited
+            self._wait_buckets[self._bucket(waited)] += 1
+        return PooledConnection(self, slot)
+
+    def _bucket(self, waited):
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if waited <= bound:
+                return i
+        return len(WAIT_BUCKETS)
+
+    def _checkout_idle(self):
+        while True:
+            try:
+                slot = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            now = time.monotonic()
+            if now - slot.created_at > self.recycle:
+                self._discard(slot, 'recycled')
+                continue
+            if now - slot.last_used > self.ping_after:
+                try:
+                    slot.cnx.ping(reconnect=False)
+                except Error:
+                    self._discard(slot, 'broken')
+                    continue
+            return slot
+
+    def _open(self):
+        try:
+            cnx = mysql.connector.connect(**self.config)
+            try:
+                cursor = cnx.cursor()
+                for statement in self.session_sql:
+                    cursor.execute(statement)
+                cursor.close()
+            except Error:
+                cnx.close()
+                raise
+        except Error:
+            with self._lock:
+                self._stats['connect_errors'] += 1
+            raise
+        with self._lock:
+            self._stats['connects'] += 1
+            self._open_count += 1
+        return _Slot(cnx)
+
+    def _discard(self, slot, reason):
+        try:
+            slot.cnx.close()
+        except Error:
+            pass
+        with self._lock:
+            self._stats[reason] += 1
+            self._open_count -= 1
+
+    def _release(self, slot):
+        try:
+            # End any open transaction so the next user does not inherit its snapshot
+            if slot.cnx.in_transaction:
+                slot.cnx.rollback()
+            slot.last_used = time.monotonic()
+            self._idle.put(slot)
+        except Error:
+            self._discard(slot, 'broken')
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def stats(self):
+        """Snapshot of the pool counters and the cumulative wait-time histogram."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['in_use'] = self._in_use
+            stats['open'] = self._open_count
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(WAIT_BUCKETS + (float('inf'),), self._wait_buckets):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            stats['wait_buckets'] = buckets
+        return stats
+
+class _Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.down_until = 0.0
+        self.lag = None
+        self.checked_at = float('-inf')
+        self.failures = 0
+
+class ReplicaRouter:
+    """Hands out connections to healthy read replicas in turn.
+
+    A replica is skipped for `retry_after` seconds after a connection to it
+    fails, and while its replication lag, measured at most every
+    `check_interval` seconds, is unknown or above `max_lag` seconds. A
+    replica whose pool has no free connection within `checkout_timeout`
+    seconds is only skipped for that read, since it is busy rather than down.
+    A server that reports no replication status has unknown lag, unless
+    `allow_standalone` is set for test setups that use a second standalone
+    instance as the replica. get_connection() returns None when no replica
+    is usable, and the caller reads from the primary instead.
+    """
+
+    def __init__(self, pools, max_lag=5, check_interval=5, retry_after=30, checkout_timeout=0, allow_standalone=False):
+        self.replicas = [_Replica(name, pool) for name, pool in pools]
+        self.allow_standalone = allow_standalone
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.checkout_timeout = checkout_timeout
+        self._lock = threading.Lock()
+        self._next = 0
+        self._stats = {'reads': 0, 'fallbacks': 0, 'busy': 0}
+
+    def get_connection(self):
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if time.monotonic() < replica.down_until:
+                continue
+            try:
+                conn = replica.pool.get_connection(timeout=self.checkout_timeout)
+            except PoolError:
+                # Exhausted, not unreachable: try the next replica or the primary without waiting
+                with self._lock:
+                    self._stats['busy'] += 1
+                continue
+            except Error:
+                self._mark_down(replica)
+                continue
+            if self._lag_ok(replica, conn):
+                with self._lock:
+                    self._stats['reads'] += 1
+                return conn
+            conn.close()
+        with self._lock:
+            self._stats['fallbacks'] += 1
+        return None
+
+    def _mark_down(self, replica):
+        with self._lock:
+            replica.down_until = time.monotonic() + self.retry_after
+            replica.failures += 1
+
+    def _lag_ok(self, replica, conn):
+        now = time.monotonic()
+        if now - replica.checked_at >= self.check_interval:
+            replica.checked_at = now
+            try:
+                replica.lag = self._measure_lag(conn._slot.cnx)
+            except Error:
+                self._mark_down(replica)
+                return False
+        return replica.lag is not None and replica.lag <= self.max_lag
+
+    def _measure_lag(self, cnx):
+        """Seconds the replica is behind its source; None while replication is stopped or not set up."""
+        cursor = cnx.cursor(dictionary=True, buffered=True)
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except Error:
+                # Servers before MySQL 8.0.22 only know the old name
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        if row is None:
+            # Not replicating at all, so it may hold any old copy of the data
+            return 0 if self.allow_standalone else None
+        return row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+
+    def stats(self):
+        """Router counters plus, per replica, whether it is marked down, its last measured lag and pool stats."""
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._stats)
+        stats['replicas'] = [{
+            'name': replica.name,
+            'down': now < replica.down_until,
+            'lag': replica.lag,
+            'failures': replica.failures,
+            **replica.pool.stats(),
+        } for replica in self.replicas]
+        return stats
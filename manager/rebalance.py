@@ -0,0 +1,317 @@
+"""Prepare new shards and move managers between them.
+
+    python rebalance.py status
+    python rebalance.py init SHARD
+    python rebalance.py move MANAGER_ID SHARD [--batch-size 2000] [--drain-timeout 120]
+
+A new shard is added to DB_SHARDS, given the schema with `python migrate.py`
+and then prepared with `init`. `init` raises its AUTO_INCREMENT counters
+above every id shard 0 holds, so ids handed out before sharding was turned on
+are never issued again. Run it once every process has DB_SHARDS set.
+
+`move` copies one manager's rows to another shard while the manager keeps
+working:
+
+1. Copies the manager's account row, then payments, payments_archive and
+   balance_ledger, which only ever gain rows, in batches.
+2. Freezes the manager in manager_shards and waits DB_SHARD_MAP_TTL for every
+   process to notice. Frozen managers can still read, but their writes fail
+   with a "please try again" message and the billing and email workers skip
+   them. Then waits for emails already being sent to finish.
+3. Copies the rows added since step 1, copies the remaining tables in full and
+   checks that the row counts on both shards match.
+4. Points the directory at the new shard and unfreezes the manager, waits
+   DB_SHARD_MAP_TTL again, then deletes the rows from the old shard.
+
+A move that fails before step 4 unfreezes the manager on its old shard; what
+it copied is cleared by the next attempt. Do not run `partitions.py maintain`
+while a move is in progress.
+"""
+import argparse
+import sys
+import time
+import mysql.connector
+from mysql.connector import Error
+from cache import manager_cache
+from db import shard_configs, MAIN_SHARD, SHARD_MAP_TTL
+
+# Tables that only ever gain rows, copied before the manager is frozen and topped up after
+APPEND_ONLY_TABLES = ('payments', 'payments_archive', 'balance_ledger')
+# Every other table holding a manager's rows, parents first, with the condition selecting them
+MANAGER_TABLES = (
+    ('customers', 'manager_id = %s'),
+    ('billing_runs', 'manager_id = %s'),
+    ('billing_run_items', 'run_id IN (SELECT id FROM billing_runs WHERE manager_id = %s)'),
+    ('email_outbox', 'manager_id = %s'),
+    ('import_jobs', 'manager_id = %s'),
+    ('import_job_rows', 'job_id IN (SELECT id FROM import_jobs WHERE manager_id = %s)'),
+    ('manager_summary', 'manager_id = %s'),
+    ('manager_collections', 'manager_id = %s'),
+)
+# Tables whose ids come from AUTO_INCREMENT, with the tables sharing their ids
+ID_TABLES = {
+    'managers': ('managers',),
+    'pending_users': ('pending_users',),
+    'customers': ('customers',),
+    'payments': ('payments', 'payments_archive'),
+    'balance_ledger': ('balance_ledger',),
+    'billing_runs': ('billing_runs',),
+    'email_outbox': ('email_outbox',),
+    'import_jobs': ('import_jobs',),
+}
+
+def connect(shard):
+    # Autocommit, so every read sees the latest committed rows
+    return mysql.connector.connect(autocommit=True, **shard_configs[shard])
+
+def directory_entry(main, manager_id):
+    """Return (shard, frozen) of a manager straight from the directory, bypassing the cache."""
+    cursor = main.cursor()
+    try:
+        cursor.execute("SELECT id FROM managers WHERE id = %s", (manager_id,))
+        if not cursor.fetchone():
+            raise Error(msg=f"Manager {manager_id} does not exist")
+        cursor.execute("SELECT shard, frozen FROM manager_shards WHERE manager_id = %s", (manager_id,))
+        row = cursor.fetchone()
+        return (row[0], bool(row[1])) if row else (MAIN_SHARD, False)
+    finally:
+        cursor.close()
+
+def set_directory(main, manager_id, shard, frozen):
+    cursor = main.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO manager_shards (manager_id, shard, frozen) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE shard = VALUES(shard), frozen = VALUES(frozen)
+        """, (manager_id, shard, frozen))
+    finally:
+        cursor.close()
+
+def count_rows(conn, table, condition, manager_id):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {condition}", (manager_id,))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+def copy_rows(source, target, table, condition, params, batch_size, upsert=False):
+    """Insert the rows of table matching condition from source into target; returns (rows, highest id).
+
+    A row already on the target is a duplicate key error unless `upsert`, so
+    an id clash with another manager's rows stops the move instead of
+    overwriting them.
+    """
+    read = source.cursor(buffered=False)
+    write = target.cursor()
+    copied, highest = 0, None
+    try:
+        read.execute(f"SELECT * FROM {table} WHERE {condition}", params)
+        columns = list(read.column_names)
+        insert = f"INSERT INTO {table} ({', '.join(f'`{column}`' for column in columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        if upsert:
+            insert += " ON DUPLICATE KEY UPDATE " + ', '.join(f"`{column}` = VALUES(`{column}`)" for column in columns)
+        while True:
+            rows = read.fetchmany(batch_size)
+            if not rows:
+                break
+            write.executemany(insert, rows)
+            copied += len(rows)
+            if 'id' in columns:
+                highest = max([highest or 0] + [row[columns.index('id')] for row in rows])
+        return copied, highest
+    finally:
+        try:
+            read.close()
+        except Error:
+            pass
+        write.close()
+
+def delete_rows(conn, table, condition, manager_id, batch_size):
+    """Delete the manager's rows of table in batches; returns the number deleted."""
+    cursor = conn.cursor()
+    deleted = 0
+    try:
+        while True:
+            cursor.execute(f"DELETE FROM {table} WHERE {condition} LIMIT %s", (manager_id, batch_size))
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+    finally:
+        cursor.close()
+
+def delete_manager_rows(conn, manager_id, batch_size):
+    """Delete every row of the manager from one shard, children first; the account row stays."""
+    for table, condition in reversed(MANAGER_TABLES):
+        delete_rows(conn, table, condition, manager_id, batch_size)
+    for table in APPEND_ONLY_TABLES:
+        delete_rows(conn, table, 'manager_id = %s', manager_id, batch_size)
+
+def fill_missing(source, target, table, manager_id, batch_size):
+    """Copy rows of an append-only table that are on source but not target, whatever their id."""
+    ids = []
+    for conn in (source, target):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT id FROM {table} WHERE manager_id = %s", (manager_id,))
+            ids.append({row[0] for row in cursor.fetchall()})
+        finally:
+            cursor.close()
+    missing = sorted(ids[0] - ids[1])
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        copy_rows(source, target, table, f"id IN ({', '.join(['%s'] * len(batch))})", batch, batch_size)
+    return len(missing)
+
+def wait_for_sends(source, manager_id, timeout):
+    """Wait until none of the manager's emails is being sent, so none is marked sent on the old shard."""
+    deadline = time.monotonic() + timeout
+    while True:
+        sending = count_rows(source, 'email_outbox', "manager_id = %s AND status = 'sending'", manager_id)
+        if not sending:
+            return
+        if time.monotonic() > deadline:
+            raise Error(msg=f"{sending} emails still being sent after {timeout}s; "
+                            "emails left by a crashed mailer are reclaimed after its stale timeout")
+        time.sleep(1)
+
+def move(manager_id, target, batch_size, drain_timeout):
+    if target not in shard_configs:
+        print(f"Shard {target} is not in DB_SHARDS")
+        return 2
+    main = connect(MAIN_SHARD)
+    frozen = switched = False
+    try:
+        source, was_frozen = directory_entry(main, manager_id)
+        if source == target:
+            print(f"Manager {manager_id} is already on shard {target}")
+            return 0
+        if was_frozen:
+            print(f"Manager {manager_id} is frozen; another move may be running")
+            return 1
+        src, dst = connect(source), connect(target)
+        try:
+            print(f"Moving manager {manager_id} from shard {source} to shard {target}")
+            # Rows left on the target by an earlier failed attempt
+            delete_manager_rows(dst, manager_id, batch_size)
+            if target != MAIN_SHARD:
+                # Backs the foreign keys of the manager's rows; logins keep using the account on shard 0
+                copy_rows(main, dst, 'managers', 'id = %s', (manager_id,), batch_size, upsert=True)
+
+            watermarks = {}
+            for table in APPEND_ONLY_TABLES:
+                copied, watermarks[table] = copy_rows(src, dst, table, 'manager_id = %s', (manager_id,), batch_size)
+                print(f"  {table}: {copied} rows copied while live")
+
+            set_directory(main, manager_id, source, True)
+            frozen = True
+            print(f"  Frozen; waiting {SHARD_MAP_TTL + 1:g}s for every process to notice")
+            time.sleep(SHARD_MAP_TTL + 1)
+            wait_for_sends(src, manager_id, drain_timeout)
+
+            for table in APPEND_ONLY_TABLES:
+                copied, _ = copy_rows(src, dst, table, 'manager_id = %s AND id > %s',
+                                      (manager_id, watermarks[table] or 0), batch_size)
+                # Rows committed out of id order during the live copy sit below the watermark
+                if count_rows(src, table, 'manager_id = %s', manager_id) != count_rows(dst, table, 'manager_id = %s', manager_id):
+                    copied += fill_missing(src, dst, table, manager_id, batch_size)
+                print(f"  {table}: {copied} rows copied while frozen")
+            for table, condition in MANAGER_TABLES:
+                copied, _ = copy_rows(src, dst, table, condition, (manager_id,), batch_size)
+                print(f"  {table}: {copied} rows copied")
+            for table, condition in MANAGER_TABLES + tuple((table, 'manager_id = %s') for table in APPEND_ONLY_TABLES):
+                expected, actual = count_rows(src, table, condition, manager_id), count_rows(dst, table, condition, manager_id)
+                if expected != actual:
+                    raise Error(msg=f"{table} has {expected} rows on shard {source} but {actual} on shard {target}")
+
+            set_directory(main, manager_id, target, False)
+            switched = True
+            manager_cache.invalidate(manager_id)
+            print(f"  Switched to shard {target}; waiting {SHARD_MAP_TTL + 1:g}s before cleaning up shard {source}")
+            time.sleep(SHARD_MAP_TTL + 1)
+            delete_manager_rows(src, manager_id, batch_size)
+            if source != MAIN_SHARD:
+                delete_rows(src, 'managers', 'id = %s', manager_id, batch_size)
+            print(f"Moved manager {manager_id} to shard {target}")
+            return 0
+        finally:
+            src.close()
+            dst.close()
+    except Error as e:
+        if frozen and not switched:
+            try:
+                set_directory(main, manager_id, source, False)
+                print(f"Unfroze manager {manager_id} on shard {source}")
+            except Error as unfreeze_error:
+                print(f"Could not unfreeze manager {manager_id}: {str(unfreeze_error)}")
+        print(f"Move failed: {str(e)}")
+        return 1
+    finally:
+        main.close()
+
+def init_shard(shard):
+    if shard == MAIN_SHARD or shard not in shard_configs:
+        print(f"Shard {shard} is not an extra shard in DB_SHARDS")
+        return 2
+    main, node = connect(MAIN_SHARD), connect(shard)
+    main_cursor, node_cursor = main.cursor(), node.cursor()
+    try:
+        for table, id_tables in ID_TABLES.items():
+            highest = 0
+            for cursor in (main_cursor, node_cursor):
+                for id_table in id_tables:
+                    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {id_table}")
+                    highest = max(highest, cursor.fetchone()[0])
+            node_cursor.execute(f"ALTER TABLE {table} AUTO_INCREMENT = {highest + 1}")
+            print(f"{table}: ids on shard {shard} start above {highest}")
+        return 0
+    except Error as e:
+        print(f"Could not initialise shard {shard}: {str(e)}")
+        return 1
+    finally:
+        main_cursor.close()
+        node_cursor.close()
+        main.close()
+        node.close()
+
+def status():
+    main = connect(MAIN_SHARD)
+    cursor = main.cursor()
+    try:
+        cursor.execute("""
+            SELECT COALESCE(s.shard, 0), COUNT(*), COALESCE(SUM(s.frozen), 0)
+            FROM managers m
+            LEFT JOIN manager_shards s ON s.manager_id = m.id
+            GROUP BY COALESCE(s.shard, 0)
+        """)
+        counts = {shard: (managers, frozen) for shard, managers, frozen in cursor.fetchall()}
+        for shard in sorted(set(shard_configs) | set(counts)):
+            config = shard_configs.get(shard)
+            location = f"{config['host']}:{config['port']}/{config['database']}" if config else 'not in DB_SHARDS'
+            managers, frozen = counts.get(shard, (0, 0))
+            print(f"shard {shard:<3} {location:<40} {managers} managers" + (f", {frozen} frozen" if frozen else ""))
+        return 0
+    except Error as e:
+        print(f"Could not read the directory: {str(e)}")
+        return 1
+    finally:
+        cursor.close()
+        main.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='managers per shard')
+    init_parser = commands.add_parser('init', help='raise the id counters of a new shard')
+    init_parser.add_argument('shard', type=int)
+    move_parser = commands.add_parser('move', help="move a manager's rows to another shard")
+    move_parser.add_argument('manager_id', type=int)
+    move_parser.add_argument('shard', type=int)
+    move_parser.add_argument('--batch-size', type=int, default=2000, help='rows copied or deleted per statement')
+    move_parser.add_argument('--drain-timeout', type=float, default=120, help='seconds to wait for emails being sent')
+    args = parser.parse_args()
+    if args.command == 'status':
+        sys.exit(status())
+    if args.command == 'init':
+        sys.exit(init_shard(args.shard))
+    sys.exit(move(args.manager_id, args.shard, args.batch_size, args.drain_timeout))
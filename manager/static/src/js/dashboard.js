@@ -0,0 +1,524 @@
+// Route URLs and the CSRF token are rendered into the page by the template
+const pageData = document.body.dataset;
+const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+
+// Theme toggle
+const themeToggleBtn = document.getElementById('themeToggle');
+themeToggleBtn.addEventListener('click', () => {
+    const html = document.documentElement;
+    const currentTheme = html.getAttribute('data-theme');
+    html.setAttribute('data-theme', currentTheme === 'light' ? 'dark' : 'light');
+    themeToggleBtn.textContent = `${currentTheme === 'light' ? '☀' : '☾'} Toggle Theme`;
+});
+
+// Show loading overlay
+function showLoading() {
+    document.getElementById('loadingOverlay').style.display = 'flex';
+}
+
+// Hide loading overlay
+function hideLoading() {
+    document.getElementById('loadingOverlay').style.display = 'none';
+}
+
+// Sidebar toggle for mobile
+const menuBtn = document.getElementById('menuBtn');
+const sidebar = document.getElementById('sidebar');
+
+menuBtn.addEventListener('click', () => {
+    sidebar.classList.toggle('-translate-x-full');
+    const isOpen = !sidebar.classList.contains('-translate-x-full');
+    document.body.classList.toggle('sidebar-open', isOpen);
+});
+
+// Show section and close sidebar on mobile
+function showSection(id) {
+    document.querySelectorAll('section').forEach(section => {
+        section.classList.add('hidden');
+    });
+    document.getElementById(id).classList.remove('hidden');
+    sidebar.classList.add('-translate-x-full');
+    document.body.classList.remove('sidebar-open');
+    if (id === 'payments') {
+        loadBills();
+    }
+}
+
+// Show details in popup
+function showDetailsPopup(id) {
+    const customer = customerCache.get(id);
+    const popup = document.getElementById('detailsPopup');
+    const content = document.getElementById('detailsContent');
+    const token = escapeHtml(csrfToken);
+    content.innerHTML = `
+        <p><strong>Id:</strong> ${customer.id}</p>
+        <p><strong>Box Number:</strong> ${escapeHtml(customer.box_number)}</p>
+        <p><strong>Name:</strong> ${escapeHtml(customer.name)}</p>
+        <p><strong>Mobile:</strong> ${escapeHtml(customer.mobile_number)}</p>
+        <p><strong>Email:</strong> ${escapeHtml(customer.email)}</p>
+        <p><strong>Plan Amount:</strong> ${escapeHtml(customer.plan_amount)}</p>
+        <p><strong>Address:</strong> ${escapeHtml(customer.address)}</p>
+        <div class="flex gap-2 mt-4">
+            <button onclick="closeDetailsPopup(); showEditModal(${id})" class="bg-teal-primary text-white px-3 py-1 rounded hover:bg-teal-dark">Edit</button>
+            <form method="POST" action="/delete_customer/${id}" onsubmit="closeDetailsPopup(); showLoading()">
+                <input type="hidden" name="csrf_token" value="${token}">
+                <button type="submit" class="bg-red-500 text-white px-3 py-1 rounded hover:bg-red-600">Delete</button>
+            </form>
+            <form action="/add_bill/${id}" method="POST" onsubmit="closeDetailsPopup(); showLoading()">
+                <input type="hidden" name="csrf_token" value="${token}">
+                <button type="submit" class="bg-teal-light text-white px-3 py-1 rounded hover:bg-teal-dark">Add Bill</button>
+            </form>
+            <button onclick="closeDetailsPopup(); showPaymentModal(${id}, ${customer.balance})" class="bg-blue-500 text-white px-3 py-1 rounded hover:bg-blue-600">Pay Offline</button>
+        </div>
+    `;
+    popup.style.display = 'block';
+}
+
+// Close details popup
+function closeDetailsPopup() {
+    document.getElementById('detailsPopup').style.display = 'none';
+}
+
+// Customers loaded so far, keyed by id
+const customerCache = new Map();
+let customerCursor = null;
+let customerRequest = null;
+
+const HTML_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'};
+
+function escapeHtml(value) {
+    return (value == null ? '' : String(value)).replace(/[&<>"']/g, char => HTML_ESCAPES[char]);
+}
+
+// GET a JSON endpoint; a new request with the same controller slot aborts the previous one
+function getJSON(url, params, controller) {
+    const query = new URLSearchParams(params).toString();
+    return fetch(query ? `${url}?${query}` : url, {
+        credentials: 'same-origin',
+        signal: controller ? controller.signal : undefined
+    }).then(response => response.json());
+}
+
+function renderCustomer(customer) {
+    document.getElementById('customer-table-body').insertAdjacentHTML('beforeend', `
+        <tr class="border-b hover:bg-teal-background" data-customer-id="${customer.id}">
+            <td class="p-4">${escapeHtml(customer.box_number)}</td>
+            <td class="p-4">${escapeHtml(customer.name)}</td>
+            <td class="p-4">${escapeHtml(customer.mobile_number)}</td>
+            <td class="p-4 customer-balance">${escapeHtml(customer.balance)}</td>
+            <td class="p-4 flex gap-2">
+                <button onclick="showDetailsPopup(${customer.id})" class="bg-teal-primary text-white px-3 py-1 rounded hover:bg-teal-dark">Show More</button>
+            </td>
+        </tr>
+    `);
+    document.getElementById('customer-cards').insertAdjacentHTML('beforeend', `
+        <div class="bg-white p-4 rounded-lg shadow-md" data-customer-id="${customer.id}">
+            <p><strong>Box No:</strong> ${escapeHtml(customer.box_number)}</p>
+            <p><strong>Name:</strong> ${escapeHtml(customer.name)}</p>
+            <p><strong>Mobile:</strong> ${escapeHtml(customer.mobile_number)}</p>
+            <p><strong>Balance:</strong> <span class="customer-balance">${escapeHtml(customer.balance)}</span></p>
+            <button onclick="showDetailsPopup(${customer.id})" class="text-teal-primary mt-2">Show More</button>
+        </div>
+    `);
+}
+
+// Fetch the next page of customers; reset starts again from the first page
+function loadCustomers(reset) {
+    if (customerRequest) {
+        customerRequest.abort();
+    }
+    if (reset) {
+        customerCursor = null;
+        customerCache.clear();
+        document.getElementById('customer-table-body').innerHTML = '';
+        document.getElementById('customer-cards').innerHTML = '';
+    }
+    const [sort, direction] = document.getElementById('customer_sort').value.split(':');
+    const params = {
+        search: document.getElementById('customer_search').value.trim(),
+        status: document.getElementById('filter').value,
+        sort: sort,
+        direction: direction || 'asc'
+    };
+    const balance = document.getElementById('balance_search').value;
+    if (balance !== '') {
+        params.balance = balance;
+        params.balance_op = document.getElementById('balance_operator').value;
+    }
+    if (customerCursor) {
+        params.cursor = customerCursor;
+    }
+    const controller = new AbortController();
+    customerRequest = controller;
+    getJSON(pageData.customersUrl, params, controller).then(response => {
+        customerRequest = null;
+        if (!response.success) {
+            showNotification(response.error, 'error');
+            return;
+        }
+        response.customers.forEach(customer => {
+            customerCache.set(customer.id, customer);
+            renderCustomer(customer);
+        });
+        customerCursor = response.next_cursor;
+        document.getElementById('loadMoreCustomers').classList.toggle('hidden', !customerCursor);
+        document.getElementById('customerInfo').textContent = customerCache.size > 0 ? `Showing ${customerCache.size} customers` : 'No customers found';
+    }).catch(() => {});
+}
+
+// Bill history paging state: cursors of the pages visited so far
+let billCursors = [null];
+let billNextCursor = null;
+let currentPage = 1;
+const itemsPerPage = 10;
+let sortDirection = 'desc';
+let billRequest = null;
+
+// Fetch the current page of bills with the filters applied on the server
+function loadBills() {
+    if (billRequest) {
+        billRequest.abort();
+    }
+    const params = billFilterParams();
+    params.limit = itemsPerPage;
+    const cursor = billCursors[currentPage - 1];
+    if (cursor) {
+        params.cursor = cursor;
+    }
+    const controller = new AbortController();
+    billRequest = controller;
+    getJSON(pageData.paymentsUrl, params, controller).then(response => {
+        billRequest = null;
+        if (!response.success) {
+            showNotification(response.error, 'error');
+            return;
+        }
+        billNextCursor = response.next_cursor;
+        renderBills(response.payments);
+    }).catch(() => {});
+}
+
+function billFilterParams() {
+    return {
+        mobile_number: document.getElementById('payment_mobile_number_search').value.trim(),
+        status: document.getElementById('status_filter').value,
+        start_date: document.getElementById('start_date_filter').value,
+        end_date: document.getElementById('end_date_filter').value,
+        direction: sortDirection
+    };
+}
+
+// Download the bill history matching the current filters
+function exportBills() {
+    window.location = pageData.exportPaymentsUrl + '?' + new URLSearchParams(billFilterParams()).toString();
+}
+
+function renderBills(payments) {
+    const rows = payments.map(payment => {
+        const status = escapeHtml(payment.payment_status.toLowerCase());
+        return `
+            <tr class="border-b hover:bg-teal-background">
+                <td class="p-4" data-label="Bill ID:">${payment.id}</td>
+                <td class="p-4" data-label="Customer ID:">${payment.customer_id}</td>
+                <td class="p-4" data-label="Amount:">₹${escapeHtml(payment.amount)}</td>
+                <td class="p-4" data-label="Payment Mode:">${escapeHtml(capitalize(payment.payment_mode))}</td>
+                <td class="p-4 status-${status}" data-label="Status:">${escapeHtml(capitalize(payment.payment_status))}</td>
+                <td class="p-4" data-label="Date:">${escapeHtml(payment.payment_date)}</td>
+            </tr>
+        `;
+    });
+    document.getElementById('bill-table-body').innerHTML = rows.length > 0
+        ? rows.join('')
+        : '<tr><td colspan="6" class="p-4 text-center">No bills found for the given criteria.</td></tr>';
+    document.getElementById('prevPage').classList.toggle('disabled', currentPage === 1);
+    document.getElementById('nextPage').classList.toggle('disabled', !billNextCursor);
+    document.getElementById('pageInfo').textContent = payments.length > 0 ? `Page ${currentPage}` : 'No bills';
+}
+
+function capitalize(value) {
+    value = value || '';
+    return value.charAt(0).toUpperCase() + value.slice(1).toLowerCase();
+}
+
+// Filter bills by mobile number, status, and date range
+function filterBills() {
+    billCursors = [null];
+    currentPage = 1;
+    loadBills();
+}
+
+// Change page
+function changePage(direction) {
+    if (direction === 'prev' && currentPage > 1) {
+        currentPage--;
+    } else if (direction === 'next' && billNextCursor) {
+        billCursors[currentPage] = billNextCursor;
+        currentPage++;
+    } else {
+        return;
+    }
+    loadBills();
+}
+
+// Sort table by date
+function sortTableByDate() {
+    sortDirection = sortDirection === 'desc' ? 'asc' : 'desc';
+    updateSortIcon();
+    filterBills();
+}
+
+// Update sort icon based on direction
+function updateSortIcon() {
+    const sortIcon = document.getElementById('sortIcon');
+    sortIcon.classList.toggle('sort-asc', sortDirection === 'asc');
+    sortIcon.classList.toggle('sort-desc', sortDirection === 'desc');
+}
+
+// Clear search input
+function clearSearch() {
+    document.getElementById('payment_mobile_number_search').value = '';
+    document.getElementById('start_date_filter').value = '';
+    document.getElementById('end_date_filter').value = '';
+    document.getElementById('status_filter').value = 'all';
+    filterBills();
+}
+
+// Validate mobile number input (allow only digits)
+let billSearchTimer = null;
+document.getElementById('payment_mobile_number_search').addEventListener('input', function() {
+    const input = this.value;
+    const numericInput = input.replace(/[^0-9]/g, '');
+    if (input !== numericInput) {
+        this.value = numericInput;
+        showNotification('Please enter only digits for the mobile number.', 'error');
+    }
+    clearTimeout(billSearchTimer);
+    billSearchTimer = setTimeout(filterBills, 300);
+});
+
+// Trigger filter on status and date change
+['status_filter', 'start_date_filter', 'end_date_filter'].forEach(id => {
+    document.getElementById(id).addEventListener('change', filterBills);
+});
+
+// POST a form body and parse the JSON reply; rejects with the server's error message
+function postForm(url, body) {
+    return fetch(url, {
+        method: 'POST',
+        body: body,
+        credentials: 'same-origin',
+        headers: {'X-CSRF-Token': csrfToken}
+    }).then(response => response.json().catch(() => ({})).then(data => {
+        if (!response.ok) {
+            throw new Error(data.error || '');
+        }
+        return data;
+    }));
+}
+
+// Milliseconds between progress checks of a queued import
+const IMPORT_POLL_MS = 2000;
+
+function showImportResult(job) {
+    const result = document.getElementById('importResult');
+    result.classList.remove('hidden');
+    result.innerHTML = '';
+    const summary = document.createElement('p');
+    summary.textContent = job.status === 'completed'
+        ? `Imported ${job.imported} customers, ${job.emails_queued} credential emails queued.`
+        : `Importing: ${job.imported} of ${job.total_rows} customers saved so far...`;
+    result.appendChild(summary);
+    const errors = document.createElement('ul');
+    errors.className = 'list-disc ml-6';
+    job.errors.forEach(error => {
+        const item = document.createElement('li');
+        item.textContent = error.row ? `Row ${error.row}: ${error.error}` : error.error;
+        errors.appendChild(item);
+    });
+    result.appendChild(errors);
+}
+
+// Follow a queued import until the worker has saved every row
+function watchImport(statusUrl) {
+    getJSON(statusUrl).then(job => {
+        if (!job.success) {
+            throw new Error(job.error || '');
+        }
+        showImportResult(job);
+        if (job.status !== 'completed') {
+            setTimeout(() => watchImport(statusUrl), IMPORT_POLL_MS);
+        } else if (job.imported > 0) {
+            loadCustomers(true);
+        }
+    }).catch(error => {
+        showNotification(error.message || 'Could not check the import progress.', 'error');
+    });
+}
+
+// Upload a customer file and show the per-row results as the import worker saves it
+document.getElementById('importCustomersForm').addEventListener('submit', function(event) {
+    event.preventDefault();
+    showLoading();
+    postForm(pageData.importUrl, new FormData(this)).then(response => {
+        hideLoading();
+        watchImport(response.status_url);
+    }).catch(error => {
+        hideLoading();
+        showNotification(error.message || 'Failed to import customers.', 'error');
+    });
+});
+
+// Show edit modal
+function showEditModal(customerId) {
+    const customer = customerCache.get(customerId);
+    const modal = document.getElementById('editModal');
+    const form = document.getElementById('editForm');
+    form.action = `/edit_customer/${customerId}`;
+    document.getElementById('editCustomerId').value = customerId;
+    document.getElementById('editBoxNumber').value = customer.box_number;
+    document.getElementById('editName').value = customer.name;
+    document.getElementById('editMobileNumber').value = customer.mobile_number;
+    document.getElementById('editEmail').value = customer.email || '';
+    document.getElementById('editPlanAmount').value = customer.plan_amount;
+    document.getElementById('editAddress').value = customer.address;
+    modal.classList.remove('hidden');
+}
+
+// Close edit modal
+function closeEditModal() {
+    document.getElementById('editModal').classList.add('hidden');
+}
+
+// Show payment modal
+function showPaymentModal(customerId, balance) {
+    const modal = document.getElementById('paymentModal');
+    const customerIdInput = document.getElementById('paymentCustomerId');
+    const amountInput = document.getElementById('paymentAmount');
+
+    customerIdInput.value = customerId;
+    amountInput.max = balance;
+    amountInput.value = ''; // Reset amount input
+    modal.classList.remove('hidden');
+}
+
+// Close payment modal
+function closePaymentModal() {
+    document.getElementById('paymentModal').classList.add('hidden');
+    document.getElementById('paymentAmount').value = '';
+}
+
+// Submit payment
+function submitPayment() {
+    const customerId = document.getElementById('paymentCustomerId').value;
+    const amount = document.getElementById('paymentAmount').value;
+
+    if (!amount || amount <= 0) {
+        showNotification('Please enter a valid amount.', 'error');
+        return;
+    }
+
+    showLoading();
+    postForm('/pay_offline/' + customerId, new URLSearchParams({customer_id: customerId, amount: amount})).then(response => {
+        hideLoading();
+        if (response.success) {
+            showNotification(response.message, 'success');
+            closePaymentModal();
+            updateCustomerTable(customerId, response.new_balance);
+        } else {
+            showNotification(response.error, 'error');
+        }
+    }).catch(error => {
+        hideLoading();
+        showNotification(error.message || 'Failed to submit payment.', 'error');
+    });
+}
+
+// Show the balance returned by the server for a customer
+function updateCustomerTable(customerId, newBalance) {
+    const customer = customerCache.get(parseInt(customerId));
+    if (customer) {
+        customer.balance = newBalance;
+    }
+    document.querySelectorAll(`[data-customer-id="${parseInt(customerId)}"] .customer-balance`).forEach(element => {
+        element.textContent = parseFloat(newBalance).toFixed(2);
+    });
+}
+
+// Filter and search customers on the server
+function filterTable() {
+    loadCustomers(true);
+}
+
+// Debounce typing so each keystroke does not trigger a request
+let customerSearchTimer = null;
+['customer_search', 'balance_search'].forEach(id => {
+    document.getElementById(id).addEventListener('input', () => {
+        clearTimeout(customerSearchTimer);
+        customerSearchTimer = setTimeout(filterTable, 300);
+    });
+});
+['balance_operator', 'filter', 'customer_sort'].forEach(id => {
+    document.getElementById(id).addEventListener('change', filterTable);
+});
+
+// Notification popup logic
+function showNotification(message, type) {
+    const popup = document.getElementById('notificationPopup');
+    const messageElement = document.getElementById('notificationMessage');
+
+    messageElement.textContent = message;
+    popup.className = '';
+    popup.classList.add(type === 'success' ? 'notification-success' : 'notification-error');
+    popup.style.display = 'block';
+
+    // Auto-hide after 5 seconds
+    setTimeout(() => {
+        closeNotification();
+    }, 5000);
+}
+
+function closeNotification() {
+    document.getElementById('notificationPopup').style.display = 'none';
+}
+
+// Poll the email queue while notifications are still being sent
+function pollEmailStatus() {
+    getJSON(pageData.emailStatusUrl, {}).then(response => {
+        if (!response.success) {
+            return;
+        }
+        const counts = response.counts;
+        const queued = counts.pending + counts.sending;
+        const statusElement = document.getElementById('emailStatus');
+        if (queued > 0) {
+            statusElement.textContent = `Sending emails: ${queued} queued`;
+            statusElement.classList.remove('hidden');
+            setTimeout(pollEmailStatus, 5000);
+        } else if (counts.failed > 0) {
+            statusElement.textContent = `${counts.failed} emails failed`;
+            statusElement.classList.remove('hidden');
+        } else {
+            statusElement.classList.add('hidden');
+        }
+    }).catch(() => {});
+}
+
+// A fresh key per page view so a resubmitted "bill all" form is not billed twice
+function newRunKey() {
+    const bytes = new Uint8Array(16);
+    crypto.getRandomValues(bytes);
+    return Array.from(bytes, byte => byte.toString(16).padStart(2, '0')).join('');
+}
+document.getElementById('billingRunKey').value = newRunKey();
+
+// Add loading for form submissions
+['addCustomerForm', 'editForm', 'addAllBillsForm'].forEach(id => {
+    document.getElementById(id).addEventListener('submit', showLoading);
+});
+
+// Display flash messages as popups and load the first page of customers
+JSON.parse(document.getElementById('flashMessages').textContent).forEach(([category, message]) => {
+    showNotification(message, category);
+});
+loadCustomers(true);
+pollEmailStatus();
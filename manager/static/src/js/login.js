@@ -0,0 +1,12 @@
+function showLoading() {
+    document.getElementById('loadingOverlay').style.display = 'flex';
+}
+
+function closePopup(popupId) {
+    document.getElementById(popupId).style.display = 'none';
+}
+
+// Show popups for flashed messages
+document.querySelectorAll('.popup').forEach(popup => {
+    popup.style.display = 'block';
+});
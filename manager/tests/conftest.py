@@ -0,0 +1,119 @@
+"""Integration tests for the db.py write paths, run against a real MySQL database.
+
+    TEST_DB_NAME=manager_test python -m pytest tests
+
+TEST_DB_NAME names a database the tests may migrate and write to; it is used
+with the usual DB_HOST, DB_USER, DB_PASSWORD and DB_PORT. The billing worker
+bills every open run it finds, so do not point it at a database in use. Each
+test creates a throwaway manager and removes its rows afterwards. Without
+TEST_DB_NAME, or without the MySQL driver, the tests using the `db` fixture
+are skipped; the unit tests of modules that need no database always run.
+"""
+import os
+import sys
+import uuid
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+TEST_DB_NAME = os.getenv('TEST_DB_NAME')
+
+if TEST_DB_NAME:
+    # Must be set before db.py reads its configuration: one database, no cache, cheap hashes
+    os.environ['DB_NAME'] = TEST_DB_NAME
+    for key in ('DB_SHARDS', 'DB_REPLICA_HOSTS'):
+        os.environ.pop(key, None)
+    os.environ['CACHE_BACKEND'] = 'none'
+    os.environ['PASSWORD_HASH_OFFLOAD'] = '0'
+    os.environ['BCRYPT_ROUNDS'] = '4'
+    os.environ.setdefault('DB_POOL_SIZE', '10')
+
+@pytest.fixture(scope='session')
+def db():
+    if not TEST_DB_NAME:
+        pytest.skip("set TEST_DB_NAME to run the database tests")
+    pytest.importorskip('mysql.connector')
+    pytest.importorskip('flask')
+    from mysql.connector import Error
+    import migrate
+    try:
+        if migrate.upgrade():
+            pytest.fail(f"Could not migrate {TEST_DB_NAME}")
+    except Error as e:
+        pytest.skip(f"Test database unavailable: {str(e)}")
+    import db
+    return db
+
+def query(db, sql, params=()):
+    """Run one statement on a connection of its own and return its rows as dicts."""
+    conn = db.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall() if cursor.with_rows else []
+        conn.commit()
+        return rows
+    finally:
+        cursor.close()
+        conn.close()
+
+def bill_everything(db, chunk_size=100):
+    """Run the billing worker until no open run has items left; returns the number billed."""
+    total = 0
+    while True:
+        billed = db.bill_next_chunk(chunk_size, 'Test bill')
+        assert billed is not None
+        if not billed:
+            return total
+        total += billed
+
+class Manager:
+    def __init__(self, db, manager_id, tag):
+        self.db = db
+        self.id = manager_id
+        self.tag = tag
+        self.count = 0
+
+    def add_customer(self, plan_amount, email=None):
+        """Add a customer through db.add_customer and return its id."""
+        self.count += 1
+        box_number = f"T{self.tag}-{self.count}"
+        success, message = self.db.add_customer(box_number, f"{self.count}{self.tag[:9]}", f"Test {self.count}", email,
+                                                'x', plan_amount, 'Test Street', self.id)
+        assert success, message
+        return query(self.db, "SELECT id FROM customers WHERE manager_id = %s AND box_number = %s",
+                     (self.id, box_number))[0]['id']
+
+    def balance(self, customer_id):
+        return query(self.db, "SELECT balance FROM customers WHERE id = %s", (customer_id,))[0]['balance']
+
+@pytest.fixture
+def manager(db):
+    tag = uuid.uuid4().hex[:10]
+    conn = db.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO managers (username, email, mobile_number, password)
+            VALUES (%s, %s, %s, %s)
+        """, (f"test-{tag}", f"test-{tag}@example.invalid", tag, 'x'))
+        manager_id = cursor.lastrowid
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    yield Manager(db, manager_id, tag)
+    query(db, "DELETE FROM email_outbox WHERE manager_id = %s", (manager_id,))
+    query(db, """
+        DELETE i FROM billing_run_items i
+        JOIN billing_runs r ON r.id = i.run_id
+        WHERE r.manager_id = %s
+    """, (manager_id,))
+    query(db, """
+        DELETE r FROM import_job_rows r
+        JOIN import_jobs j ON j.id = r.job_id
+        WHERE j.manager_id = %s
+    """, (manager_id,))
+    for table in ('import_jobs', 'billing_runs', 'balance_ledger', 'payments', 'manager_collections', 'manager_summary', 'customers'):
+        query(db, f"DELETE FROM {table} WHERE manager_id = %s", (manager_id,))
+    query(db, "DELETE FROM managers WHERE id = %s", (manager_id,))
@@ -0,0 +1,25 @@
+from assets import content_tokens, purge_css
+
+CSS = """
+.modal { display: none; }
+.modal.open, .unused-one { display: block; }
+.w-1\\.5 { width: 0.375rem; }
+.never-used { color: red; }
+.status-paid { color: green; }
+@media (min-width: 768px) { .md\\:flex { display: flex; } .never-used { color: blue; } }
+"""
+
+def test_script_selectors_count_as_used_classes():
+    tokens = content_tokens("document.querySelector('.modal.open'); el.classList.add('w-1.5')")
+    assert {'modal', 'open', 'w-1.5'} <= tokens
+    assert '.modal' not in tokens and '' not in tokens
+
+def test_purge_keeps_classes_only_scripts_mention():
+    used = content_tokens('<div class="md:flex"></div>') | content_tokens("$('.modal').addClass('open')")
+    css = purge_css(CSS, used)
+    assert '.modal{' in css.replace(' ', '')
+    assert '.modal.open' in css and 'unused-one' not in css
+    assert 'never-used' not in css and 'w-1' not in css
+    # Runtime-built status classes are never purged
+    assert '.status-paid' in css
+    assert '@media (min-width: 768px){.md\\:flex' in css
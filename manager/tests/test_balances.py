@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from conftest import query
+
+def ledger(db, customer_id):
+    return query(db, "SELECT amount, balance_after FROM balance_ledger WHERE customer_id = %s ORDER BY id", (customer_id,))
+
+def test_concurrent_payments_and_bills_lose_no_updates(db, manager):
+    customer_id = manager.add_customer(100)
+    assert db.update_customer_balance(customer_id, 1000, 'bill')[0]
+
+    def change(i):
+        # Payments and bills interleaved, so both write paths race on the same row
+        if i % 2:
+            return db.post_payment(customer_id, manager.id, 10, 'offline', 'completed', None)[0]
+        return db.update_customer_balance(customer_id, 5, 'bill')[0]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert all(executor.map(change, range(80)))
+
+    assert manager.balance(customer_id) == Decimal('1000') - 40 * 10 + 40 * 5
+    assert db.audit_customer_balances(manager.id) == []
+    # Entries are written under the customer's row lock, so in id order each balance_after is the running total
+    running = Decimal('0')
+    for entry in ledger(db, customer_id):
+        running += entry['amount']
+        assert entry['balance_after'] == running
+    assert running == manager.balance(customer_id)
+
+def test_concurrent_payments_never_overdraw(db, manager):
+    customer_id = manager.add_customer(100)
+    assert db.update_customer_balance(customer_id, 100, 'bill')[0]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(
+            lambda _: db.post_payment(customer_id, manager.id, 30, 'offline', 'completed', None), range(10)
+        ))
+
+    assert sum(1 for success, _, _ in results if success) == 3
+    assert {message for success, message, _ in results if not success} == {'Balance cannot be negative'}
+    assert manager.balance(customer_id) == Decimal('10.00')
+    assert db.audit_customer_balances(manager.id) == []
+    # Rejected payments are rolled back along with their payment row
+    assert len(query(db, "SELECT id FROM payments WHERE customer_id = %s", (customer_id,))) == 3
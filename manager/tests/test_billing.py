@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from conftest import bill_everything, query
+
+PLANS = (199, 299, 499, 0, 1250, 2600, 75)
+
+def bill_entries(db, manager_id):
+    return query(db, """
+        SELECT customer_id, amount FROM balance_ledger
+        WHERE manager_id = %s AND entry_type = 'bill' ORDER BY customer_id
+    """, (manager_id,))
+
+def run_row(db, manager_id):
+    return query(db, "SELECT status, customer_count, total_amount FROM billing_runs WHERE manager_id = %s",
+                 (manager_id,))[0]
+
+def test_rerunning_the_worker_bills_each_customer_once(db, manager):
+    customers = {manager.add_customer(plan, email=f"c{plan}-{manager.tag}@example.invalid"): plan for plan in PLANS}
+    assert db.create_billing_run(manager.id, 'test-run')[0]
+
+    # Small chunks, so the run is billed over several transactions
+    assert bill_everything(db, chunk_size=2) >= len(PLANS)
+    assert bill_everything(db, chunk_size=2) == 0
+    assert db.bill_next_chunk(2, 'Test bill') == 0
+
+    for customer_id, plan in customers.items():
+        assert manager.balance(customer_id) == Decimal(plan)
+    assert [row['customer_id'] for row in bill_entries(db, manager.id)] == sorted(customers)
+    assert run_row(db, manager.id) == {
+        'status': 'completed', 'customer_count': len(PLANS), 'total_amount': Decimal(sum(PLANS)),
+    }
+    notifications = query(db, """
+        SELECT COUNT(*) AS count FROM email_outbox WHERE manager_id = %s AND template_type = 'bill_notification'
+    """, (manager.id,))[0]['count']
+    assert notifications == len(PLANS)
+    assert db.audit_customer_balances(manager.id) == []
+
+def test_requeuing_a_billed_run_bills_nobody(db, manager):
+    customers = [manager.add_customer(plan) for plan in PLANS]
+    assert db.create_billing_run(manager.id, 'test-run')[0]
+    bill_everything(db)
+    balances = [manager.balance(customer_id) for customer_id in customers]
+
+    success, message, count = db.create_billing_run(manager.id, 'test-run')
+    bill_everything(db)
+
+    assert success and message == 'Billing run already processed' and count == len(PLANS)
+    assert [manager.balance(customer_id) for customer_id in customers] == balances
+    assert len(bill_entries(db, manager.id)) == len(PLANS)
+
+def test_concurrent_workers_share_a_run_without_double_billing(db, manager):
+    customers = {manager.add_customer(plan): plan for plan in PLANS * 6}
+    assert db.create_billing_run(manager.id, 'test-run')[0]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: bill_everything(db, chunk_size=3), range(4)))
+    bill_everything(db)
+
+    for customer_id, plan in customers.items():
+        assert manager.balance(customer_id) == Decimal(plan)
+    assert [row['customer_id'] for row in bill_entries(db, manager.id)] == sorted(customers)
+    assert run_row(db, manager.id)['status'] == 'completed'
+    assert db.audit_customer_balances(manager.id) == []
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import pytest
+import cache
+from cache import LRUBackend, ManagerCache, SharedBackend, MISS
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    return clock
+
+class DictClient:
+    """The part of the Redis client SharedBackend uses, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(threading.get_ident())
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.threads.add(threading.get_ident())
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+
+def counting(manager_cache, name='rows', **options):
+    """A cached function returning its call count, so cache hits are visible."""
+    calls = []
+
+    @manager_cache.cached(name, **options)
+    def rows(manager_id, page=1):
+        calls.append((manager_id, page))
+        return len(calls)
+    return rows, calls
+
+def test_lru_evicts_the_least_recently_used_entry():
+    backend = LRUBackend(max_entries=2, ttl=60)
+    backend.set('a', 1)
+    backend.set('b', 2)
+    assert backend.get('a') == 1
+    backend.set('c', 3)
+    assert backend.get('b') is MISS
+    assert (backend.get('a'), backend.get('c')) == (1, 3)
+    assert backend.evictions == 1
+
+def test_lru_entries_expire_after_ttl(clock):
+    backend = LRUBackend(max_entries=10, ttl=30)
+    backend.set('a', 1)
+    clock.now += 29
+    assert backend.get('a') == 1
+    clock.now += 2
+    assert backend.get('a') is MISS
+
+def test_versions_survive_eviction():
+    backend = LRUBackend(max_entries=1, ttl=60)
+    backend.bump_version('manager:1')
+    backend.set('a', 1)
+    backend.set('b', 2)
+    assert backend.get_version('manager:1') == 1
+    assert backend.get_version('manager:2') == 0
+
+@pytest.mark.parametrize('backend', [LRUBackend(ttl=60), SharedBackend(DictClient())], ids=['local', 'shared'])
+def test_invalidate_bumps_only_that_managers_entries(backend):
+    manager_cache = ManagerCache(backend)
+    rows, calls = counting(manager_cache)
+    assert rows(1) == rows(1) == 1
+    assert rows(2) == 2
+    assert rows(1, page=2) == 3
+
+    manager_cache.invalidate(1)
+
+    assert rows(1) == 4
+    assert rows(2) == 2
+    assert calls == [(1, 1), (2, 1), (1, 2), (1, 1)]
+    assert manager_cache.stats()['invalidations'] == 1
+
+def test_cache_if_keeps_rejected_results_out():
+    manager_cache = ManagerCache(LRUBackend(ttl=60))
+    rows, calls = counting(manager_cache, cache_if=lambda result: result % 2 == 0)
+    rows(1)
+    rows(1)
+    rows(1)
+    # The first (odd) result was not stored, the second was
+    assert len(calls) == 2
+    assert manager_cache.stats()['hits'] == 1
+
+def test_fill_when_serves_entries_without_storing():
+    manager_cache = ManagerCache(LRUBackend(ttl=60))
+    fill = [False]
+    rows, calls = counting(manager_cache, fill_when=lambda: fill[0])
+    rows(1)
+    rows(1)
+    assert len(calls) == 2
+    fill[0] = True
+    assert rows(1) == 3
+    fill[0] = False
+    assert rows(1) == 3
+    assert len(calls) == 3
+
+def test_calls_without_a_manager_bypass_the_cache():
+    manager_cache = ManagerCache(LRUBackend(ttl=60))
+    rows, calls = counting(manager_cache)
+    rows(None)
+    rows(None)
+    assert len(calls) == 2
+    assert manager_cache.stats()['misses'] == 0
+
+def test_backend_errors_fall_through_to_the_function():
+    class Broken(LRUBackend):
+        def get(self, key):
+            raise ConnectionError("cache down")
+
+    manager_cache = ManagerCache(Broken(ttl=60))
+    rows, calls = counting(manager_cache)
+    assert rows(1) == 1
+    assert rows(1) == 2
+    assert manager_cache.stats()['errors'] == 2
+
+def test_async_functions_share_entries_with_sync_ones():
+    manager_cache = ManagerCache(LRUBackend(ttl=60))
+    rows, calls = counting(manager_cache)
+
+    @manager_cache.cached('rows')
+    async def rows_async(manager_id, page=1):
+        return 'async'
+
+    assert rows(1) == 1
+    assert asyncio.run(rows_async(1)) == 1
+    assert asyncio.run(rows_async(2)) == 'async'
+    assert rows(2) == 'async'
+
+def test_async_functions_reach_a_shared_backend_off_the_event_loop():
+    client = DictClient()
+    manager_cache = ManagerCache(SharedBackend(client))
+
+    @manager_cache.cached('rows')
+    async def rows(manager_id):
+        return threading.get_ident()
+
+    async def twice():
+        return await rows(1), await rows(1)
+
+    loop_thread, cached = asyncio.run(twice())
+    assert cached == loop_thread
+    assert client.threads and loop_thread not in client.threads
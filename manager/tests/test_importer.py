@@ -0,0 +1,88 @@
+import io
+from decimal import Decimal
+import pytest
+from conftest import query
+
+def upload(text, filename='customers.csv'):
+    from werkzeug.datastructures import FileStorage
+    return FileStorage(stream=io.BytesIO(text.encode('utf-8')), filename=filename)
+
+def row(**values):
+    base = {'box_number': 'B1', 'mobile_number': '9000000001', 'name': 'One', 'email': '',
+            'plan_amount': '199', 'address': 'Street'}
+    return dict(base, **values)
+
+@pytest.fixture
+def validate_row():
+    return pytest.importorskip('importer').validate_row
+
+def test_valid_row_is_cleaned_up(validate_row):
+    customer, error = validate_row(row(box_number=' B1 ', plan_amount='99.999', email=' one@example.com '),
+                                   7, set(), set())
+    assert error is None
+    assert customer == {'box_number': 'B1', 'mobile_number': '9000000001', 'name': 'One',
+                        'email': 'one@example.com', 'plan_amount': Decimal('100.00'), 'address': 'Street', 'row': 7}
+    customer, _ = validate_row(row(), 2, set(), set())
+    assert customer['email'] is None
+
+@pytest.mark.parametrize('values, error', [
+    ({'name': '  ', 'address': None}, "Missing name, address"),
+    ({'plan_amount': 'abc'}, "Invalid plan amount abc"),
+    ({'plan_amount': 'NaN'}, "Invalid plan amount NaN"),
+    ({'plan_amount': '-0.01'}, "Plan amount cannot be negative"),
+    ({'email': 'not-an-email'}, "Invalid email not-an-email"),
+])
+def test_invalid_rows_are_reported(validate_row, values, error):
+    assert validate_row(row(**values), 2, set(), set()) == (None, error)
+
+def test_repeats_within_the_file_are_rejected(validate_row):
+    seen_boxes, seen_mobiles = set(), set()
+    assert validate_row(row(), 2, seen_boxes, seen_mobiles)[1] is None
+    assert validate_row(row(mobile_number='9000000002'), 3, seen_boxes, seen_mobiles) == (
+        None, "Box number B1 repeated in file")
+    assert validate_row(row(box_number='B2'), 4, seen_boxes, seen_mobiles) == (
+        None, "Mobile number 9000000001 repeated in file")
+    # Rejected rows do not claim their box or mobile number
+    assert validate_row(row(box_number='B3', mobile_number='9000000003', plan_amount='x'), 5,
+                        seen_boxes, seen_mobiles)[0] is None
+    assert validate_row(row(box_number='B3', mobile_number='9000000003'), 6, seen_boxes, seen_mobiles)[1] is None
+
+def test_import_job_is_saved_by_the_worker(db, manager):
+    import importer
+    tag = manager.tag
+    csv_text = (
+        "box_number,mobile_number,name,email,plan_amount,address\n"
+        f"I{tag}-1,1{tag[:9]},One,one-{tag}@example.invalid,199,Street\n"
+        f"I{tag}-2,2{tag[:9]},Two,,299.5,Street\n"
+        f"I{tag}-3,3{tag[:9]},Three,,-1,Street\n"
+        f"I{tag}-1,4{tag[:9]},Repeat,,100,Street\n"
+        f"I{tag}-5,5{tag[:9]},Five,,50,Street\n"
+    )
+    success, message, job_id = importer.import_customers(manager.id, upload(csv_text))
+    assert success, message
+    job = db.get_import_job(job_id, manager.id)
+    assert job['status'] == 'pending' and job['total_rows'] == 3 and job['imported'] == 0
+    assert [error['row'] for error in job['errors']] == [4, 5]
+
+    # Batches of two, so the job is saved over several claims
+    assert importer.ImportWorker(batch_size=2).drain() >= 3
+
+    job = db.get_import_job(job_id, manager.id)
+    assert job['status'] == 'completed'
+    assert (job['imported'], job['emails_queued']) == (3, 1)
+    assert [error['row'] for error in job['errors']] == [4, 5]
+    customers = query(db, "SELECT box_number, plan_amount FROM customers WHERE manager_id = %s ORDER BY box_number",
+                      (manager.id,))
+    assert [(c['box_number'], c['plan_amount']) for c in customers] == [
+        (f"I{tag}-1", Decimal('199.00')), (f"I{tag}-2", Decimal('299.50')), (f"I{tag}-5", Decimal('50.00')),
+    ]
+    assert query(db, "SELECT COUNT(*) AS count FROM import_job_rows WHERE job_id = %s", (job_id,))[0]['count'] == 0
+
+def test_import_without_valid_rows_completes_at_once(db, manager):
+    import importer
+    success, _, job_id = importer.import_customers(manager.id, upload("box_number,name\nB1,No Mobile\n"))
+    assert success
+    job = db.get_import_job(job_id, manager.id)
+    assert job['status'] == 'completed' and job['total_rows'] == 0
+    assert job['errors'] == [{'row': 2, 'error': 'Missing mobile_number, plan_amount, address'}]
+    assert db.get_import_job(job_id, manager.id + 1) is None
@@ -0,0 +1,189 @@
+import email as email_parser
+import socketserver
+import threading
+import pytest
+
+mailer = pytest.importorskip('mailer')
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """SMTP server on a free local port recording each accepted message's recipients.
+
+    Recipients starting with "reject" are refused with a 550.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.recipients = []
+        self.lock = threading.Lock()
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.reply('220 test sink')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command.upper()
+            if verb.startswith(('EHLO', 'HELO')):
+                self.reply('250 test')
+            elif verb.startswith('RCPT TO:'):
+                address = command[8:].strip().strip('<>')
+                if address.startswith('reject'):
+                    self.reply('550 no such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 end with <CRLF>.<CRLF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                with self.server.lock:
+                    self.server.recipients.extend(recipients)
+                recipients = []
+                self.reply('250 queued')
+            elif verb == 'RSET':
+                recipients = []
+                self.reply('250 ok')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+class Outbox:
+    """Stands in for the db.py outbox functions the dispatcher calls."""
+
+    def __init__(self, emails):
+        self.emails = emails
+        self.sent = []
+        self.failed = []
+
+    def claim(self, limit):
+        claimed, self.emails = self.emails[:limit], self.emails[limit:]
+        return claimed
+
+    def mark_sent(self, email_ids):
+        self.sent.extend(email_ids)
+        return True, "Emails marked as sent"
+
+    def mark_failed(self, email_id, error, retry_in_seconds=None):
+        self.failed.append((email_id, retry_in_seconds is not None))
+        return True, "Email failure recorded"
+
+def email(email_id, to_email, template_type='credential'):
+    return {'id': email_id, 'to_email': to_email, 'subject': 'Test', 'template_type': template_type,
+            'payload': {'mobile_number': '9000000000', 'password': 'secret'}, 'attempts': 1}
+
+@pytest.fixture
+def sink(monkeypatch):
+    server = SMTPSink()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(mailer, 'SMTP_HOST', '127.0.0.1')
+    monkeypatch.setattr(mailer, 'SMTP_PORT', server.server_address[1])
+    monkeypatch.setattr(mailer, 'SMTP_STARTTLS', False)
+    monkeypatch.setattr(mailer, 'EMAIL_PASSWORD', None)
+    monkeypatch.setattr(mailer, 'EMAIL_ADDRESS', 'sender@example.invalid')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def use_outbox(monkeypatch, emails):
+    outbox = Outbox(emails)
+    monkeypatch.setattr(mailer, 'claim_pending_emails', outbox.claim)
+    monkeypatch.setattr(mailer, 'mark_emails_sent', outbox.mark_sent)
+    monkeypatch.setattr(mailer, 'mark_email_failed', outbox.mark_failed)
+    return outbox
+
+def test_dispatcher_sends_a_batch_over_one_session(sink, monkeypatch):
+    outbox = use_outbox(monkeypatch, [
+        email(1, 'one@example.invalid'),
+        email(2, 'reject@example.invalid'),
+        email(3, 'three@example.invalid', template_type='unknown'),
+        email(4, 'four@example.invalid'),
+    ])
+    session = mailer.SMTPSession()
+    try:
+        assert mailer.EmailDispatcher(rate_per_second=0).process_batch(session) == 4
+    finally:
+        session.close()
+
+    assert sink.recipients == ['one@example.invalid', 'four@example.invalid']
+    assert outbox.sent == [1, 4]
+    # The refused recipient is retried later, the unknown template is given up on
+    assert outbox.failed == [(2, True), (3, False)]
+
+def test_emails_sent_before_a_crash_are_not_released(sink, monkeypatch):
+    outbox = use_outbox(monkeypatch, [email(1, 'one@example.invalid'), email(2, 'two@example.invalid'),
+                                      email(3, 'three@example.invalid')])
+    sends = []
+
+    def send(to_email, message_bytes):
+        if len(sends) == 1:
+            raise RuntimeError("worker crashed")
+        sends.append(to_email)
+        original_send(to_email, message_bytes)
+
+    session = mailer.SMTPSession()
+    original_send = session.send
+    session.send = send
+    try:
+        with pytest.raises(RuntimeError):
+            mailer.EmailDispatcher(rate_per_second=0).process_batch(session)
+    finally:
+        session.close()
+
+    assert sink.recipients == ['one@example.invalid']
+    # The first email was marked as it went out; only the two it never reached are put back
+    assert outbox.sent == [1]
+    assert outbox.failed == [(2, True), (3, True)]
+
+def parts(message_bytes):
+    message = email_parser.message_from_bytes(message_bytes)
+    return message, {part.get_content_type(): part.get_payload(decode=True).decode('utf-8')
+                     for part in message.get_payload()}
+
+def test_credential_email_renders_both_parts(monkeypatch):
+    monkeypatch.setattr(mailer, 'EMAIL_ADDRESS', 'sender@example.invalid')
+    [(rendered, message_bytes)] = mailer.render_messages([email(1, 'one@example.invalid')])
+    message, bodies = parts(message_bytes)
+
+    assert (message['From'], message['To'], message['Subject']) == ('sender@example.invalid', 'one@example.invalid', 'Test')
+    assert message.get_content_type() == 'multipart/alternative'
+    # Plain text first, so clients that prefer HTML pick the last part
+    assert list(bodies) == ['text/plain', 'text/html']
+    for body in bodies.values():
+        assert '9000000000' in body and 'secret' in body
+    assert 'render_error' not in rendered
+
+def test_payload_is_escaped_in_the_html_part_only():
+    queued = email(1, 'one@example.invalid', template_type='bill_notification')
+    queued['payload'] = {'name': '<b>Ann & Co</b>', 'amount': 1234.5}
+    [(_, message_bytes)] = mailer.render_messages([queued])
+    _, bodies = parts(message_bytes)
+    assert 'Dear <b>Ann & Co</b>,' in bodies['text/plain'] and '1234.50' in bodies['text/plain']
+    assert '&lt;b&gt;Ann &amp; Co&lt;/b&gt;' in bodies['text/html'] and '<b>Ann' not in bodies['text/html']
+
+def test_emails_that_cannot_render_do_not_stop_the_batch():
+    unknown = email(1, 'one@example.invalid', template_type='unknown')
+    broken = email(2, 'two@example.invalid', template_type='bill_notification')
+    broken['payload'] = {'name': 'Two', 'amount': 'not a number'}
+    rendered = list(mailer.render_messages([unknown, broken, email(3, 'three@example.invalid')]))
+
+    assert [message_bytes is None for _, message_bytes in rendered] == [True, True, False]
+    assert unknown['render_error'] == "Invalid template type"
+    assert broken['render_error'].startswith("Could not render email: ")
+
+def test_render_email_returns_html_and_text():
+    html_body, text_body = mailer.render_email('credential', mobile_number='9000000000', password='p')
+    assert html_body.lstrip().startswith('<!DOCTYPE html>')
+    assert text_body.startswith('Welcome to Time2Due')
+    assert mailer.render_email('unknown') is None
@@ -0,0 +1,64 @@
+from metrics import Histogram, Registry
+
+def test_counters_and_histograms_render_under_one_header_each():
+    registry = Registry()
+    registry.describe('rows_total', 'Rows fetched.')
+    registry.inc('rows_total', (('statement', 'b'),), 2)
+    registry.inc('rows_total', (('statement', 'a'),))
+    registry.inc('rows_total', (('statement', 'a'),), 4)
+    registry.observe('duration_seconds', 0.003)
+    registry.observe('duration_seconds', 0.02)
+    registry.observe('duration_seconds', 60)
+
+    lines = registry.render().splitlines()
+    assert lines[:4] == [
+        '# HELP rows_total Rows fetched.',
+        '# TYPE rows_total counter',
+        'rows_total{statement="a"} 5',
+        'rows_total{statement="b"} 2',
+    ]
+    assert lines[4] == '# TYPE duration_seconds histogram'
+    buckets = [line for line in lines if line.startswith('duration_seconds_bucket')]
+    assert buckets[0] == 'duration_seconds_bucket{le="0.001"} 0'
+    assert 'duration_seconds_bucket{le="0.005"} 1' in buckets
+    assert 'duration_seconds_bucket{le="0.025"} 2' in buckets
+    assert buckets[-2:] == ['duration_seconds_bucket{le="10.0"} 2', 'duration_seconds_bucket{le="+Inf"} 3']
+    assert lines[-2:] == ['duration_seconds_sum 60.023', 'duration_seconds_count 3']
+
+def test_samples_are_grouped_after_their_type_line():
+    registry = Registry()
+    registry.describe('pool_size', 'Open connections.')
+    registry.inc('reads_total')
+    lines = registry.render([
+        ('gauge', 'pool_size', (('pool', 'main'),), 5),
+        ('counter', 'pool_timeouts_total', (('pool', 'main'),), 0),
+        ('gauge', 'pool_size', (('pool', 'replica'),), 2),
+        ('histogram', 'wait_seconds', (), (((0.1, 1), (float('inf'), 3)), 0.5, 3)),
+    ]).splitlines()
+    assert lines == [
+        '# TYPE reads_total counter',
+        'reads_total 1',
+        '# HELP pool_size Open connections.',
+        '# TYPE pool_size gauge',
+        'pool_size{pool="main"} 5',
+        'pool_size{pool="replica"} 2',
+        '# TYPE pool_timeouts_total counter',
+        'pool_timeouts_total{pool="main"} 0',
+        '# TYPE wait_seconds histogram',
+        'wait_seconds_bucket{le="0.1"} 1',
+        'wait_seconds_bucket{le="+Inf"} 3',
+        'wait_seconds_sum 0.5',
+        'wait_seconds_count 3',
+    ]
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.inc('errors_total', (('message', 'said "no"\\\n'),))
+    assert registry.render() == '# TYPE errors_total counter\nerrors_total{message="said \\"no\\"\\\\\\n"} 1\n'
+
+def test_histogram_counts_values_on_a_bound_in_that_bucket():
+    histogram = Histogram(buckets=(1, 2))
+    for value in (1, 1.5, 2, 3):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1]
+    assert (histogram.total, histogram.count) == (7.5, 4)
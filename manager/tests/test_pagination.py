@@ -0,0 +1,41 @@
+import base64
+from datetime import date
+import pytest
+
+db = pytest.importorskip('db')
+
+def test_cursor_round_trips_its_values():
+    cursor = db.encode_cursor(['B-100', 42])
+    assert db.decode_cursor(cursor) == ['B-100', 42]
+    # Cursors travel in query strings, so they must not need escaping
+    assert not set(db.encode_cursor(['a' * 40, 10 ** 12, 'ü?&'])) & set('+/&?')
+
+def test_payment_cursor_keeps_dates_as_strings():
+    cursor = db.encode_cursor(db._payment_cursor({'payment_date': date(2024, 3, 31), 'id': 7}))
+    assert db.decode_cursor(cursor) == ['2024-03-31', 7]
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor!',
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+    base64.urlsafe_b64encode(b'{not json').decode(),
+    base64.urlsafe_b64encode(b'5').decode(),
+    base64.urlsafe_b64encode(b'{"id": 5}').decode(),
+], ids=['not-base64', 'not-utf8', 'not-json', 'number', 'object'])
+def test_tampered_cursors_decode_to_none(cursor):
+    assert db.decode_cursor(cursor) is None
+
+def test_tampered_cursor_starts_from_the_first_page():
+    query, params, _ = db._customers_page_query(1, 'box_number', 'asc', None, None, None, None,
+                                                base64.urlsafe_b64encode(b'5').decode(), 50)
+    assert params == [1, 51]
+    query, params, _ = db._customers_page_query(1, 'name', 'desc', None, None, None, None,
+                                                db.encode_cursor(['Zed', 9]), 50)
+    assert "(name < %s OR (name = %s AND id < %s))" in query
+    assert params == [1, 'Zed', 'Zed', 9, 51]
+
+def test_next_page_cursor_points_past_the_last_row():
+    rows = [{'id': i, 'box_number': f"B{i}"} for i in range(1, 5)]
+    page, cursor = db._next_page(rows, 3, lambda last: [last['box_number'], last['id']])
+    assert [row['id'] for row in page] == [1, 2, 3]
+    assert db.decode_cursor(cursor) == ['B3', 3]
+    assert db._next_page(rows[:3], 3, lambda last: [last['id']]) == (rows[:3], None)
@@ -0,0 +1,60 @@
+from decimal import Decimal
+from conftest import bill_everything, query
+
+def summary(db, manager_id):
+    row = db.get_manager_summary(manager_id)
+    return {key: row[key] for key in ('customer_count', 'total_outstanding') + db.SUMMARY_BUCKETS}
+
+def rebuilt(db, manager_id):
+    """The summary recomputed from the customers table, as rebuild_manager_summary would."""
+    assert db.rebuild_manager_summary(manager_id)[0]
+    return summary(db, manager_id)
+
+def test_buckets_follow_bill_pay_and_delete(db, manager):
+    # Plan amounts land one customer in each bucket once billed
+    manager.add_customer(0)
+    manager.add_customer(300)
+    medium = manager.add_customer(1500)
+    high = manager.add_customer(2500)
+    assert summary(db, manager.id) == {
+        'customer_count': 4, 'total_outstanding': Decimal('0.00'),
+        'bucket_paid': 4, 'bucket_low': 0, 'bucket_medium': 0, 'bucket_high': 0,
+    }
+
+    assert db.create_billing_run(manager.id, 'test-run')[0]
+    bill_everything(db)
+    expected = {
+        'customer_count': 4, 'total_outstanding': Decimal('4300.00'),
+        'bucket_paid': 1, 'bucket_low': 1, 'bucket_medium': 1, 'bucket_high': 1,
+    }
+    assert summary(db, manager.id) == expected
+
+    # Paying most of the medium balance moves the customer down to low
+    assert db.post_payment(medium, manager.id, 1200, 'offline', 'completed', None)[0]
+    expected.update(total_outstanding=Decimal('3100.00'), bucket_low=2, bucket_medium=0)
+    assert summary(db, manager.id) == expected
+
+    # Paying the rest moves them to paid
+    assert db.post_payment(medium, manager.id, 300, 'offline', 'completed', None)[0]
+    expected.update(total_outstanding=Decimal('2800.00'), bucket_paid=2, bucket_low=1)
+    assert summary(db, manager.id) == expected
+
+    assert db.delete_customer(high, manager.id)[0]
+    expected.update(customer_count=3, total_outstanding=Decimal('300.00'), bucket_high=0)
+    assert summary(db, manager.id) == expected
+
+    assert rebuilt(db, manager.id) == expected
+
+def test_rebilling_does_not_change_summary(db, manager):
+    for plan_amount in (100, 600, 2100):
+        manager.add_customer(plan_amount)
+    assert db.create_billing_run(manager.id, 'test-run')[0]
+    bill_everything(db)
+    before = summary(db, manager.id)
+
+    success, message, _ = db.create_billing_run(manager.id, 'test-run')
+    bill_everything(db)
+
+    assert success and message == 'Billing run already processed'
+    assert summary(db, manager.id) == before == rebuilt(db, manager.id)
+    assert query(db, "SELECT COUNT(*) AS count FROM billing_runs WHERE manager_id = %s", (manager.id,))[0]['count'] == 1
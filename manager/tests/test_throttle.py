@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import pytest
+import throttle
+from throttle import LoginThrottle, MemoryStore
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(throttle.time, 'monotonic', clock)
+    return clock
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(throttle, 'LOGIN_IP_LIMIT', 4)
+    monkeypatch.setattr(throttle, 'LOGIN_IP_WINDOW', 100)
+    monkeypatch.setattr(throttle, 'LOGIN_EMAIL_LIMIT', 2)
+    monkeypatch.setattr(throttle, 'LOGIN_EMAIL_WINDOW', 60)
+    monkeypatch.setattr(throttle, 'UNKNOWN_EMAIL_TTL', 30)
+
+def test_window_slides_as_events_age_out(clock):
+    store = MemoryStore()
+    store.add('k', 10)
+    clock.now += 4
+    store.add('k', 10)
+    assert store.count('k', 10) == (2, 6)
+    clock.now += 6
+    assert store.count('k', 10) == (1, 4)
+    clock.now += 4
+    assert store.count('k', 10) == (0, 0)
+
+def test_store_drops_the_least_recently_used_keys(clock):
+    store = MemoryStore(max_keys=2)
+    store.add('a', 10)
+    store.add('b', 10)
+    store.add('a', 10)
+    store.add('c', 10)
+    assert store.count('b', 10) == (0, 0)
+    assert store.count('a', 10)[0] == 2
+    assert store.count('c', 10)[0] == 1
+
+def test_email_is_locked_out_until_its_oldest_failure_expires(clock, limits):
+    login_throttle = LoginThrottle(MemoryStore())
+    login_throttle.record_failure('10.0.0.1', 'Manager@Example.com')
+    clock.now += 10
+    assert login_throttle.retry_after('10.0.0.1', 'manager@example.com') == 0
+    login_throttle.record_failure('10.0.0.1', 'manager@example.com')
+
+    assert login_throttle.retry_after('10.0.0.2', 'MANAGER@example.com') == 50
+    assert login_throttle.retry_after('10.0.0.1', 'other@example.com') == 0
+    clock.now += 50
+    assert login_throttle.retry_after('10.0.0.1', 'manager@example.com') == 0
+
+def test_ip_is_locked_out_across_emails(clock, limits):
+    login_throttle = LoginThrottle(MemoryStore())
+    for i in range(4):
+        login_throttle.record_failure('10.0.0.1', f"user{i}@example.com")
+    assert login_throttle.retry_after('10.0.0.1', 'new@example.com') == 100
+    assert login_throttle.retry_after('10.0.0.2', 'new@example.com') == 0
+
+def test_successful_login_resets_the_email_but_not_the_ip(clock, limits):
+    login_throttle = LoginThrottle(MemoryStore())
+    for _ in range(4):
+        login_throttle.record_failure('10.0.0.1', 'manager@example.com')
+    login_throttle.reset('Manager@example.com')
+    assert login_throttle.retry_after('10.0.0.2', 'manager@example.com') == 0
+    assert login_throttle.retry_after('10.0.0.1', 'manager@example.com') == 100
+
+def test_unknown_emails_are_remembered_for_their_ttl(clock, limits):
+    login_throttle = LoginThrottle(MemoryStore())
+    assert not login_throttle.is_unknown_email('nobody@example.com')
+    login_throttle.remember_unknown_email('Nobody@example.com')
+    assert login_throttle.is_unknown_email('nobody@example.com')
+    clock.now += 30
+    assert not login_throttle.is_unknown_email('nobody@example.com')
+
+    login_throttle.remember_unknown_email('nobody@example.com')
+    login_throttle.forget_unknown_email('nobody@example.com')
+    assert not login_throttle.is_unknown_email('nobody@example.com')
+
+def test_store_errors_never_lock_anyone_out(limits):
+    class Broken(MemoryStore):
+        def add(self, key, window):
+            raise ConnectionError("store down")
+
+        def count(self, key, window):
+            raise ConnectionError("store down")
+
+    login_throttle = LoginThrottle(Broken())
+    login_throttle.record_failure('10.0.0.1', 'manager@example.com')
+    assert login_throttle.retry_after('10.0.0.1', 'manager@example.com') == 0
+    assert not login_throttle.is_unknown_email('manager@example.com')
+
+def test_coroutines_reach_a_blocking_store_off_the_event_loop(limits):
+    class Blocking(MemoryStore):
+        blocking = True
+
+        def add(self, key, window):
+            threads.add(threading.get_ident())
+            super().add(key, window)
+
+    threads = set()
+    login_throttle = LoginThrottle(Blocking())
+
+    async def fail():
+        await login_throttle.off_loop(login_throttle.record_failure, '10.0.0.1', 'manager@example.com')
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(fail())
+    assert threads and loop_thread not in threads
+    assert login_throttle.store.count('email:manager@example.com', 60)[0] == 1
@@ -0,0 +1,178 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Login throttling configuration from environment variables
+LOGIN_THROTTLE_BACKEND = os.getenv('LOGIN_THROTTLE_BACKEND', 'local')
+LOGIN_THROTTLE_URL = os.getenv('LOGIN_THROTTLE_URL', os.getenv('CACHE_URL', 'redis://localhost:6379/0'))
+# Failed attempts allowed per client IP and per email inside their sliding windows
+LOGIN_IP_LIMIT = int(os.getenv('LOGIN_IP_LIMIT', 20))
+LOGIN_IP_WINDOW = float(os.getenv('LOGIN_IP_WINDOW', 300))
+LOGIN_EMAIL_LIMIT = int(os.getenv('LOGIN_EMAIL_LIMIT', 5))
+LOGIN_EMAIL_WINDOW = float(os.getenv('LOGIN_EMAIL_WINDOW', 900))
+# How long an email with no manager account is remembered as unknown
+UNKNOWN_EMAIL_TTL = float(os.getenv('UNKNOWN_EMAIL_TTL', 60))
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv('LOGIN_THROTTLE_MAX_KEYS', 100000))
+
+class MemoryStore:
+    """In-process sliding-window event log, bounded to `max_keys` keys.
+
+    Each gunicorn worker keeps its own counts, so the effective limit is the
+    configured limit times the worker count; use the shared store when that
+    matters.
+    """
+
+    # Calls only take a lock, so coroutines make them on the event loop
+    blocking = False
+
+    def __init__(self, max_keys=LOGIN_THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, key, window, now):
+        events = self._events.get(key)
+        if events is None:
+            return None
+        while events and events[0] <= now - window:
+            events.popleft()
+        if not events:
+            del self._events[key]
+            return None
+        return events
+
+    def add(self, key, window):
+        now = time.monotonic()
+        with self._lock:
+            events = self._prune(key, window, now)
+            if events is None:
+                events = self._events[key] = deque()
+            events.append(now)
+            self._events.move_to_end(key)
+            while len(self._events) > self.max_keys:
+                self._events.popitem(last=False)
+
+    def count(self, key, window):
+        """Return (events in the window, seconds until the oldest one expires)."""
+        now = time.monotonic()
+        with self._lock:
+            events = self._prune(key, window, now)
+            if events is None:
+                return 0, 0
+            return len(events), events[0] + window - now
+
+    def clear(self, key):
+        with self._lock:
+            self._events.pop(key, None)
+
+class SharedStore:
+    """Sliding-window event log in Redis sorted sets, shared by all workers."""
+
+    # Every call is a network round trip, so coroutines make them on a worker thread
+    blocking = True
+
+    def __init__(self, client, prefix='throttle:'):
+        self.client = client
+        self.prefix = prefix
+
+    def add(self, key, window):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.prefix + key, 0, now - window)
+        pipe.zadd(self.prefix + key, {uuid.uuid4().hex: now})
+        pipe.expire(self.prefix + key, max(1, int(window)))
+        pipe.execute()
+
+    def count(self, key, window):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(self.prefix + key, 0, now - window)
+        pipe.zcard(self.prefix + key)
+        pipe.zrange(self.prefix + key, 0, 0, withscores=True)
+        _, count, oldest = pipe.execute()
+        if not count:
+            return 0, 0
+        return count, oldest[0][1] + window - now
+
+    def clear(self, key):
+        self.client.delete(self.prefix + key)
+
+class LoginThrottle:
+    """Failed-login limits per IP and per email, plus a short negative cache of unknown emails.
+
+    Store errors are logged and treated as "not throttled" so an unavailable
+    store never locks everyone out.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    async def off_loop(self, fn, *args):
+        """Await one of the methods below from a coroutine, on a worker thread if the store blocks."""
+        if getattr(self.store, 'blocking', False):
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    def retry_after(self, ip, email):
+        """Seconds the caller must wait before another attempt, or 0 if allowed."""
+        try:
+            wait = 0
+            for key, limit, window in ((f"ip:{ip}", LOGIN_IP_LIMIT, LOGIN_IP_WINDOW),
+                                       (f"email:{email.lower()}", LOGIN_EMAIL_LIMIT, LOGIN_EMAIL_WINDOW)):
+                count, expires_in = self.store.count(key, window)
+                if count >= limit:
+                    wait = max(wait, expires_in)
+            return wait
+        except Exception as e:
+            print(f"Login throttle check failed: {str(e)}")
+            return 0
+
+    def record_failure(self, ip, email):
+        try:
+            self.store.add(f"ip:{ip}", LOGIN_IP_WINDOW)
+            self.store.add(f"email:{email.lower()}", LOGIN_EMAIL_WINDOW)
+        except Exception as e:
+            print(f"Login throttle update failed: {str(e)}")
+
+    def reset(self, email):
+        try:
+            self.store.clear(f"email:{email.lower()}")
+        except Exception as e:
+            print(f"Login throttle reset failed: {str(e)}")
+
+    def is_unknown_email(self, email):
+        try:
+            return self.store.count(f"unknown:{email.lower()}", UNKNOWN_EMAIL_TTL)[0] > 0
+        except Exception as e:
+            print(f"Login throttle check failed: {str(e)}")
+            return False
+
+    def remember_unknown_email(self, email):
+        try:
+            self.store.add(f"unknown:{email.lower()}", UNKNOWN_EMAIL_TTL)
+        except Exception as e:
+            print(f"Login throttle update failed: {str(e)}")
+
+    def forget_unknown_email(self, email):
+        try:
+            self.store.clear(f"unknown:{email.lower()}")
+        except Exception as e:
+            print(f"Login throttle reset failed: {str(e)}")
+
+def create_store():
+    if LOGIN_THROTTLE_BACKEND == 'redis':
+        if redis is None:
+            print("LOGIN_THROTTLE_BACKEND=redis but the redis package is not installed; using the local store")
+            return MemoryStore()
+        return SharedStore(redis.Redis.from_url(LOGIN_THROTTLE_URL))
+    return MemoryStore()
+
+login_throttle = LoginThrottle(create_store())